@@ -0,0 +1,94 @@
+import threading
+import EventLog
+
+logger = EventLog.get_logger(__name__)
+
+class BookFeed:
+    """Sequence-numbered L2 diffs of one stock's book for streaming clients.
+
+    snapshot() returns the full aggregated book, every trader row and the
+    sequence number it is current as of. delta() returns only the price levels
+    and trader rows that changed since the previous delta, tagged with the next
+    sequence number, or None when nothing changed. Levels carry their new
+    absolute quantity (0 removes the level), so applying a diff to a snapshot
+    taken after some of its changes is still correct: a client applies diffs
+    in order on top of its last snapshot and asks for a new snapshot when it
+    sees a gap in the sequence.
+
+    A feed replacing another (say after a market reset) should start at a seq
+    past the old one's, so stale diffs of the old feed are recognized as such
+    and clients that miss the new snapshot see a gap.
+
+    Trader rows carry cash (free plus reserved) and shares rather than a marked
+    value, so a price move does not dirty every row; clients value them at the
+    current price themselves.
+    """
+
+    def __init__(self, exchange, stock_id, user_ids, price_decimals=2, seq=0):
+        self.exchange = exchange
+        self.stock_id = stock_id
+        self.user_ids = list(user_ids)
+        self.price_decimals = price_decimals
+        self.changes = exchange.track_changes(levels=True)
+        self.seq = seq # sequence number of the last delta
+
+        self._lock = threading.Lock()
+        self._tracked_users = set(self.user_ids)
+
+    def snapshot(self):
+        """Full book, summary and trader rows as of the current sequence number."""
+        exchange = self.exchange
+        with self._lock, exchange.book_lock(self.stock_id):
+            book = exchange.get_stock_orders(self.stock_id)
+            return {
+                "seq": self.seq,
+                "summary": self._summary(),
+                "bids": [[price, quantity] for price, quantity, _ in exchange.get_depth(self.stock_id, "bid", len(book["bids"]))],
+                "asks": [[price, quantity] for price, quantity, _ in exchange.get_depth(self.stock_id, "ask", len(book["asks"]))],
+                "users": [row for row in map(self._user_row, self.user_ids) if row is not None],
+            }
+
+    def delta(self):
+        """Levels and trader rows changed since the last delta, or None if nothing changed."""
+        exchange = self.exchange
+        with self._lock:
+            levels = [(side, tick) for stock_id, side, tick in self.changes.drain_levels() if stock_id == self.stock_id]
+            _, dirty_users = self.changes.drain()
+            users = [row for row in map(self._user_row, self._tracked_users.intersection(dirty_users)) if row is not None]
+            if not levels and not users:
+                return None
+
+            bids, asks = [], []
+            with exchange.book_lock(self.stock_id):
+                for side, price, quantity in exchange.get_level_quantities(self.stock_id, levels):
+                    (bids if side == "bid" else asks).append([price, quantity])
+                summary = self._summary()
+            self.seq += 1
+            return {"seq": self.seq, "summary": summary, "bids": bids, "asks": asks, "users": users}
+
+    def _summary(self):
+        """Price, best bid and ask and spread."""
+        exchange = self.exchange
+        decimals = self.price_decimals
+        current_price = exchange.get_stock_price(self.stock_id)
+        lowest_ask = exchange.get_lowest_ask(self.stock_id)
+        highest_bid = exchange.get_highest_bid(self.stock_id)
+        return {
+            "current_price": round(float(current_price), decimals) if current_price else None,
+            "lowest_ask": lowest_ask,
+            "highest_bid": highest_bid,
+            "spread": round(float(lowest_ask - highest_bid), decimals) if (lowest_ask and highest_bid) else None,
+        }
+
+    def _user_row(self, user_id):
+        """[user_id, free balance, cash including reserved, shares including reserved] of one trader."""
+        exchange = self.exchange
+        try:
+            balance = exchange.get_user_balance(user_id)
+            portfolio = exchange.get_user_portfolio(user_id)
+            reserved_balance, reserved_holdings = exchange.get_user_reserved(user_id)
+        except ValueError as user_error:
+            logger.warning("Error getting data for user %s: %s", user_id, user_error)
+            return None
+        shares = portfolio.get(self.stock_id, 0) + reserved_holdings.get(self.stock_id, 0)
+        return [user_id, round(float(balance), 2), round(float(balance + reserved_balance), 2), int(shares)]
@@ -0,0 +1,262 @@
+import threading
+import time
+from datetime import datetime
+import numpy as np
+
+DEFAULT_RESOLUTIONS = (1, 5, 60, 300) # seconds per bar
+
+# Columns of a bar: notional is sum(price * quantity), so VWAP = notional / volume
+OPEN, HIGH, LOW, CLOSE, VOLUME, NOTIONAL = range(6)
+
+class CandleRing:
+    """Closed bars of one resolution in preallocated arrays; the oldest bar is overwritten first."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.starts = np.zeros(capacity, dtype=np.int64) # bar start, epoch seconds
+        self.bars = np.zeros((capacity, 6), dtype=np.float64) # OPEN .. NOTIONAL
+        self.count = 0
+        self.head = 0 # slot the next bar goes to
+
+    def append(self, start, bar):
+        self.starts[self.head] = start
+        self.bars[self.head] = bar
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def last(self, n=None):
+        """(starts, bars) of the newest n bars (default all), oldest first, as copies."""
+        n = self.count if n is None else min(n, self.count)
+        index = (self.head - n + np.arange(n)) % self.capacity
+        return self.starts[index], self.bars[index]
+
+    def range(self, start, end, limit=None):
+        """(starts, bars) of the first limit (default all) bars starting in [start, end), oldest first, as copies of just those bars."""
+        if self.count < self.capacity:
+            segments = [slice(0, self.count)]
+        else:
+            segments = [slice(self.head, self.capacity), slice(0, self.head)]
+        starts, bars = [], []
+        for segment in segments:
+            # Each segment is contiguous and sorted, so this searches in place
+            segment_starts = self.starts[segment]
+            low, high = np.searchsorted(segment_starts, (start, end))
+            if limit is not None:
+                high = min(high, low + limit - sum(map(len, starts)))
+            starts.append(segment_starts[low:high])
+            bars.append(self.bars[segment][low:high])
+        return np.concatenate(starts), np.concatenate(bars)
+
+class _StockCandles:
+    """Rings and in-progress bars of every resolution for one stock."""
+    __slots__ = ("rings", "live", "live_starts")
+
+    def __init__(self, num_resolutions, capacity):
+        self.rings = [CandleRing(capacity) for _ in range(num_resolutions)]
+        self.live = [None] * num_resolutions # in-progress bar per resolution, a list OPEN .. NOTIONAL
+        self.live_starts = [None] * num_resolutions
+
+class CandleAggregator:
+    """OHLCV and VWAP bars at several resolutions, built from fills.
+
+    Register on_trade with StockExchange.add_trade_listener. Each fill only
+    updates the in-progress bar of the finest resolution. When a bar closes
+    (the next fill falls in a later bar) it is stored in that resolution's ring
+    and folded into the in-progress bar of the next coarser resolution, so
+    coarser bars are rolled up from finer ones instead of from every fill.
+    Each resolution must be a multiple of the previous one, and each keeps at
+    most capacity closed bars per stock. Bars exist only for intervals with fills.
+
+    The in-progress bar of a coarse resolution only holds finer bars that have
+    closed; readers merge in the finer in-progress bars, so candles() and
+    latest() are always current to the last fill.
+    """
+
+    def __init__(self, resolutions=DEFAULT_RESOLUTIONS, capacity=1000, clock=time.time):
+        resolutions = tuple(sorted(resolutions))
+        for finer, coarser in zip(resolutions, resolutions[1:]):
+            if coarser % finer:
+                raise ValueError(f"Candle resolution {coarser}s is not a multiple of {finer}s.")
+        self.resolutions = resolutions
+        self._base = resolutions[0]
+        self.capacity = capacity
+        self.clock = clock # source of fill timestamps, epoch seconds
+        self.version = 0 # bumped on every fill
+        self._stocks = {} # stock_id -> _StockCandles
+        self._lock = threading.Lock()
+
+    def on_trade(self, stock_id, price, quantity, buyer_id=None, seller_id=None, aggressor=None, timestamp=None):
+        """Add one fill, timestamped now unless timestamp is given. The counterparties are not needed."""
+        now = self.clock() if timestamp is None else timestamp
+        price = float(price)
+        start = int(now // self._base) * self._base
+        with self._lock:
+            candles = self._stocks.get(stock_id)
+            if candles is None:
+                candles = self._stocks[stock_id] = _StockCandles(len(self.resolutions), self.capacity)
+            bar = candles.live[0]
+            # A fill stamped before the open bar (clock step back) still goes into it
+            if bar is None or start > candles.live_starts[0]:
+                if bar is not None:
+                    self._close(candles, 0)
+                candles.live[0] = [price, price, price, price, quantity, price * quantity]
+                candles.live_starts[0] = start
+            else:
+                if price > bar[HIGH]:
+                    bar[HIGH] = price
+                elif price < bar[LOW]:
+                    bar[LOW] = price
+                bar[CLOSE] = price
+                bar[VOLUME] += quantity
+                bar[NOTIONAL] += price * quantity
+            self.version += 1
+
+    def _close(self, candles, level):
+        """Store the in-progress bar of a resolution and fold it into the next coarser one."""
+        bar, start = candles.live[level], candles.live_starts[level]
+        candles.rings[level].append(start, bar)
+        candles.live[level] = candles.live_starts[level] = None
+        if level + 1 == len(self.resolutions):
+            return
+        coarse = self.resolutions[level + 1]
+        coarse_start = start // coarse * coarse
+        if candles.live[level + 1] is not None and candles.live_starts[level + 1] != coarse_start:
+            self._close(candles, level + 1)
+        if candles.live[level + 1] is None:
+            candles.live[level + 1] = list(bar)
+            candles.live_starts[level + 1] = coarse_start
+        else:
+            _merge(candles.live[level + 1], bar)
+
+    def _pending(self, candles, level):
+        """[(start, bar)] not yet in the ring of a resolution, oldest first, merged from the in-progress bars."""
+        resolution = self.resolutions[level]
+        pending = []
+        # Finer in-progress bars are never older than coarser ones
+        for finer in range(level, -1, -1):
+            bar = candles.live[finer]
+            if bar is None:
+                continue
+            start = candles.live_starts[finer] // resolution * resolution
+            if pending and pending[-1][0] == start:
+                _merge(pending[-1][1], bar)
+            else:
+                pending.append((start, list(bar)))
+        return pending
+
+    def arrays(self, stock_id, resolution, count=None):
+        """(starts, bars) NumPy arrays of the newest count bars (default all kept), oldest first.
+
+        starts are bar start times in epoch seconds; bars has columns OPEN, HIGH,
+        LOW, CLOSE, VOLUME and NOTIONAL. The last bar may still be in progress.
+        """
+        level = self._level(resolution)
+        with self._lock:
+            candles = self._stocks.get(stock_id)
+            if candles is None:
+                return np.zeros(0, dtype=np.int64), np.zeros((0, 6), dtype=np.float64)
+            pending = self._pending(candles, level)
+            closed = None if count is None else max(count - len(pending), 0)
+            starts, bars = candles.rings[level].last(closed)
+        if pending:
+            starts = np.concatenate([starts, [start for start, _ in pending]])
+            bars = np.concatenate([bars, [bar for _, bar in pending]])
+        if count is not None:
+            starts, bars = starts[-count:], bars[-count:]
+        return starts, bars
+
+    def range_arrays(self, stock_id, resolution, start=None, end=None, limit=None):
+        """(starts, bars) of the first limit (default all) bars starting in [start, end) epoch seconds, oldest first; see arrays.
+
+        Found by binary search, so only the bars returned are copied.
+        """
+        level = self._level(resolution)
+        start = np.iinfo(np.int64).min if start is None else start
+        end = np.iinfo(np.int64).max if end is None else end
+        with self._lock:
+            candles = self._stocks.get(stock_id)
+            if candles is None:
+                return np.zeros(0, dtype=np.int64), np.zeros((0, 6), dtype=np.float64)
+            pending = [(bar_start, bar) for bar_start, bar in self._pending(candles, level) if start <= bar_start < end]
+            starts, bars = candles.rings[level].range(start, end, limit)
+        if limit is not None:
+            pending = pending[:limit - len(starts)]
+        if pending:
+            starts = np.concatenate([starts, [bar_start for bar_start, _ in pending]])
+            bars = np.concatenate([bars, [bar for _, bar in pending]])
+        return starts, bars
+
+    def candles(self, stock_id, resolution, count=None):
+        """The newest count bars (default all kept) as dicts, oldest first; see arrays."""
+        return candle_dicts(*self.arrays(stock_id, resolution, count))
+
+    def latest(self, stock_id, resolution):
+        """The newest bar of a resolution as a dict, or None before the first fill."""
+        level = self._level(resolution)
+        with self._lock:
+            candles = self._stocks.get(stock_id)
+            pending = self._pending(candles, level) if candles is not None else []
+            if pending:
+                return _candle_dict(*pending[-1])
+            if candles is None or not candles.rings[level].count:
+                return None
+            starts, bars = candles.rings[level].last(1)
+        return _candle_dict(int(starts[0]), bars[0].tolist())
+
+    def clear(self):
+        with self._lock:
+            self._stocks.clear()
+            self.version += 1
+
+    def _level(self, resolution):
+        try:
+            return self.resolutions.index(resolution)
+        except ValueError:
+            raise ValueError(f"No {resolution}s candles; resolutions are {self.resolutions}.") from None
+
+def downsample(starts, bars, max_points):
+    """Merge runs of consecutive bars so at most max_points remain.
+
+    Each merged bar takes the first open, the highest high, the lowest low, the
+    last close and the summed volume and notional of its run, so highs, lows and
+    total volume survive downsampling and VWAP stays exact. Returns (starts,
+    bars) unchanged if there are already few enough.
+    """
+    if len(starts) <= max_points:
+        return starts, bars
+    size = -(-len(starts) // max_points) # bars per merged bar, rounded up
+    first = np.arange(0, len(starts), size)
+    last = np.minimum(first + size, len(starts)) - 1
+    merged = np.empty((len(first), 6), dtype=np.float64)
+    merged[:, OPEN] = bars[first, OPEN]
+    merged[:, HIGH] = np.maximum.reduceat(bars[:, HIGH], first)
+    merged[:, LOW] = np.minimum.reduceat(bars[:, LOW], first)
+    merged[:, CLOSE] = bars[last, CLOSE]
+    merged[:, VOLUME] = np.add.reduceat(bars[:, VOLUME], first)
+    merged[:, NOTIONAL] = np.add.reduceat(bars[:, NOTIONAL], first)
+    return starts[first], merged
+
+def _merge(bar, other):
+    """Extend bar in place with a later bar."""
+    bar[HIGH] = max(bar[HIGH], other[HIGH])
+    bar[LOW] = min(bar[LOW], other[LOW])
+    bar[CLOSE] = other[CLOSE]
+    bar[VOLUME] += other[VOLUME]
+    bar[NOTIONAL] += other[NOTIONAL]
+
+def candle_dicts(starts, bars):
+    """Bars from arrays/range_arrays/downsample as candle dicts."""
+    return [_candle_dict(start, bar) for start, bar in zip(starts.tolist(), bars.tolist())]
+
+def _candle_dict(start, bar):
+    """A bar in the visualizer's candle format, plus volume and VWAP."""
+    volume = bar[VOLUME]
+    return {
+        "timestamp": datetime.fromtimestamp(start).isoformat(),
+        "open": bar[OPEN],
+        "high": bar[HIGH],
+        "low": bar[LOW],
+        "close": bar[CLOSE],
+        "volume": int(volume),
+        "vwap": bar[NOTIONAL] / volume if volume else bar[CLOSE],
+    }
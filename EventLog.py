@@ -0,0 +1,218 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+DEBUG, INFO, WARNING, ERROR = logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR
+
+_STOP = object() # queued by LogWriter.close to end the writer thread
+
+class Logger:
+    """Structured logger for the exchange's own modules; get one with get_logger(__name__).
+
+    logger.info("Trader %s bought %s", trader_id, quantity, order_id=order_id)
+    queues the message, its arguments and the keyword fields as one tuple,
+    skipping the logging.LogRecord the standard library would build on the
+    caller's thread; the LogWriter formats it on its own. A call below the
+    configured level returns after one comparison. Until configure() is
+    called, records go through the standard logging module instead, so
+    warnings and errors still reach stderr.
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def enabled_for(self, level):
+        """Whether a record at level would be written; check it before building costly arguments."""
+        return level >= _level
+
+    def debug(self, message, *args, **fields):
+        if DEBUG >= _level:
+            self._log(DEBUG, message, args, fields)
+
+    def info(self, message, *args, **fields):
+        if INFO >= _level:
+            self._log(INFO, message, args, fields)
+
+    def warning(self, message, *args, **fields):
+        if WARNING >= _level:
+            self._log(WARNING, message, args, fields)
+
+    def error(self, message, *args, **fields):
+        if ERROR >= _level:
+            self._log(ERROR, message, args, fields)
+
+    def exception(self, message, *args, **fields):
+        """Log at ERROR with the exception being handled."""
+        if ERROR >= _level:
+            self._log(ERROR, message, args, fields, sys.exc_info())
+
+    def _log(self, level, message, args, fields, exc_info=None):
+        writer = _writer
+        if writer is not None:
+            writer.queue.put((time.time(), level, self.name, message, args, fields, exc_info))
+        else:
+            logging.getLogger(self.name).log(level, message, *args, exc_info=exc_info, extra={"fields": fields})
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Hands standard logging records (Flask, werkzeug, ...) to the writer as they are."""
+
+    def prepare(self, record):
+        # The stock prepare() renders the message on the calling thread so the
+        # record can be pickled; the queue never leaves the process
+        return record
+
+class LogWriter:
+    """Background thread that drains log records from a queue and writes them in batches.
+
+    Records are Logger tuples or standard logging records. Each becomes a
+    structured entry: time, level, logger, message, its fields and the
+    formatted exception, if any. Every record waiting in the queue is written
+    with one write() and one flush per destination: JSON lines appended to
+    path, a human-readable line on stderr with console set, and the entry
+    itself kept in a ring of the newest ring_size entries (see recent).
+    """
+
+    def __init__(self, path=None, console=True, ring_size=1000, batch_size=256):
+        self.queue = queue.SimpleQueue()
+        self.path = path
+        self.console = console
+        self.batch_size = batch_size
+        self.ring = deque(maxlen=ring_size) # newest entries, oldest first
+        self.records_written = 0
+        self.batches_written = 0
+        self._file = open(path, "a", encoding="utf-8") if path else None
+        self._formatter = logging.Formatter()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(record is _STOP for record in batch)
+            self._write([record for record in batch if record is not _STOP])
+            if stop:
+                return
+
+    def _write(self, records):
+        if not records:
+            return
+        lines, console_lines = [], []
+        for record in records:
+            entry = self._entry(record)
+            self.ring.append(entry)
+            if self._file is not None:
+                lines.append(json.dumps(entry, default=str))
+            if self.console:
+                console_lines.append(self._console_line(entry))
+        try:
+            if lines:
+                self._file.write("\n".join(lines) + "\n")
+                self._file.flush()
+            if console_lines:
+                sys.stderr.write("\n".join(console_lines) + "\n")
+                sys.stderr.flush()
+        except (OSError, ValueError) as write_error:
+            sys.stderr.write(f"Error writing log records: {write_error}\n")
+        self.records_written += len(records)
+        self.batches_written += 1
+
+    def _entry(self, record):
+        if isinstance(record, logging.LogRecord):
+            created, level, name, message, args = record.created, record.levelno, record.name, record.msg, record.args
+            fields, exc_info = getattr(record, "fields", None), record.exc_info
+        else:
+            created, level, name, message, args, fields, exc_info = record
+        try:
+            message = str(message) % args if args else str(message)
+        except Exception as format_error: # a bad format string must not kill the writer
+            message = f"{message!r} % {args!r} (unformattable: {format_error})"
+        entry = {"time": created, "level": logging.getLevelName(level), "logger": name, "message": message}
+        if fields:
+            entry.update(fields)
+        if exc_info:
+            entry["exception"] = self._formatter.formatException(exc_info)
+        return entry
+
+    def _console_line(self, entry):
+        fields = " ".join(f"{key}={value}" for key, value in entry.items()
+                          if key not in ("time", "level", "logger", "message", "exception"))
+        line = f"{time.strftime('%H:%M:%S', time.localtime(entry['time']))} {entry['level']:<7} {entry['logger']}: {entry['message']}"
+        if fields:
+            line += f" [{fields}]"
+        if "exception" in entry:
+            line += "\n" + entry["exception"]
+        return line
+
+    def close(self):
+        """Write everything queued so far, then stop the thread and close the file."""
+        self.queue.put(_STOP)
+        self._thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+_level = WARNING # lowest level a Logger records
+_writer = None
+_handler = None
+_configure_lock = threading.Lock()
+
+def get_logger(name):
+    return Logger(name)
+
+def configure(level="INFO", path=None, console=True, ring_size=1000, batch_size=256):
+    """Send every record at level or above, from Loggers and from standard logging, through a new LogWriter.
+
+    Replaces any earlier writer. Returns the writer.
+    """
+    global _level, _writer, _handler
+    with _configure_lock:
+        _close()
+        _writer = LogWriter(path=path, console=console, ring_size=ring_size, batch_size=batch_size)
+        _handler = _QueueHandler(_writer.queue)
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(level)
+        _level = root.level
+        return _writer
+
+def recent(count=100, level=None):
+    """The newest count entries written (oldest first), optionally only those at level or above."""
+    if _writer is None:
+        return []
+    entries = list(_writer.ring)
+    if level is not None:
+        threshold = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+        if not isinstance(threshold, int):
+            raise ValueError(f"Unknown log level {level!r}.")
+        entries = [entry for entry in entries if logging.getLevelName(entry["level"]) >= threshold]
+    return entries[-count:] if count > 0 else []
+
+def shutdown():
+    """Flush and stop the writer; until configure is called again, records go through the standard logging module."""
+    global _level
+    with _configure_lock:
+        _close()
+        _level = WARNING
+
+def _close():
+    global _writer, _handler
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+atexit.register(shutdown)
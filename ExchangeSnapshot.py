@@ -0,0 +1,69 @@
+import json
+import mmap
+import struct
+import numpy as np
+
+MAGIC = b"SXS1"
+HEADER = struct.Struct("<4sI") # magic, header JSON length
+ALIGNMENT = 64 # sections start on 64-byte boundaries so they can be viewed in place
+
+# One row per resting order, in book order: stock, side, ascending tick, time priority
+ORDER_DTYPE = np.dtype([
+    ("order_id", "<i8"),
+    ("stock", "<i4"), # index into the header's stocks
+    ("user", "<i4"), # index into the header's users
+    ("side", "i1"), # 0 = bid, 1 = ask
+    ("tick", "<i8"),
+    ("quantity", "<i8"),
+])
+
+def encode(header, arrays):
+    """Pack a JSON-serializable header and named NumPy arrays into snapshot bytes.
+
+    The header is stored with a "sections" entry giving each array's dtype,
+    shape and byte offset.
+    """
+    sections = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        dtype = "orders" if array.dtype == ORDER_DTYPE else array.dtype.str
+        sections[name] = {"dtype": dtype, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    header = dict(header, sections=sections)
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = -(-(HEADER.size + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    out = bytearray(data_start + offset)
+    HEADER.pack_into(out, 0, MAGIC, len(header_bytes))
+    out[HEADER.size:HEADER.size + len(header_bytes)] = header_bytes
+    for name, array in arrays.items():
+        start = data_start + sections[name]["offset"]
+        out[start:start + array.nbytes] = np.ascontiguousarray(array).tobytes()
+    return bytes(out)
+
+def decode(source):
+    """Return (header, arrays) from snapshot bytes or a snapshot file path.
+
+    Files are memory-mapped and the arrays are read-only views into the
+    mapping (or into the bytes), so nothing is copied until the caller does.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        buffer = source
+    else:
+        with open(source, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, header_length = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a StockExchange snapshot.")
+    header = json.loads(bytes(buffer[HEADER.size:HEADER.size + header_length]))
+    data_start = -(-(HEADER.size + header_length) // ALIGNMENT) * ALIGNMENT
+
+    arrays = {}
+    for name, section in header.pop("sections").items():
+        dtype = ORDER_DTYPE if section["dtype"] == "orders" else np.dtype(section["dtype"])
+        shape = tuple(section["shape"])
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                     offset=data_start + section["offset"]).reshape(shape)
+    return header, arrays
@@ -0,0 +1,262 @@
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+from PriceLadder import LADDERS
+
+MAGIC = b"SXJ1"
+
+# fsync policies
+FSYNC_ALWAYS = "always" # fsync after every group commit
+FSYNC_INTERVAL = "interval" # fsync at most once per fsync_interval seconds
+FSYNC_NEVER = "never" # leave flushing to the operating system
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+# Record kinds
+SYMBOL, IPO, ADD_USER, ORDER, CANCEL, AMEND, TRANSFER_STOCK, TRANSFER_MONEY, ORDERS = range(9)
+
+# Fixed little-endian layout per record kind, starting with the kind byte.
+# Stock IDs are written as indices into the journal's symbol table.
+RECORDS = {
+    SYMBOL: struct.Struct("<BH32s"), # index, utf-8 stock ID
+    IPO: struct.Struct("<BHqddB"), # stock, quantity, price, tick_size, ladder
+    ADD_USER: struct.Struct("<Bqd"), # user, initial_balance
+    ORDER: struct.Struct("<BHqBBqd"), # stock, user, side, type, quantity, price (NaN for market)
+    CANCEL: struct.Struct("<Bq"), # order_id
+    AMEND: struct.Struct("<Bqq"), # order_id, new_qty
+    TRANSFER_STOCK: struct.Struct("<BqqHq"), # from_user, to_user, stock, quantity
+    TRANSFER_MONEY: struct.Struct("<Bqqd"), # from_user, to_user, amount
+    ORDERS: struct.Struct("<BI"), # count; a place_orders batch, its rows follow as ORDER records
+}
+
+# Each group commit is written as one frame: payload length, CRC32, records
+FRAME = struct.Struct("<II")
+
+LADDER_NAMES = list(LADDERS)
+SIDES = ("bid", "ask")
+ORDER_TYPES = ("market", "limit")
+SIDE_CODES = {name: code for code, name in enumerate(SIDES)}
+ORDER_TYPE_CODES = {name: code for code, name in enumerate(ORDER_TYPES)}
+
+class Journal:
+    """Append-only binary journal of accepted StockExchange commands.
+
+    Records are buffered and written in group commits: a commit happens when
+    group_size records are pending, when group_interval seconds have passed
+    since the first pending record, or on commit()/close(). Each commit is one
+    CRC-checked frame, so a crash loses at most the uncommitted tail and a torn
+    final frame is discarded on recovery. fsync is one of FSYNC_POLICIES.
+
+    Opening an existing journal recovers its symbol table, truncates any torn
+    tail and appends after the last complete frame. User IDs must be integers.
+    """
+
+    def __init__(self, path, fsync=FSYNC_ALWAYS, group_size=1024, group_interval=0.05, fsync_interval=1.0, truncate=False):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}.")
+        if group_size <= 0:
+            raise ValueError("group_size must be greater than zero.")
+        self.path = path
+        self.fsync = fsync
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.fsync_interval = fsync_interval
+        self.symbols = {} # stock_id -> symbol index
+        self.records = 0 # records appended through this Journal
+        self.commits = 0
+
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._pending = 0 # records in _buffer
+        self._group_started = 0.0
+        self._last_fsync = time.monotonic()
+
+        if truncate or not os.path.exists(path) or os.path.getsize(path) == 0:
+            self._file = open(path, "wb")
+            self._file.write(MAGIC)
+            self._file.flush()
+        else:
+            end = 0
+            for end, kind, fields in _read_frames(path):
+                if kind == SYMBOL:
+                    self.symbols[fields[1]] = fields[0]
+            self._file = open(path, "r+b")
+            self._file.truncate(max(end, len(MAGIC)))
+            self._file.seek(0, os.SEEK_END)
+
+    def _append(self, kind, *fields):
+        with self._lock:
+            self._append_locked(kind, *fields)
+
+    def _append_locked(self, kind, *fields):
+        """Buffer one record, committing the group if it is full or old enough. Caller holds the lock."""
+        self._buffer_locked(RECORDS[kind].pack(kind, *fields), 1)
+
+    def _buffer_locked(self, data, records):
+        """Buffer packed records, committing the group if it is full or old enough. Caller holds the lock."""
+        if self._file.closed:
+            raise ValueError("Cannot record to a closed journal.")
+        now = time.monotonic()
+        if not self._pending:
+            self._group_started = now
+        self._buffer += data
+        self._pending += records
+        self.records += records
+        if self._pending >= self.group_size or now - self._group_started >= self.group_interval:
+            self._commit()
+
+    def _symbol_locked(self, stock_id):
+        """Symbol index for a stock ID, buffering a SYMBOL record the first time it is seen. Caller holds the lock.
+
+        Callers reach the journal under different exchange locks, so the index
+        is allocated, and its SYMBOL record buffered ahead of any record using
+        it, under the journal's own lock.
+        """
+        index = self.symbols.get(stock_id)
+        if index is None:
+            name = str(stock_id).encode("utf-8")
+            if len(name) > 32:
+                raise ValueError("Stock IDs longer than 32 bytes cannot be journaled.")
+            index = self.symbols[stock_id] = len(self.symbols)
+            self._append_locked(SYMBOL, index, name)
+        return index
+
+    def record_ipo(self, stock_id, quantity, price, tick_size, ladder):
+        with self._lock:
+            self._append_locked(IPO, self._symbol_locked(stock_id), quantity, price, tick_size, LADDER_NAMES.index(ladder))
+
+    def record_add_user(self, user_id, initial_balance):
+        self._append(ADD_USER, user_id, initial_balance)
+
+    def record_order(self, stock_id, user_id, bid_or_ask, order_type, quantity, order_price):
+        price = math.nan if order_price is None else order_price
+        with self._lock:
+            self._append_locked(ORDER, self._symbol_locked(stock_id), user_id, SIDE_CODES[bid_or_ask],
+                                ORDER_TYPE_CODES[order_type], quantity, price)
+
+    def record_orders(self, stock_ids, user_ids, sides, order_types, quantities, prices):
+        """Record a place_orders batch from its columns (sides and order types as names).
+
+        The batch is written as one ORDERS record and its rows, in the same
+        group commit, and replays as a place_orders call so it gets the same
+        block of order IDs.
+        """
+        order = RECORDS[ORDER].pack
+        with self._lock:
+            symbols = {stock_id: self._symbol_locked(stock_id) for stock_id in set(stock_ids)}
+            data = bytearray(RECORDS[ORDERS].pack(ORDERS, len(stock_ids)))
+            for stock_id, user_id, side, order_type, quantity, price in zip(stock_ids, user_ids, sides, order_types, quantities, prices):
+                data += order(ORDER, symbols[stock_id], user_id, SIDE_CODES[side], ORDER_TYPE_CODES[order_type],
+                              quantity, math.nan if price is None else price)
+            self._buffer_locked(data, len(stock_ids) + 1)
+
+    def record_cancel(self, order_id):
+        self._append(CANCEL, order_id)
+
+    def record_amend(self, order_id, new_qty):
+        self._append(AMEND, order_id, new_qty)
+
+    def record_transfer_stock(self, from_user_id, to_user_id, stock_id, quantity):
+        with self._lock:
+            self._append_locked(TRANSFER_STOCK, from_user_id, to_user_id, self._symbol_locked(stock_id), quantity)
+
+    def record_transfer_money(self, from_user_id, to_user_id, amount):
+        self._append(TRANSFER_MONEY, from_user_id, to_user_id, amount)
+
+    def commit(self):
+        """Write all pending records as one frame and apply the fsync policy."""
+        with self._lock:
+            self._commit()
+
+    def _commit(self):
+        if self._pending:
+            payload = bytes(self._buffer)
+            self._file.write(FRAME.pack(len(payload), zlib.crc32(payload)))
+            self._file.write(payload)
+            self._buffer.clear()
+            self._pending = 0
+            self.commits += 1
+        self._file.flush()
+        if self.fsync == FSYNC_ALWAYS:
+            os.fsync(self._file.fileno())
+        elif self.fsync == FSYNC_INTERVAL:
+            now = time.monotonic()
+            if now - self._last_fsync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._last_fsync = now
+
+    def close(self):
+        """Commit pending records, fsync unless the policy is FSYNC_NEVER, and close the file."""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._commit()
+            if self.fsync == FSYNC_INTERVAL:
+                os.fsync(self._file.fileno())
+            self._file.close()
+
+def _read_frames(path):
+    """Yield (frame_end_offset, kind, fields) for every record in complete frames."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a StockExchange journal.")
+    offset = len(MAGIC)
+    while offset + FRAME.size <= len(data):
+        length, crc = FRAME.unpack_from(data, offset)
+        start = offset + FRAME.size
+        end = start + length
+        if end > len(data) or zlib.crc32(data[start:end]) != crc:
+            break # torn or corrupt tail
+        position = start
+        while position < end:
+            record = RECORDS[data[position]]
+            fields = record.unpack_from(data, position)[1:]
+            if data[position] == SYMBOL:
+                fields = (fields[0], fields[1].rstrip(b"\0").decode("utf-8"))
+            yield end, data[position], fields
+            position += record.size
+        offset = end
+
+def read_journal(path):
+    """Yield (method_name, args) StockExchange calls that reproduce a journal.
+
+    Only complete frames are read; a torn or corrupt tail is ignored.
+    """
+    stock_ids = {} # symbol index -> stock_id
+    batch = None # columns of the place_orders batch being read
+    batch_rows = 0 # its rows still to come
+    for _, kind, fields in _read_frames(path):
+        if kind == SYMBOL:
+            stock_ids[fields[0]] = fields[1]
+        elif kind == IPO:
+            stock, quantity, price, tick_size, ladder = fields
+            yield "ipo_stock", (stock_ids[stock], quantity, price, tick_size, LADDER_NAMES[ladder])
+        elif kind == ADD_USER:
+            yield "add_user", fields
+        elif kind == ORDER:
+            stock, user_id, side, order_type, quantity, price = fields
+            row = (stock_ids[stock], user_id, SIDES[side], ORDER_TYPES[order_type], quantity, None if math.isnan(price) else price)
+            if batch is None:
+                yield "place_order", row
+                continue
+            for column, field in zip(batch.values(), row):
+                column.append(field)
+            batch_rows -= 1
+            if not batch_rows:
+                yield "place_orders", (batch,)
+                batch = None
+        elif kind == ORDERS:
+            batch_rows = fields[0]
+            batch = {"stock": [], "user": [], "side": [], "type": [], "qty": [], "price": []}
+        elif kind == CANCEL:
+            yield "cancel_order", fields
+        elif kind == AMEND:
+            yield "amend_order", fields
+        elif kind == TRANSFER_STOCK:
+            from_user_id, to_user_id, stock, quantity = fields
+            yield "transfer_stock", (from_user_id, to_user_id, stock_ids[stock], quantity)
+        elif kind == TRANSFER_MONEY:
+            yield "transfer_money", fields
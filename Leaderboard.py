@@ -0,0 +1,187 @@
+import threading
+from itertools import islice
+import numpy as np
+from sortedcontainers import SortedList
+import EventLog
+
+logger = EventLog.get_logger(__name__)
+
+class Leaderboard:
+    """Traders ranked by total value: cash plus holdings at the latest prices.
+
+    Cash and holdings include what is reserved behind resting orders. update()
+    drains a ChangeSet and re-reads only the traders touched since the last
+    update, re-ranking each in a SortedList in O(log n).
+
+    Marking to market is lazy. Ranks are keyed on values at a mark price per
+    stock, and a price move alone does not touch the ranking until some price
+    has drifted more than remark_threshold (relative) from its mark. Then every
+    key is recomputed and sorted in one vectorized pass. Meanwhile no value can
+    be further from its key than the largest holding of each stock times that
+    stock's drift, so board() scans in from each end of the ranking only until
+    no trader further in could have overtaken the ones it has, and is exact at
+    the latest prices. page() ranks by the keys but values at the latest prices.
+
+    Only update() reads the exchange; page() and board() serve from the
+    leaderboard's own state.
+    """
+
+    def __init__(self, exchange, user_ids, remark_threshold=0.01):
+        self.exchange = exchange
+        self.user_ids = list(user_ids)
+        self.remark_threshold = remark_threshold
+        self.changes = exchange.track_changes()
+        self.remarks = 0 # full re-marks so far
+
+        self._lock = threading.Lock()
+        self._rows = {user_id: row for row, user_id in enumerate(self.user_ids)}
+        self._cash = np.zeros(len(self.user_ids), dtype=np.float64)
+        self._shares = np.zeros((len(self.user_ids), 0), dtype=np.int64) # users x stock columns
+        self._max_shares = np.zeros(0, dtype=np.int64) # bound on each column of _shares
+        self._columns = {} # stock_id -> column of _shares
+        self._stock_ids = [] # column -> stock_id
+        self._marks = np.zeros(0, dtype=np.float64) # price each column's keys are valued at
+        self._prices = np.zeros(0, dtype=np.float64) # latest price of each column
+        self._keys = [0.0] * len(self.user_ids) # value at the marks, per row
+        self._ranked = SortedList() # (key, row), lowest first
+
+        with self._lock:
+            self.changes.drain()
+            for row, user_id in enumerate(self.user_ids):
+                self._read_user(row, user_id)
+            self._read_prices()
+            self._remark()
+
+    def update(self):
+        """Re-read the traders touched since the last update and the latest prices, then re-rank."""
+        with self._lock:
+            _, dirty_users = self.changes.drain()
+            rows = [self._rows[user_id] for user_id in dirty_users if user_id in self._rows]
+            for row in rows:
+                self._read_user(row, self.user_ids[row])
+            self._read_prices()
+            # A new stock, or a first price for one, counts as drifted too
+            if len(self._marks) != len(self._prices) or \
+                    (np.abs(self._prices - self._marks) > self.remark_threshold * self._marks).any() or \
+                    ((self._marks == 0) & (self._prices != 0)).any():
+                self._remark()
+                return
+            for row in rows:
+                self._rekey(row)
+
+    def _read_user(self, row, user_id):
+        """Refresh one trader's cash and holdings from the exchange."""
+        exchange = self.exchange
+        try:
+            balance = exchange.get_user_balance(user_id)
+            portfolio = exchange.get_user_portfolio(user_id)
+            reserved_balance, reserved_holdings = exchange.get_user_reserved(user_id)
+        except ValueError as user_error:
+            logger.warning("Error getting data for user %s: %s", user_id, user_error)
+            return
+        self._cash[row] = balance + reserved_balance
+        self._shares[row] = 0
+        for holdings in (portfolio, reserved_holdings):
+            for stock_id, quantity in holdings.items():
+                column = self._column(stock_id) # may grow _shares, so look it up first
+                self._shares[row, column] += quantity
+        np.maximum(self._max_shares, self._shares[row], out=self._max_shares)
+
+    def _column(self, stock_id):
+        """Column of a stock in _shares, adding one for a stock not seen before."""
+        column = self._columns.get(stock_id)
+        if column is None:
+            column = self._columns[stock_id] = len(self._stock_ids)
+            self._stock_ids.append(stock_id)
+            self._shares = np.hstack([self._shares, np.zeros((len(self.user_ids), 1), dtype=np.int64)])
+            self._max_shares = np.append(self._max_shares, 0)
+            self._prices = np.append(self._prices, 0.0)
+        return column
+
+    def _read_prices(self):
+        """Latest price of every stock held; a stock with no price keeps its last one."""
+        for column, stock_id in enumerate(self._stock_ids):
+            price = self.exchange.get_stock_price(stock_id)
+            if price is not None:
+                self._prices[column] = price
+
+    def _remark(self):
+        """Move every mark to the latest price and re-rank everyone, vectorized."""
+        self._marks = self._prices.copy()
+        self._max_shares = self._shares.max(axis=0, initial=0)
+        keys = self._cash + self._shares @ self._marks
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys.tolist()
+        # Already in order, so building the list only checks it
+        self._ranked = SortedList(zip(keys[order].tolist(), order.tolist()))
+        self.remarks += 1
+
+    def _rekey(self, row):
+        """Re-rank one trader at the current marks."""
+        self._ranked.remove((self._keys[row], row))
+        self._keys[row] = float(self._cash[row] + self._shares[row] @ self._marks)
+        self._ranked.add((self._keys[row], row))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def _value(self, row):
+        return float(self._cash[row] + self._shares[row] @ self._prices)
+
+    def page(self, offset=0, limit=10):
+        """Traders ranked offset+1 to offset+limit by descending value, as dicts."""
+        with self._lock:
+            ranked = self._ranked
+            end = len(ranked) - offset
+            entries = list(ranked.islice(max(end - max(limit, 0), 0), max(end, 0), reverse=True))
+            page = []
+            for rank, (_, row) in enumerate(entries, start=offset + 1):
+                page.append({
+                    "rank": rank,
+                    "user_id": self.user_ids[row],
+                    "total_value": round(self._value(row), 2),
+                    "cash": round(float(self._cash[row]), 2),
+                    "holdings": {stock_id: int(quantity) for stock_id, quantity in zip(self._stock_ids, self._shares[row].tolist()) if quantity},
+                })
+            return page
+
+    def board(self, size, stock_id):
+        """(top, bottom): the size most and least valuable traders as [user_id, total_value, cash, shares of stock_id] rows.
+
+        top is in descending and bottom in ascending order of value, at the
+        latest prices; a trader is never in both.
+        """
+        with self._lock:
+            ranked = self._ranked
+            size = min(size, len(ranked))
+            # Most any value can have moved since its key was taken
+            slack = float(self._max_shares @ np.abs(self._prices - self._marks))
+            top = self._best(ranked.islice(reverse=True), size, slack, 1)
+            shown = {row for _, row in top}
+            bottom = self._best((entry for entry in ranked if entry[1] not in shown), min(size, len(ranked) - size), slack, -1)
+            column = self._columns.get(stock_id)
+
+            def board_row(value, row):
+                shares = int(self._shares[row, column]) if column is not None else 0
+                return [self.user_ids[row], round(value, 2), round(float(self._cash[row]), 2), shares]
+            return [board_row(value, row) for value, row in top], [board_row(value, row) for value, row in bottom]
+
+    def _best(self, entries, size, slack, sign):
+        """[(value, row)] of the size highest (sign 1) or lowest (sign -1) values, best first, from (key, row) entries best key first."""
+        if size <= 0:
+            return []
+        entries = iter(entries)
+        rows = []
+        chunk = 2 * size
+        while True:
+            taken = list(islice(entries, chunk))
+            rows.extend(row for _, row in taken)
+            values = sign * (self._cash[rows] + self._shares[rows] @ self._prices)
+            if len(taken) < chunk:
+                break
+            # Values are within slack of their keys, so nobody further in can beat the size-th best
+            if sign * taken[-1][0] + slack < np.partition(values, len(values) - size)[len(values) - size]:
+                break
+            chunk *= 2
+        best = np.argsort(-values, kind="stable")[:size]
+        return [(sign * float(values[index]), rows[index]) for index in best.tolist()]
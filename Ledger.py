@@ -0,0 +1,221 @@
+from collections.abc import MutableMapping
+import numpy as np
+
+class ArrayLedger:
+    """Compact user ledger backed by NumPy arrays.
+
+    User IDs and stock IDs are mapped to dense row and column indices. Balances
+    live in 1-D float arrays and holdings in 2-D users x stocks integer arrays,
+    so there is no per-user dict and nothing is created or deleted on a fill.
+    The exchange talks to it through the dict-like views returned by
+    balance_view and holdings_view; vectorized queries read the arrays directly.
+    """
+
+    def __init__(self, user_capacity=1024, stock_capacity=4):
+        self.user_index = {} # user_id -> row
+        self.user_ids = [] # row -> user_id
+        self.stock_index = {} # stock_id -> column
+        self.stock_ids = [] # column -> stock_id
+        self.balances = np.zeros(user_capacity, dtype=np.float64)
+        self.reserved_balances = np.zeros(user_capacity, dtype=np.float64)
+        self.holdings = np.zeros((user_capacity, stock_capacity), dtype=np.int64)
+        self.reserved_holdings = np.zeros((user_capacity, stock_capacity), dtype=np.int64)
+
+    @property
+    def num_users(self):
+        return len(self.user_ids)
+
+    @property
+    def num_stocks(self):
+        return len(self.stock_ids)
+
+    def add_user(self, user_id):
+        """Assign the next row to a user, growing the arrays if needed."""
+        row = self.user_index.get(user_id)
+        if row is not None:
+            return row
+        row = len(self.user_ids)
+        if row == len(self.balances):
+            self._resize(2 * row, self.holdings.shape[1])
+        self.user_index[user_id] = row
+        self.user_ids.append(user_id)
+        return row
+
+    def add_stock(self, stock_id):
+        """Assign the next column to a stock, growing the arrays if needed."""
+        column = self.stock_index.get(stock_id)
+        if column is not None:
+            return column
+        column = len(self.stock_ids)
+        if column == self.holdings.shape[1]:
+            self._resize(len(self.balances), 2 * column)
+        self.stock_index[stock_id] = column
+        self.stock_ids.append(stock_id)
+        return column
+
+    def _resize(self, user_capacity, stock_capacity):
+        """Reallocate the arrays with new capacities, keeping existing rows."""
+        users, stocks = self.num_users, self.num_stocks
+        for name in ("balances", "reserved_balances"):
+            old = getattr(self, name)
+            new = np.zeros(user_capacity, dtype=old.dtype)
+            new[:users] = old[:users]
+            setattr(self, name, new)
+        for name in ("holdings", "reserved_holdings"):
+            old = getattr(self, name)
+            new = np.zeros((user_capacity, stock_capacity), dtype=old.dtype)
+            new[:users, :stocks] = old[:users, :stocks]
+            setattr(self, name, new)
+
+    def load(self, user_ids, stock_ids, balances, reserved_balances, holdings, reserved_holdings):
+        """Replace the whole ledger with copies of the given arrays, in row/column order."""
+        self.user_ids = list(user_ids)
+        self.user_index = {user_id: row for row, user_id in enumerate(self.user_ids)}
+        self.stock_ids = list(stock_ids)
+        self.stock_index = {stock_id: column for column, stock_id in enumerate(self.stock_ids)}
+        user_capacity = max(len(self.user_ids), len(self.balances))
+        stock_capacity = max(len(self.stock_ids), self.holdings.shape[1])
+        self.balances = np.zeros(user_capacity, dtype=np.float64)
+        self.reserved_balances = np.zeros(user_capacity, dtype=np.float64)
+        self.holdings = np.zeros((user_capacity, stock_capacity), dtype=np.int64)
+        self.reserved_holdings = np.zeros((user_capacity, stock_capacity), dtype=np.int64)
+        users, stocks = self.num_users, self.num_stocks
+        self.balances[:users] = balances
+        self.reserved_balances[:users] = reserved_balances
+        self.holdings[:users, :stocks] = holdings
+        self.reserved_holdings[:users, :stocks] = reserved_holdings
+
+    def rows(self, user_ids):
+        """Row indices for a sequence of user IDs."""
+        index = self.user_index
+        try:
+            return np.fromiter((index[user_id] for user_id in user_ids), dtype=np.intp, count=len(user_ids))
+        except KeyError:
+            raise ValueError("User does not exist.")
+
+    def balance_view(self, name):
+        """Dict-like user_id -> amount view of one balance array."""
+        return BalanceView(self, name)
+
+    def holdings_view(self, name):
+        """Dict-like user_id -> {stock_id: quantity} view of one holdings array."""
+        return HoldingsView(self, name)
+
+    # Vectorized queries
+
+    def total_money(self):
+        """Free plus reserved money across all users."""
+        users = self.num_users
+        return float(self.balances[:users].sum() + self.reserved_balances[:users].sum())
+
+    def share_totals(self):
+        """Free plus reserved shares per stock, as {stock_id: total}."""
+        users, stocks = self.num_users, self.num_stocks
+        totals = self.holdings[:users, :stocks].sum(axis=0) + self.reserved_holdings[:users, :stocks].sum(axis=0)
+        return {stock_id: int(total) for stock_id, total in zip(self.stock_ids, totals)}
+
+    def mark_to_market(self, prices, rows=None):
+        """Cash plus holdings valued at prices (one per stock column) for each row."""
+        users, stocks = self.num_users, self.num_stocks
+        if rows is None:
+            rows = slice(0, users)
+        cash = self.balances[rows] + self.reserved_balances[rows]
+        shares = self.holdings[rows, :stocks] + self.reserved_holdings[rows, :stocks]
+        return cash + shares @ np.asarray(prices, dtype=np.float64)
+
+class BalanceView(MutableMapping):
+    """user_id -> amount mapping over one of an ArrayLedger's balance arrays."""
+
+    def __init__(self, ledger, name):
+        self.ledger = ledger
+        self.name = name
+
+    def __getitem__(self, user_id):
+        return getattr(self.ledger, self.name)[self.ledger.user_index[user_id]].item()
+
+    def __setitem__(self, user_id, amount):
+        row = self.ledger.add_user(user_id)
+        getattr(self.ledger, self.name)[row] = amount
+
+    def __delitem__(self, user_id):
+        raise TypeError("Users cannot be removed from an ArrayLedger.")
+
+    def __contains__(self, user_id):
+        return user_id in self.ledger.user_index
+
+    def __iter__(self):
+        return iter(self.ledger.user_ids)
+
+    def __len__(self):
+        return self.ledger.num_users
+
+class HoldingsView(MutableMapping):
+    """user_id -> HoldingsRow mapping over one of an ArrayLedger's holdings arrays."""
+
+    def __init__(self, ledger, name):
+        self.ledger = ledger
+        self.name = name
+
+    def __getitem__(self, user_id):
+        return HoldingsRow(self.ledger, self.name, self.ledger.user_index[user_id])
+
+    def __setitem__(self, user_id, portfolio):
+        row = HoldingsRow(self.ledger, self.name, self.ledger.add_user(user_id))
+        row.clear()
+        row.update(portfolio)
+
+    def __delitem__(self, user_id):
+        raise TypeError("Users cannot be removed from an ArrayLedger.")
+
+    def __contains__(self, user_id):
+        return user_id in self.ledger.user_index
+
+    def __iter__(self):
+        return iter(self.ledger.user_ids)
+
+    def __len__(self):
+        return self.ledger.num_users
+
+class HoldingsRow(MutableMapping):
+    """One user's stock_id -> quantity row; behaves like a dict without zero entries."""
+
+    def __init__(self, ledger, name, row):
+        self.ledger = ledger
+        self.name = name
+        self.row = row
+
+    def __getitem__(self, stock_id):
+        column = self.ledger.stock_index.get(stock_id)
+        if column is None:
+            raise KeyError(stock_id)
+        return getattr(self.ledger, self.name)[self.row, column].item()
+
+    def get(self, stock_id, default=None):
+        column = self.ledger.stock_index.get(stock_id)
+        if column is None:
+            return default
+        quantity = getattr(self.ledger, self.name)[self.row, column].item()
+        return quantity if quantity else default
+
+    def __setitem__(self, stock_id, quantity):
+        column = self.ledger.add_stock(stock_id)
+        getattr(self.ledger, self.name)[self.row, column] = quantity
+
+    def __delitem__(self, stock_id):
+        column = self.ledger.stock_index.get(stock_id)
+        if column is None:
+            raise KeyError(stock_id)
+        getattr(self.ledger, self.name)[self.row, column] = 0
+
+    def __contains__(self, stock_id):
+        return bool(self.get(stock_id, 0))
+
+    def __iter__(self):
+        values = getattr(self.ledger, self.name)[self.row, :self.ledger.num_stocks]
+        return iter([self.ledger.stock_ids[column] for column in np.flatnonzero(values)])
+
+    def __len__(self):
+        return int(np.count_nonzero(getattr(self.ledger, self.name)[self.row, :self.ledger.num_stocks]))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
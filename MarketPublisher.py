@@ -0,0 +1,254 @@
+import math
+import struct
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import numpy as np
+import EventLog
+
+logger = EventLog.get_logger(__name__)
+
+# Frame kinds
+SNAPSHOT = 0 # full book; replaces the client's local state
+DELTA = 1 # changed levels, applied on top of the previous frame
+
+# Little-endian frame header: kind, 3 pad bytes, from_seq, to_seq, 4 pad bytes,
+# current_price, highest_bid, lowest_ask, spread (NaN for none), candle time in
+# epoch ms, open, high, low, close (NaN if there is no candle), then the number
+# of bid levels, ask levels and leaderboard rows and how many of those rows are
+# the top of the board (the rest are the bottom). The header is 104 bytes so the
+# body that follows is 8-byte aligned. The body is columnar, money as float64
+# and counts as int32: level prices (bids, then asks), trader total values,
+# trader cash, then level quantities, trader user_ids, trader shares.
+FRAME_HEADER = struct.Struct("<B3xII4x9d4I")
+
+def encode_frame(kind, from_seq, to_seq, summary, candle, bids, asks, board=((), ())):
+    """Pack one update into a binary frame (see FRAME_HEADER).
+
+    board is (top, bottom) lists of [user_id, total_value, cash, shares] rows,
+    as from Leaderboard.board.
+    """
+    def number(value):
+        return math.nan if value is None else float(value)
+
+    top, bottom = board
+
+    candle_values = (math.nan,) * 5
+    if candle:
+        candle_time = datetime.fromisoformat(candle["timestamp"]).timestamp() * 1000
+        candle_values = (candle_time, candle["open"], candle["high"], candle["low"], candle["close"])
+    header = FRAME_HEADER.pack(
+        kind, from_seq, to_seq,
+        number(summary.get("current_price")), number(summary.get("highest_bid")),
+        number(summary.get("lowest_ask")), number(summary.get("spread")),
+        *candle_values,
+        len(bids), len(asks), len(top) + len(bottom), len(top),
+    )
+    levels = np.array([*bids, *asks], dtype="<f8").reshape(-1, 2)
+    traders = np.array([*top, *bottom], dtype="<f8").reshape(-1, 4)
+    return b"".join((
+        header,
+        levels[:, 0].tobytes(), traders[:, 1].tobytes(), traders[:, 2].tobytes(),
+        levels[:, 1].astype("<i4").tobytes(), traders[:, 0].astype("<i4").tobytes(), traders[:, 3].astype("<i4").tobytes(),
+    ))
+
+class _Client:
+    """Delivery state of one connected client: its "latest only" slot."""
+    __slots__ = ("interval", "next_due", "seq", "version", "in_flight", "sent_at")
+
+    def __init__(self, interval):
+        self.interval = interval # seconds between frames, as negotiated
+        self.next_due = 0.0
+        self.seq = None # last delta seq the client holds; None until it gets a snapshot
+        self.version = 0 # publisher version of the last frame sent
+        self.in_flight = False # a frame is sent but not yet acknowledged
+        self.sent_at = 0.0
+
+class MarketPublisher:
+    """Conflating fan-out of book updates to many socket clients.
+
+    The trading loop hands each BookFeed delta, the current candle and the
+    leaderboard to publish(), which only appends to a bounded log. A publisher
+    thread sends each client at most one frame per its negotiated interval and
+    never more than one unacknowledged frame: everything that arrived meanwhile
+    is merged into the client's next frame. Level quantities in a delta are
+    absolute, so merging keeps the latest quantity per level and a slow client
+    simply receives fewer, larger frames instead of a queue. Every frame
+    carries the latest leaderboard whole; it is a fixed number of rows however
+    many traders there are. A client that falls behind the log, loses an ack or
+    asks for a resync gets a snapshot frame from snapshot_source instead.
+
+    Frames are encoded once per distinct (from_seq, to_seq) and shared by every
+    client at the same position. send(sid, frame, callback) delivers a frame
+    and must call callback() when the client acknowledges it.
+    """
+
+    def __init__(self, send, snapshot_source, default_interval=0.2, min_interval=0.05, history=256, ack_timeout=5.0):
+        self.send = send
+        self.snapshot_source = snapshot_source # callable returning a BookFeed snapshot
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.ack_timeout = ack_timeout
+        self.frames_encoded = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+        self._clients = {} # sid -> _Client
+        self._log = deque(maxlen=history) # recent deltas, oldest first
+        self._summary = {}
+        self._candle = None
+        self._board = ((), ()) # (top, bottom) leaderboard rows
+        self._version = 0 # bumped on every publish that changed anything
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="market-publisher", daemon=True)
+        self._thread.start()
+
+    def add_client(self, sid, interval=None):
+        """Start publishing to a client; its first frame is a snapshot. Returns the granted interval."""
+        with self._condition:
+            client = self._clients[sid] = _Client(self._clamp(interval))
+            self._condition.notify()
+            return client.interval
+
+    def remove_client(self, sid):
+        with self._condition:
+            self._clients.pop(sid, None)
+
+    def set_interval(self, sid, interval):
+        """Change a client's update interval (seconds), clamped to min_interval. Returns the granted interval."""
+        with self._condition:
+            client = self._clients.get(sid)
+            if client is None:
+                raise ValueError("Unknown client.")
+            client.interval = self._clamp(interval)
+            client.next_due = min(client.next_due, time.monotonic() + client.interval)
+            self._condition.notify()
+            return client.interval
+
+    def _clamp(self, interval):
+        return max(self.min_interval, self.default_interval if interval is None else float(interval))
+
+    def resync(self, sid=None):
+        """Send a client (or with sid None, every client) a snapshot as its next frame."""
+        with self._condition:
+            for client in (self._clients.values() if sid is None else filter(None, [self._clients.get(sid)])):
+                client.seq = None
+                client.version = -1
+            self._condition.notify()
+
+    def reset(self):
+        """Forget the delta log after the feed was replaced (e.g. market reset) and resync every client."""
+        with self._condition:
+            self._log.clear()
+        self.resync()
+
+    def publish(self, delta, candle=None, board=None):
+        """Queue a BookFeed delta (or None), the current candle and the leaderboard's (top, bottom) rows for delivery."""
+        board = self._board if board is None else board
+        with self._condition:
+            if delta is None and candle == self._candle and board == self._board:
+                return
+            if delta is not None:
+                if self._log and delta["seq"] != self._log[-1]["seq"] + 1:
+                    self._log.clear() # a gap in the log can only be bridged by snapshots
+                self._log.append(delta)
+                self._summary = delta["summary"]
+            self._candle = dict(candle) if candle else None
+            self._board = board
+            self._version += 1
+            self._condition.notify()
+
+    def client_count(self):
+        with self._condition:
+            return len(self._clients)
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+                now = time.monotonic()
+                due, wait = [], None
+                for sid, client in self._clients.items():
+                    if client.in_flight:
+                        if now - client.sent_at < self.ack_timeout:
+                            continue
+                        # The ack is lost; the client may or may not hold the frame
+                        client.in_flight = False
+                        client.seq = None
+                        client.version = -1
+                    if client.version == self._version and client.seq is not None:
+                        continue
+                    if client.next_due > now:
+                        wait = client.next_due - now if wait is None else min(wait, client.next_due - now)
+                        continue
+                    due.append((sid, client))
+                if not due:
+                    self._condition.wait(wait if wait is not None else self.ack_timeout)
+                    continue
+                log = list(self._log)
+                summary, candle, board, version = self._summary, self._candle, self._board, self._version
+
+            frames = {} # (from_seq, to_seq) -> frame, shared by clients at the same position
+            snapshot = None
+            for sid, client in due:
+                if client.seq is None or (log and client.seq + 1 < log[0]["seq"]):
+                    if snapshot is None:
+                        try:
+                            snapshot = self.snapshot_source()
+                        except Exception as snapshot_error:
+                            logger.error("Error building book snapshot: %s", snapshot_error)
+                            snapshot = False
+                        else:
+                            frames["snapshot"] = encode_frame(SNAPSHOT, snapshot["seq"], snapshot["seq"], snapshot["summary"],
+                                                              candle, snapshot["bids"], snapshot["asks"], board)
+                            self.frames_encoded += 1
+                    if snapshot is False:
+                        with self._condition:
+                            client.next_due = time.monotonic() + client.interval # retry later
+                        continue
+                    key, to_seq = "snapshot", snapshot["seq"]
+                else:
+                    # A snapshot may be ahead of the log; the next frame then starts after it
+                    to_seq = max(client.seq, log[-1]["seq"]) if log else client.seq
+                    key = (client.seq + 1, to_seq)
+                    if key not in frames:
+                        frames[key] = self._merged_frame(log, client.seq + 1, to_seq, summary, candle, board)
+                        self.frames_encoded += 1
+                frame = frames[key]
+                with self._condition:
+                    if self._clients.get(sid) is not client:
+                        continue # disconnected meanwhile
+                    client.seq = to_seq
+                    client.version = version
+                    client.in_flight = True
+                    client.sent_at = now = time.monotonic()
+                    client.next_due = now + client.interval
+                self.frames_sent += 1
+                self.bytes_sent += len(frame)
+                try:
+                    self.send(sid, frame, lambda *_, client=client: self._acknowledged(client))
+                except Exception as send_error:
+                    logger.error("Error sending market frame: %s", send_error)
+
+    def _acknowledged(self, client):
+        with self._condition:
+            client.in_flight = False
+            self._condition.notify()
+
+    def _merged_frame(self, log, from_seq, to_seq, summary, candle, board):
+        """One delta frame covering log entries from_seq to to_seq, latest quantity per level."""
+        bids, asks = {}, {}
+        for delta in log:
+            if from_seq <= delta["seq"] <= to_seq:
+                bids.update(delta["bids"])
+                asks.update(delta["asks"])
+        return encode_frame(DELTA, from_seq, to_seq, summary, candle, list(bids.items()), list(asks.items()), board)
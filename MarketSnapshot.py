@@ -0,0 +1,145 @@
+import threading
+from datetime import datetime
+import numpy as np
+import EventLog
+
+logger = EventLog.get_logger(__name__)
+
+class MarketSnapshot:
+    """Cached market data payload for one stock.
+
+    The payload is split into a book section, a users section and the candle
+    history. Each call checks the exchange's sequence number and its own
+    ChangeSet and rebuilds only the sections that changed; when nothing has
+    happened since the last call the cached payload is returned as is, so any
+    number of HTTP clients can be served without walking the engine again.
+    Payloads are shared between callers and must be treated as read-only.
+
+    Each trader's cash and holding are kept in arrays and read from the
+    exchange only when the trader is dirty. A new price only changes the
+    total_value column, which is recomputed for every trader at once.
+    """
+
+    def __init__(self, exchange, stock_id, user_ids, max_levels=18, price_decimals=2, candle_source=None):
+        self.exchange = exchange
+        self.stock_id = stock_id
+        self.user_ids = list(user_ids)
+        self.max_levels = max_levels
+        self.price_decimals = price_decimals
+        self.candle_source = candle_source # callable returning (version, closed_candles, current_candle)
+        self.changes = exchange.track_changes()
+
+        self._lock = threading.Lock()
+        self._sequence = None
+        self._candle_version = None
+        self._book = None
+        self._user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        self._balances = np.zeros(len(self.user_ids)) # free cash
+        self._cash = np.zeros(len(self.user_ids)) # free plus reserved cash
+        self._holdings = np.zeros(len(self.user_ids), dtype=np.int64) # free plus reserved shares of the stock
+        self._known = np.zeros(len(self.user_ids), dtype=bool) # traders the exchange could report on
+        self._users = None
+        self._users_price = None
+        self._history = []
+        self._latest_candle = None
+        self._payloads = {} # include_full_history -> payload
+
+    def get(self, include_full_history=True):
+        """Return the market data payload, rebuilding only what changed."""
+        with self._lock:
+            candle_version = None
+            if self.candle_source is not None:
+                candle_version, closed_candles, current_candle = self.candle_source()
+
+            if self.exchange.sequence != self._sequence or self._book is None:
+                self._refresh_engine_sections()
+                self._payloads = {}
+
+            if candle_version != self._candle_version:
+                self._history = list(closed_candles) + ([dict(current_candle)] if current_candle else [])
+                self._latest_candle = dict(current_candle) if current_candle else None
+                self._candle_version = candle_version
+                self._payloads = {}
+
+            payload = self._payloads.get(include_full_history)
+            if payload is None:
+                payload = dict(self._book)
+                payload["timestamp"] = datetime.now().isoformat()
+                payload["users"] = self._users
+                if include_full_history:
+                    payload["candlestick_data"] = self._history
+                else:
+                    payload["latest_candle"] = self._latest_candle
+                self._payloads[include_full_history] = payload
+            return payload
+
+    def _refresh_engine_sections(self):
+        """Rebuild the book and users sections from the exchange's dirty sets."""
+        exchange = self.exchange
+        self._sequence = exchange.sequence
+        dirty_stocks, dirty_users = self.changes.drain()
+
+        if self._book is None or self.stock_id in dirty_stocks:
+            self._book = self._build_book()
+
+        if self._users is None:
+            dirty = self.user_ids
+        else:
+            dirty = [user_id for user_id in dirty_users if user_id in self._user_index]
+        for user_id in dirty:
+            self._read_user(user_id)
+        current_price = self._book["current_price"]
+        if dirty or current_price != self._users_price:
+            self._users = self._build_users(current_price)
+        self._users_price = current_price
+
+    def _build_book(self):
+        """Price, spread and top levels of both sides."""
+        exchange = self.exchange
+        decimals = self.price_decimals
+        # One book lock across all reads so price, spread and levels agree
+        with exchange.book_lock(self.stock_id):
+            current_price = exchange.get_stock_price(self.stock_id)
+            lowest_ask = exchange.get_lowest_ask(self.stock_id)
+            highest_bid = exchange.get_highest_bid(self.stock_id)
+            bids = [{"price": float(price), "quantity": quantity}
+                    for price, quantity, _ in exchange.get_depth(self.stock_id, "bid", self.max_levels)]
+            asks = [{"price": float(price), "quantity": quantity}
+                    for price, quantity, _ in exchange.get_depth(self.stock_id, "ask", self.max_levels)]
+        return {
+            "current_price": round(float(current_price), decimals) if current_price else None,
+            "lowest_ask": round(float(lowest_ask), decimals) if lowest_ask else None,
+            "highest_bid": round(float(highest_bid), decimals) if highest_bid else None,
+            "spread": round(float(lowest_ask - highest_bid), decimals) if (lowest_ask and highest_bid) else None,
+            "bids": bids,
+            "asks": asks,
+        }
+
+    def _read_user(self, user_id):
+        """Refresh one trader's cash and holding from the exchange."""
+        exchange = self.exchange
+        index = self._user_index[user_id]
+        try:
+            balance = exchange.get_user_balance(user_id)
+            portfolio = exchange.get_user_portfolio(user_id)
+            reserved_balance, reserved_holdings = exchange.get_user_reserved(user_id)
+        except ValueError as user_error:
+            logger.warning("Error getting data for user %s: %s", user_id, user_error)
+            self._known[index] = False
+            return
+        self._balances[index] = balance
+        self._cash[index] = balance + reserved_balance
+        self._holdings[index] = portfolio.get(self.stock_id, 0) + reserved_holdings.get(self.stock_id, 0)
+        self._known[index] = True
+
+    def _build_users(self, current_price):
+        """Balance, holding and marked total value of every trader, valuing all holdings in one step."""
+        known = self._known
+        user_ids = [user_id for user_id, is_known in zip(self.user_ids, known.tolist()) if is_known]
+        balances = np.round(self._balances[known], 2).tolist()
+        holdings = self._holdings[known]
+        total_values = np.round(self._cash[known] + holdings * (current_price or 100), 2).tolist()
+        return [
+            {"user_id": user_id, "balance": balance, "stock_quantity": stock_quantity, "total_value": total_value}
+            for user_id, balance, stock_quantity, total_value in zip(user_ids, balances, holdings.tolist(), total_values)
+        ]
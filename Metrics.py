@@ -0,0 +1,174 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import nullcontext
+
+_NO_TIMER = nullcontext() # what time() hands out with metrics disabled
+
+class Histogram:
+    """Latency histogram with logarithmic buckets.
+
+    Bucket upper bounds start at low seconds and double count - 1 times (the
+    defaults span 1 us to about 17 s), plus an overflow bucket. observe() is a
+    bisect and two additions, so it can sit on a hot path.
+    """
+
+    def __init__(self, low=1e-6, count=25):
+        self.bounds = [low * 2 ** i for i in range(count)]
+        self.counts = [0] * (count + 1) # per bucket, not cumulative; the last one is overflow
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (inf for the overflow bucket), or None before any observation."""
+        with self._lock:
+            counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return None
+        rank = max(math.ceil(q * total), 1)
+        seen = 0
+        for index, bucket in enumerate(counts):
+            seen += bucket
+            if seen >= rank:
+                return self.bounds[index] if index < len(self.bounds) else math.inf
+        return math.inf
+
+    def snapshot(self):
+        """(cumulative counts per bound plus +Inf, sum), read together."""
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative, running = [], 0
+        for bucket in counts:
+            running += bucket
+            cumulative.append(running)
+        return cumulative, total
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    """Per-stage latency histograms plus counters and gauges, rendered in the Prometheus text format.
+
+    with metrics.time("orders"): ... records how long the block took in the
+    <prefix>_stage_seconds histogram, labelled stage="orders". With enabled
+    False, time() returns a shared no-op context and records nothing.
+
+    Counters and gauges are not kept here: collectors added with
+    add_collector() are called on every render() and return
+    [(name, type, help, [(labels, value)])], so values the exchange already
+    counts cost nothing until they are scraped.
+    """
+
+    def __init__(self, prefix="exchange", enabled=True, bucket_low=1e-6, bucket_count=25):
+        self.prefix = prefix
+        self.enabled = enabled
+        self.bucket_low = bucket_low
+        self.bucket_count = bucket_count
+        self.stages = {} # stage -> Histogram
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def histogram(self, stage):
+        """The stage's histogram, created on first use."""
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(stage, Histogram(self.bucket_low, self.bucket_count))
+        return histogram
+
+    def time(self, stage):
+        """Context manager timing its block into the stage's histogram."""
+        if not self.enabled:
+            return _NO_TIMER
+        return _Timer(self.histogram(stage))
+
+    def observe(self, stage, seconds):
+        if self.enabled:
+            self.histogram(stage).observe(seconds)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def reset(self):
+        """Forget every stage's observations."""
+        with self._lock:
+            self.stages = {}
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        name = f"{self.prefix}_stage_seconds"
+        lines.append(f"# HELP {name} Time spent in each stage of the trading loop and serving path.")
+        lines.append(f"# TYPE {name} histogram")
+        for stage, histogram in sorted(self.stages.items()):
+            cumulative, total = histogram.snapshot()
+            for bound, running in zip(histogram.bounds + [math.inf], cumulative):
+                lines.append(f"{name}_bucket{_labels({'stage': stage, 'le': _number(bound)})} {running}")
+            lines.append(f"{name}_sum{_labels({'stage': stage})} {_number(total)}")
+            lines.append(f"{name}_count{_labels({'stage': stage})} {cumulative[-1]}")
+        for collector in self._collectors:
+            for metric, kind, help_text, samples in collector():
+                metric = f"{self.prefix}_{metric}"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{metric}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def exchange_collector(exchange):
+    """Order, fill, reject and cancel counts and resting book depth of an exchange, as a Metrics collector result.
+
+    Call it where the engine is consistent, e.g. inside the gateway's sequencer.
+    """
+    depth_orders, depth_levels = [], []
+    for stock_id, stock in exchange.stocks.items():
+        for side in ("bid", "ask"):
+            ladder = stock[side + "s"]
+            depth_levels.append(({"stock": stock_id, "side": side}, len(ladder)))
+            depth_orders.append(({"stock": stock_id, "side": side}, sum(len(level) for level in ladder.values())))
+    return [
+        ("orders_total", "counter", "Orders accepted.", [({}, exchange.order_count)]),
+        ("order_rejects_total", "counter", "Orders rejected because the user could not cover them.", [({}, exchange.reject_count)]),
+        ("fills_total", "counter", "Fills executed.", [({}, exchange.trade_count)]),
+        ("cancels_total", "counter", "Resting orders cancelled.", [({}, exchange.cancel_count)]),
+        ("book_orders", "gauge", "Orders resting in the book.", depth_orders),
+        ("book_levels", "gauge", "Price levels in the book.", depth_levels),
+    ]
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+class GatewayFull(Exception):
+    """Raised through a command's future when the gateway queue has no room for it."""
+
+class OrderGateway:
+    """Single-writer front door to a StockExchange.
+
+    Commands from any number of producers go into one bounded asyncio queue. A
+    single sequencer task on the gateway's own thread drains up to max_batch
+    commands at a time and applies them to the exchange in queue order, so the
+    engine is only ever touched by that task and every producer sees the same
+    ordering. Acknowledgements come back through futures.
+
+    Threads (Flask handlers, trading_loop) use submit(), which never blocks: if
+    the queue is full the future fails with GatewayFull. Coroutines running on
+    the gateway loop (see spawn) use send(), which waits for room instead. A
+    slow producer only delays its own acks, never the sequencer.
+
+    Commands: "order", "orders", "cancel" and "amend" map to place_order,
+    place_orders, cancel_order and amend_order; any StockExchange get_* method
+    can be queried by name; "call" runs fn(*args) in the sequencer, for work
+    that must see a consistent engine. Do not wait on a future from inside a
+    "call", as the sequencer would be waiting on itself.
+    """
+
+    COMMANDS = {
+        "order": "place_order",
+        "orders": "place_orders",
+        "cancel": "cancel_order",
+        "amend": "amend_order",
+    }
+
+    def __init__(self, exchange, max_queue=10_000, max_batch=512):
+        self.exchange = exchange
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.processed = 0 # commands applied
+        self.batches = 0 # sequencer wake-ups
+        self.rejected_full = 0 # commands refused because the queue was full
+
+        self._loop = asyncio.new_event_loop()
+        self._queue = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="order-gateway", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue(self.max_queue)
+        self._sequencer = self._loop.create_task(self._sequence())
+        self._ready.set()
+        self._loop.run_forever()
+        while not self._queue.empty():
+            self._queue.get_nowait()[0].cancel()
+        self._sequencer.cancel()
+        self._loop.run_until_complete(asyncio.gather(self._sequencer, return_exceptions=True))
+        self._loop.close()
+
+    async def _sequence(self):
+        """Apply queued commands in order, a drained batch at a time."""
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            for future, kind, args in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue # the producer gave up on it
+                try:
+                    result = self._apply(kind, args)
+                except Exception as error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            self.processed += len(batch)
+            self.batches += 1
+            await asyncio.sleep(0) # let producers enqueue before the next batch
+
+    def _apply(self, kind, args):
+        if kind == "call":
+            fn, *fn_args = args
+            return fn(*fn_args)
+        method = self.COMMANDS.get(kind)
+        if method is None:
+            if not kind.startswith("get_"):
+                raise ValueError(f"Unknown gateway command {kind!r}.")
+            method = kind
+        return getattr(self.exchange, method)(*args)
+
+    def submit(self, kind, *args):
+        """Queue a command from any thread and return a concurrent.futures.Future for its ack."""
+        future = Future()
+        self._loop.call_soon_threadsafe(self._offer, future, kind, args)
+        return future
+
+    def _offer(self, future, kind, args):
+        try:
+            self._queue.put_nowait((future, kind, args))
+        except asyncio.QueueFull:
+            self.rejected_full += 1
+            future.set_exception(GatewayFull("Order gateway queue is full."))
+
+    def call(self, fn, *args):
+        """Run fn(*args) in the sequencer; returns a future for its result."""
+        return self.submit("call", fn, *args)
+
+    def use_exchange(self, exchange):
+        """Switch to another exchange after every command already queued; returns a future."""
+        return self.call(setattr, self, "exchange", exchange)
+
+    async def send(self, kind, *args):
+        """Queue a command from a coroutine on the gateway loop, waiting for room, and await its ack."""
+        future = Future()
+        await self._queue.put((future, kind, args))
+        return await asyncio.wrap_future(future)
+
+    def spawn(self, coroutine):
+        """Run a producer coroutine (e.g. a simulated agent) on the gateway loop."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def queue_depth(self):
+        """Commands waiting for the sequencer."""
+        return self._queue.qsize()
+
+    def close(self):
+        """Stop the sequencer and the gateway thread. Commands still queued are cancelled."""
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
@@ -0,0 +1,234 @@
+import threading
+import numpy as np
+
+class PnLEngine:
+    """Position, average cost and P&L of every user in every stock, updated from fills.
+
+    Register on_trade with StockExchange.add_trade_listener. Like ArrayLedger,
+    user and stock IDs map to dense rows and columns of users x stocks arrays:
+    positions (signed share counts), costs (cost basis of the open position,
+    so average cost is cost / position) and realized P&L. A fill that reduces
+    a position realizes (price - average cost) on the shares it closes; one
+    that crosses zero opens the rest at the fill price.
+
+    Positions are float64 so that revaluing every user is one BLAS
+    matrix-vector product over positions, minus per-user cost totals kept up
+    to date fill by fill. Prices default to each stock's last fill. Readers
+    only take the lock long enough to pick up the current arrays, so a
+    revaluation never holds up matching; one that races fills may see the
+    newest of them partly applied.
+
+    Holdings from before the engine was attached (an IPO, transfers) are not
+    fills; book them with seed() or from_exchange().
+    """
+
+    def __init__(self, user_capacity=1024, stock_capacity=4):
+        self.user_index = {} # user_id -> row
+        self.user_ids = [] # row -> user_id
+        self.stock_index = {} # stock_id -> column
+        self.stock_ids = [] # column -> stock_id
+        self.positions = np.zeros((user_capacity, stock_capacity), dtype=np.float64)
+        self.costs = np.zeros((user_capacity, stock_capacity), dtype=np.float64)
+        self.realized = np.zeros((user_capacity, stock_capacity), dtype=np.float64)
+        self.cost_totals = np.zeros(user_capacity, dtype=np.float64) # costs summed over stocks
+        self.realized_totals = np.zeros(user_capacity, dtype=np.float64) # realized summed over stocks
+        self.last_prices = np.zeros(stock_capacity, dtype=np.float64) # last fill price per stock
+        self._lock = threading.Lock()
+        self._bind_views()
+
+    @classmethod
+    def from_exchange(cls, exchange, **kwargs):
+        """An engine holding every user's current shares (free and reserved), booked at the stock's current price.
+
+        Call it while nothing is matching, then register on_trade.
+        """
+        engine = cls(**kwargs)
+        with exchange.locked():
+            prices = {stock_id: exchange.get_stock_price(stock_id) or 0 for stock_id in exchange.stocks}
+            for user_id in list(exchange.users_balances):
+                _, reserved_holdings = exchange.get_user_reserved(user_id)
+                for holdings in (exchange.get_user_portfolio(user_id), reserved_holdings):
+                    for stock_id, quantity in holdings.items():
+                        engine.seed(user_id, stock_id, quantity, prices.get(stock_id, 0))
+        return engine
+
+    @property
+    def num_users(self):
+        return len(self.user_ids)
+
+    @property
+    def num_stocks(self):
+        return len(self.stock_ids)
+
+    def on_trade(self, stock_id, price, quantity, buyer_id, seller_id, aggressor=None):
+        """Apply one fill to the buyer's and the seller's positions."""
+        price = float(price)
+        with self._lock:
+            column = self.stock_index.get(stock_id)
+            if column is None:
+                column = self._add_stock(stock_id)
+            buyer = self.user_index.get(buyer_id)
+            if buyer is None:
+                buyer = self._add_user(buyer_id)
+            seller = self.user_index.get(seller_id)
+            if seller is None:
+                seller = self._add_user(seller_id)
+            self._fill(buyer, column, quantity, price)
+            self._fill(seller, column, -quantity, price)
+            self._views[5][column] = price
+
+    def seed(self, user_id, stock_id, quantity, price):
+        """Book quantity shares (negative for short) as opened at price, e.g. holdings that predate the engine."""
+        with self._lock:
+            column = self._add_stock(stock_id)
+            self._fill(self._add_user(user_id), column, quantity, float(price))
+            if not self.last_prices[column]:
+                self.last_prices[column] = price
+
+    def _fill(self, row, column, quantity, price):
+        """Apply quantity shares (negative when selling) at price to one position. Caller holds the lock."""
+        positions, costs, realized_cells, cost_totals, realized_totals, _ = self._views
+        cell = row * self._stride + column
+        position = positions[cell]
+        if position == 0 or (position > 0) == (quantity > 0):
+            positions[cell] = position + quantity
+            costs[cell] += price * quantity
+            cost_totals[row] += price * quantity
+            return
+        cost = costs[cell]
+        closed = min(abs(quantity), abs(position)) * (1 if position > 0 else -1) # shares closed, in the position's sign
+        closed_cost = cost * closed / position
+        realized = price * closed - closed_cost
+        realized_cells[cell] += realized
+        realized_totals[row] += realized
+        # What is left of quantity after closing opens the other way at price
+        opened = quantity + closed
+        position += quantity
+        new_cost = cost - closed_cost + price * opened if position else 0.0
+        cost_totals[row] += new_cost - cost
+        positions[cell] = position
+        costs[cell] = new_cost
+
+    def _bind_views(self):
+        """Flat memoryviews of the arrays for _fill; element access through them skips NumPy's scalar boxing."""
+        self._stride = self.positions.shape[1]
+        self._views = tuple(memoryview(array).cast("B").cast("d") for array in (
+            self.positions, self.costs, self.realized, self.cost_totals, self.realized_totals, self.last_prices))
+
+    def _add_user(self, user_id):
+        """Row of a user, assigning the next one and growing the arrays if needed. Caller holds the lock."""
+        row = self.user_index.get(user_id)
+        if row is not None:
+            return row
+        row = len(self.user_ids)
+        if row == len(self.cost_totals):
+            self._resize(2 * row, self.positions.shape[1])
+        self.user_index[user_id] = row
+        self.user_ids.append(user_id)
+        return row
+
+    def _add_stock(self, stock_id):
+        """Column of a stock, assigning the next one and growing the arrays if needed. Caller holds the lock."""
+        column = self.stock_index.get(stock_id)
+        if column is not None:
+            return column
+        column = len(self.stock_ids)
+        if column == self.positions.shape[1]:
+            self._resize(len(self.cost_totals), 2 * column)
+        self.stock_index[stock_id] = column
+        self.stock_ids.append(stock_id)
+        return column
+
+    def _resize(self, user_capacity, stock_capacity):
+        """Reallocate the arrays with new capacities, keeping existing rows."""
+        users, stocks = self.num_users, self.num_stocks
+        for name in ("positions", "costs", "realized"):
+            old = getattr(self, name)
+            new = np.zeros((user_capacity, stock_capacity), dtype=old.dtype)
+            new[:users, :stocks] = old[:users, :stocks]
+            setattr(self, name, new)
+        for name in ("cost_totals", "realized_totals"):
+            old = getattr(self, name)
+            new = np.zeros(user_capacity, dtype=old.dtype)
+            new[:users] = old[:users]
+            setattr(self, name, new)
+        last_prices = np.zeros(stock_capacity, dtype=np.float64)
+        last_prices[:stocks] = self.last_prices[:stocks]
+        self.last_prices = last_prices
+        self._bind_views()
+
+    def _arrays(self):
+        """Views of the filled part of every array, taken together under the lock."""
+        with self._lock:
+            users, stocks = self.num_users, self.num_stocks
+            return (self.positions[:users, :stocks], self.costs[:users, :stocks], self.realized[:users, :stocks],
+                    self.cost_totals[:users], self.realized_totals[:users], self.last_prices[:stocks].copy())
+
+    def _price_vector(self, prices, last_prices):
+        """prices ({stock_id: price}, missing ones at the last fill) as a vector over the stock columns."""
+        if prices is None:
+            return last_prices
+        vector = last_prices.copy()
+        for stock_id, price in prices.items():
+            column = self.stock_index.get(stock_id)
+            if column is not None and column < len(vector) and price is not None:
+                vector[column] = price
+        return vector
+
+    def revalue(self, prices=None):
+        """Mark every user to market: arrays aligned with user_ids.
+
+        Returns {"market_value", "unrealized", "realized", "total"}:
+        positions valued at prices ({stock_id: price}; stocks left out, or all
+        with prices None, at their last fill), unrealized P&L against cost,
+        realized P&L and their sum, each summed over stocks.
+        """
+        positions, _, _, cost_totals, realized_totals, last_prices = self._arrays()
+        market_value = positions @ self._price_vector(prices, last_prices)
+        unrealized = market_value - cost_totals
+        return {"market_value": market_value, "unrealized": unrealized, "realized": realized_totals.copy(),
+                "total": unrealized + realized_totals}
+
+    def stock_summary(self, prices=None):
+        """{stock_id: {...}} market-wide per stock: net and gross position, long and short exposure, realized and unrealized P&L."""
+        positions, costs, realized, _, _, last_prices = self._arrays()
+        vector = self._price_vector(prices, last_prices)
+        # Column sums as matrix-vector products, which BLAS does much faster than sum(axis=0)
+        ones = np.ones(len(positions))
+        net = ones @ positions
+        gross = ones @ np.abs(positions)
+        longs, shorts = (gross + net) / 2, (gross - net) / 2
+        unrealized = net * vector - ones @ costs
+        realized = ones @ realized
+        summary = {}
+        for column, stock_id in enumerate(self.stock_ids[:len(vector)]):
+            summary[stock_id] = {
+                "price": float(vector[column]),
+                "net_position": int(net[column]),
+                "gross_position": int(gross[column]),
+                "long_exposure": float(longs[column] * vector[column]),
+                "short_exposure": float(shorts[column] * vector[column]),
+                "realized": float(realized[column]),
+                "unrealized": float(unrealized[column]),
+            }
+        return summary
+
+    def user(self, user_id, prices=None):
+        """One user's {stock_id: {position, average_cost, realized, unrealized}} for every stock they have traded or held."""
+        positions, costs, realized, _, _, last_prices = self._arrays()
+        row = self.user_index.get(user_id)
+        if row is None or row >= len(positions):
+            raise ValueError("User has no positions.")
+        vector = self._price_vector(prices, last_prices)
+        rows = {}
+        for column, stock_id in enumerate(self.stock_ids[:len(vector)]):
+            position, cost, stock_realized = positions[row, column], costs[row, column], realized[row, column]
+            if not position and not stock_realized:
+                continue
+            rows[stock_id] = {
+                "position": int(position),
+                "average_cost": float(cost / position) if position else None,
+                "realized": float(stock_realized),
+                "unrealized": float(position * vector[column] - cost),
+            }
+        return rows
@@ -0,0 +1,213 @@
+from collections import OrderedDict
+import heapq
+from itertools import islice
+from sortedcontainers import SortedDict
+
+class PriceLevel(OrderedDict):
+    """Orders resting at one price (order_id -> Order) in time priority.
+
+    Keeps the running total open quantity so depth snapshots never have to sum
+    the orders; the order count is len(level).
+    """
+    __slots__ = ("quantity",)
+
+    def __init__(self):
+        super().__init__()
+        self.quantity = 0
+
+class SortedLadder(SortedDict):
+    """One side of an order book keyed by integer price ticks, backed by a SortedDict.
+
+    Works for any spread of prices. Values are PriceLevels.
+    """
+
+    def __init__(self, side):
+        super().__init__()
+        self.side = side # "bid" or "ask"
+
+    def best(self):
+        """Return (tick, level) for the best price. The ladder must not be empty."""
+        return self.peekitem(-1 if self.side == "bid" else 0)
+
+    def best_tick(self):
+        """Return the best price tick, or None if the side is empty."""
+        if not self:
+            return None
+        return self.peekitem(-1 if self.side == "bid" else 0)[0]
+
+    def setdefault(self, tick, default=None):
+        """Return the level at tick, creating an empty one if needed."""
+        level = self.get(tick)
+        if level is None:
+            level = self[tick] = PriceLevel() if default is None else default
+        return level
+
+    def top(self, n):
+        """Return up to n (tick, level) pairs starting from the best price."""
+        ticks = islice(self.irange(reverse=self.side == "bid"), n)
+        return [(tick, self[tick]) for tick in ticks]
+
+class DenseLadder:
+    """One side of an order book stored in a list indexed by tick offset from an anchor.
+
+    Level access and best-price lookup are O(1). The occupied ticks are also
+    kept in a set, so iteration and top() cost O(levels log levels) however
+    wide the window is. When the best level empties the ladder looks a few
+    slots toward worse prices for the next occupied one and otherwise takes
+    the extreme of the set, so that costs O(min(gap, levels)).
+
+    The anchor moves (and the list is re-centred) whenever an order lands
+    outside the current window, and the window is then sized from the span of
+    live levels, so it shrinks as well as grows; an emptied ladder goes back to
+    its initial capacity. Memory follows the span of live price levels rather
+    than the full price range.
+    """
+
+    SCAN = 8 # empty slots walked past an emptied best level before falling back to the tick set
+
+    def __init__(self, side, capacity=1024):
+        self.side = side # "bid" or "ask"
+        self._capacity = capacity # initial and smallest window
+        self._levels = [None] * capacity
+        self._ticks = set() # occupied ticks
+        self._anchor = 0 # tick stored at index 0
+        self._best = None # index of the best occupied level
+
+    def __len__(self):
+        return len(self._ticks)
+
+    def __contains__(self, tick):
+        return tick in self._ticks
+
+    def __getitem__(self, tick):
+        level = self.get(tick)
+        if level is None:
+            raise KeyError(tick)
+        return level
+
+    def __setitem__(self, tick, level):
+        i = self._slot(tick)
+        self._levels[i] = level
+        self._ticks.add(tick)
+        if (self._best is None or
+                (self.side == "bid" and i > self._best) or
+                (self.side == "ask" and i < self._best)):
+            self._best = i
+
+    def __delitem__(self, tick):
+        ticks = self._ticks
+        if tick not in ticks:
+            raise KeyError(tick)
+        ticks.remove(tick)
+        levels = self._levels
+        i = tick - self._anchor
+        levels[i] = None
+
+        if not ticks:
+            self._best = None
+            if len(levels) > self._capacity:
+                self._levels = [None] * self._capacity
+        elif i == self._best:
+            # The next level is usually close by; past SCAN empty slots, ask the set
+            step = 1 if self.side == "ask" else -1
+            end = max(min(i + step * (self.SCAN + 1), len(levels)), -1)
+            for j in range(i + step, end, step):
+                if levels[j] is not None:
+                    self._best = j
+                    break
+            else:
+                self._best = (min(ticks) if self.side == "ask" else max(ticks)) - self._anchor
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, tick, default=None):
+        i = tick - self._anchor
+        if 0 <= i < len(self._levels):
+            level = self._levels[i]
+            if level is not None:
+                return level
+        return default
+
+    def setdefault(self, tick, default=None):
+        """Return the level at tick, creating an empty one if needed."""
+        level = self.get(tick)
+        if level is None:
+            level = PriceLevel() if default is None else default
+            self[tick] = level
+        return level
+
+    def top(self, n):
+        """Return up to n (tick, level) pairs starting from the best price."""
+        best = heapq.nlargest if self.side == "bid" else heapq.nsmallest
+        anchor, levels = self._anchor, self._levels
+        return [(tick, levels[tick - anchor]) for tick in best(n, self._ticks)]
+
+    def pop(self, tick, *default):
+        level = self.get(tick)
+        if level is None:
+            if default:
+                return default[0]
+            raise KeyError(tick)
+        del self[tick]
+        return level
+
+    def best(self):
+        """Return (tick, level) for the best price. The ladder must not be empty."""
+        if self._best is None:
+            raise IndexError("ladder is empty")
+        return self._anchor + self._best, self._levels[self._best]
+
+    def best_tick(self):
+        """Return the best price tick, or None if the side is empty."""
+        if self._best is None:
+            return None
+        return self._anchor + self._best
+
+    def keys(self):
+        """Occupied ticks in ascending order."""
+        return sorted(self._ticks)
+
+    def values(self):
+        anchor, levels = self._anchor, self._levels
+        return [levels[tick - anchor] for tick in sorted(self._ticks)]
+
+    def items(self):
+        """(tick, level) pairs in ascending price order."""
+        anchor, levels = self._anchor, self._levels
+        return [(tick, levels[tick - anchor]) for tick in sorted(self._ticks)]
+
+    def _slot(self, tick):
+        """Index for tick, moving the anchor and resizing the window if needed."""
+        i = tick - self._anchor
+        size = len(self._levels)
+        if 0 <= i < size:
+            return i
+
+        if not self._ticks:
+            # Empty ladder: just re-centre on the new price
+            self._anchor = tick - size // 2
+            return tick - self._anchor
+
+        # Re-centre on the span of occupied levels plus the new tick, in a
+        # window of at least twice that span
+        low = min(min(self._ticks), tick)
+        high = max(max(self._ticks), tick)
+        span = high - low + 1
+        size = self._capacity
+        while size < 2 * span:
+            size *= 2
+        new_anchor = low - (size - span) // 2
+
+        new_levels = [None] * size
+        for t in self._ticks:
+            new_levels[t - new_anchor] = self._levels[t - self._anchor]
+        self._best = self._best + self._anchor - new_anchor
+        self._levels = new_levels
+        self._anchor = new_anchor
+        return tick - new_anchor
+
+LADDERS = {
+    "sorted": SortedLadder,
+    "dense": DenseLadder,
+}
@@ -0,0 +1,185 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+SAMPLING = "sampling"
+DETERMINISTIC = "deterministic"
+MODES = (SAMPLING, DETERMINISTIC)
+
+class _Session:
+    def __init__(self, mode, interval, threads, path):
+        self.mode = mode
+        self.interval = interval
+        self.threads = threads # thread names to sample, or None for all
+        self.path = path
+        self.started = time.time()
+        self.profiles = [] # cProfile.Profile of every thread that has stopped profiling itself
+        self.enabled = 0 # threads still profiling themselves
+        self.stacks = Counter() # collapsed stack -> samples
+        self.samples = 0
+        self.done = threading.Event()
+        self.sampler = None
+
+class Profiler:
+    """On-demand profiling of running threads, started and stopped from any thread.
+
+    A "sampling" session has a background thread record the stack of every
+    thread (or only those named in threads) each interval seconds and writes
+    them as collapsed stacks, one "thread;outer;...;inner count" line per
+    distinct stack, which flamegraph.pl and speedscope read. Its cost depends
+    on the interval, not on the code being profiled. Stacks are wall-clock, so
+    waiting threads show where they wait; and as the sampler needs the GIL to
+    look, bursts of Python work shorter than the interpreter's switch interval
+    (5 ms by default) are undercounted.
+
+    A "deterministic" session runs cProfile and writes a pstats file. CPython
+    only profiles the thread that enables the profiler, so threads take part by
+    calling checkpoint() at a safe point, e.g. once per loop iteration: the
+    first call in a session starts profiling that thread, the first after it
+    stops that thread's profile. stop() waits for them, calling wake so that
+    idle threads come round to a checkpoint. A thread about to exit calls
+    leave(). With no session running a checkpoint is a couple of attribute
+    reads.
+
+    One session runs at a time; stop() returns where it was written and the
+    latest result stays available as last.
+    """
+
+    def __init__(self, directory="profiles"):
+        self.directory = directory
+        self.last = None # result of the latest stop()
+        self._session = None
+        self._local = threading.local()
+        self._changed = threading.Condition()
+
+    @property
+    def running(self):
+        return self._session is not None
+
+    @property
+    def deterministic(self):
+        """Whether a deterministic session is waiting for threads to checkpoint."""
+        session = self._session
+        return session is not None and session.mode == DETERMINISTIC
+
+    def start(self, mode=SAMPLING, interval=0.005, threads=None):
+        """Start a session. Raises ValueError for an unknown mode or interval and RuntimeError if one is running."""
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}.")
+        if not interval > 0:
+            raise ValueError("interval must be greater than zero.")
+        with self._changed:
+            if self._session is not None:
+                raise RuntimeError("A profiling session is already running.")
+            os.makedirs(self.directory, exist_ok=True)
+            extension = "folded" if mode == SAMPLING else "pstats"
+            path = os.path.join(self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{mode}.{extension}")
+            session = _Session(mode, interval, set(threads) if threads else None, path)
+            if mode == SAMPLING:
+                session.sampler = threading.Thread(target=self._sample, args=(session,), name="profiler-sampler", daemon=True)
+                session.sampler.start()
+            self._session = session
+        return self.status()
+
+    def stop(self, wake=None, timeout=5.0):
+        """End the session, write its file and return the result.
+
+        For a deterministic session wake (if given) is called once the session
+        is closed, to prompt threads into a checkpoint, and threads that have
+        not stopped their profiles within timeout seconds are left out.
+        """
+        with self._changed:
+            session = self._session
+            if session is None:
+                raise RuntimeError("No profiling session is running.")
+            self._session = None
+        if session.mode == SAMPLING:
+            session.done.set()
+            session.sampler.join()
+            with open(session.path, "w", encoding="utf-8") as output:
+                for stack, samples in session.stacks.most_common():
+                    output.write(f"{stack} {samples}\n")
+            result = {"samples": session.samples, "stacks": len(session.stacks)}
+        else:
+            if wake is not None:
+                wake()
+            with self._changed:
+                self._changed.wait_for(lambda: session.enabled == 0, timeout)
+                profiles, missing = list(session.profiles), session.enabled
+            stats = pstats.Stats(*profiles) if profiles else pstats.Stats()
+            stats.dump_stats(session.path)
+            result = {"threads": len(profiles), "threads_missing": missing}
+        self.last = {"mode": session.mode, "path": session.path, "started": session.started,
+                     "duration": time.time() - session.started, **result}
+        return self.last
+
+    def status(self):
+        """The running session, if any, and the result of the latest one."""
+        session = self._session
+        running = None
+        if session is not None:
+            running = {"mode": session.mode, "started": session.started, "elapsed": time.time() - session.started}
+            if session.mode == SAMPLING:
+                running["samples"] = session.samples
+            else:
+                running["threads"] = session.enabled + len(session.profiles)
+        return {"running": running, "last": self.last}
+
+    def checkpoint(self):
+        """Start or stop profiling the calling thread to match the current deterministic session."""
+        joined = getattr(self._local, "session", None)
+        session = self._session
+        if joined is session:
+            return
+        deterministic = session is not None and session.mode == DETERMINISTIC
+        if joined is not None:
+            self.leave()
+        if not deterministic:
+            return
+        with self._changed:
+            if self._session is not session: # stopped meanwhile
+                return
+            session.enabled += 1
+        self._local.session, self._local.profile = session, cProfile.Profile()
+        self._local.profile.enable()
+
+    def leave(self):
+        """Stop profiling the calling thread, handing its profile to its session."""
+        joined = getattr(self._local, "session", None)
+        if joined is None:
+            return
+        self._local.profile.disable()
+        with self._changed:
+            joined.profiles.append(self._local.profile)
+            joined.enabled -= 1
+            self._changed.notify_all()
+        self._local.session = self._local.profile = None
+
+    def _sample(self, session):
+        own = threading.get_ident()
+        names = {}
+        deadline = time.perf_counter()
+        while not session.done.wait(max(deadline - time.perf_counter(), 0)):
+            # Fall behind rather than sample back to back when a sample takes longer than the interval
+            deadline = max(deadline, time.perf_counter()) + session.interval
+            frames = sys._current_frames()
+            if frames.keys() - names.keys():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                name = names.get(ident, str(ident))
+                if ident == own or (session.threads is not None and name not in session.threads):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                    stack.append(f"{module}:{getattr(code, 'co_qualname', code.co_name)}")
+                    frame = frame.f_back
+                stack.append(name)
+                session.stacks[";".join(reversed(stack)).replace(" ", "_")] += 1
+            session.samples += 1
+            del frames
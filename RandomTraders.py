@@ -1,21 +1,40 @@
 import random
 import time
+import numpy as np
 from StockExchange import StockExchange
+import EventLog
 from config import STOCK_SETTINGS, ADVANCED_SETTINGS
 
+logger = EventLog.get_logger(__name__)
+
 class RandomTraders:
     """Simulates random traders placing orders on a stock exchange."""
     
-    def __init__(self, exchange, stock_id, num_traders=10, initial_balance=10000):
+    def __init__(self, exchange, stock_id, num_traders=10, initial_balance=10000, seed=None,
+                 buy_probability=None, limit_order_probability=None, verbose=True):
         self.exchange = exchange
         self.stock_id = stock_id
         self.num_traders = num_traders
         self.trader_ids = []
+        self.rng = random.Random(seed) # drives the per-order mode; seed it for reproducible runs
+        self.np_rng = np.random.default_rng(seed) # drives the vectorized generation mode
+        self.verbose = verbose # log each order placed by place_random_order, at DEBUG
+        
+        # Order mix, defaulting to ADVANCED_SETTINGS
+        if buy_probability is None:
+            buy_probability = ADVANCED_SETTINGS["buy_probability"]
+        if limit_order_probability is None:
+            limit_order_probability = ADVANCED_SETTINGS["limit_order_probability"]
+        self.buy_probability = buy_probability
+        self.limit_order_probability = limit_order_probability
         
-        # Create traders with initial balances
+        # Create traders with initial balances (traders already on the exchange,
+        # e.g. after replaying a journal, keep theirs)
         for i in range(1, num_traders + 1):
-            self.exchange.add_user(i, initial_balance)
+            if i not in self.exchange.users_balances:
+                self.exchange.add_user(i, initial_balance)
             self.trader_ids.append(i)
+        self._trader_id_array = np.array(self.trader_ids)
     
     def get_random_price_around_market(self, base_price, percentage=None):
         """Generate a random price within percentage of base price."""
@@ -23,89 +42,156 @@ class RandomTraders:
             percentage = STOCK_SETTINGS["price_variation_percent"]
             
         if base_price is None:
-            return random.uniform(90, 110)  # Default range if no market price
+            return self.rng.uniform(90, 110)  # Default range if no market price
         
         variation = base_price * (percentage / 100)
-        return random.uniform(base_price - variation, base_price + variation)
+        return self.rng.uniform(base_price - variation, base_price + variation)
     
-    def place_random_order(self, trader_id):
-        """Place a random order for a trader based on config probabilities."""
-        try:
-            user_balance = self.exchange.get_user_balance(trader_id)
-            user_portfolio = self.exchange.get_user_portfolio(trader_id)
-            user_stock_quantity = user_portfolio.get(self.stock_id, 0)
-            
-            # Determine bid or ask based on config probability
-            bid_or_ask = "bid" if random.random() < ADVANCED_SETTINGS["buy_probability"] else "ask"
+    def draw_random_order(self, trader_id):
+        """Draw a random order for a trader based on the order mix, without placing it.
+
+        Returns (bid_or_ask, order_type, quantity, order_price), or None if the
+        trader cannot trade right now.
+        """
+        user_balance = self.exchange.get_user_balance(trader_id)
+        user_portfolio = self.exchange.get_user_portfolio(trader_id)
+        user_stock_quantity = user_portfolio.get(self.stock_id, 0)
+        
+        # Determine bid or ask based on the buy probability
+        bid_or_ask = "bid" if self.rng.random() < self.buy_probability else "ask"
 
-            # Check if the trader can make the trade
-            if bid_or_ask == "bid" and user_balance < ADVANCED_SETTINGS["min_balance_for_trading"]:
-                return None  # Not enough money to buy
-            if bid_or_ask == "ask" and user_stock_quantity < ADVANCED_SETTINGS["min_stock_for_selling"]:
-                return None  # No stock to sell
+        # Check if the trader can make the trade
+        if bid_or_ask == "bid" and user_balance < ADVANCED_SETTINGS["min_balance_for_trading"]:
+            return None  # Not enough money to buy
+        if bid_or_ask == "ask" and user_stock_quantity < ADVANCED_SETTINGS["min_stock_for_selling"]:
+            return None  # No stock to sell
 
-            # Determine order type (limit or market)
-            order_type = "limit" if random.random() < ADVANCED_SETTINGS["limit_order_probability"] else "market"
-            
-            # Generate a price for limit orders
-            current_price = self.exchange.get_stock_price(self.stock_id)
-            if current_price is None:
-                return None # Can't trade without a price
+        # Determine order type (limit or market)
+        order_type = "limit" if self.rng.random() < self.limit_order_probability else "market"
+        
+        # Generate a price for limit orders
+        current_price = self.exchange.get_stock_price(self.stock_id)
+        if current_price is None:
+            return None # Can't trade without a price
+        
+        order_price = None
+        if order_type == "limit":
+            # Snap to the tick grid so the affordability check matches the book price
+            order_price = self.exchange.round_to_tick(self.stock_id, self.get_random_price_around_market(current_price))
+
+        # Generate random quantity
+        max_qty = STOCK_SETTINGS["max_order_quantity"]
+        quantity = 0
+        if bid_or_ask == "bid":
+            effective_price = order_price if order_type == 'limit' else self.exchange.get_lowest_ask(self.stock_id)
+            if not effective_price or effective_price <= 0:
+                return None # Cannot determine price, so cannot buy
             
-            order_price = None
-            if order_type == "limit":
-                order_price = self.get_random_price_around_market(current_price)
-
-            # Generate random quantity
-            max_qty = STOCK_SETTINGS["max_order_quantity"]
-            quantity = 0
-            if bid_or_ask == "bid":
-                effective_price = order_price if order_type == 'limit' else self.exchange.get_lowest_ask(self.stock_id)
-                if not effective_price or effective_price <= 0:
-                    return None # Cannot determine price, so cannot buy
-                
-                max_affordable = int(user_balance / effective_price)
-                if max_affordable == 0:
-                    return None # Cannot afford any
-                quantity = random.randint(1, min(max_qty, max_affordable))
-            else: # ask
-                if user_stock_quantity == 0:
-                    return None # Nothing to sell
-                quantity = random.randint(1, min(max_qty, user_stock_quantity))
-
-            if quantity == 0:
+            max_affordable = int(user_balance / effective_price)
+            if max_affordable == 0:
+                return None # Cannot afford any
+            quantity = self.rng.randint(1, min(max_qty, max_affordable))
+        else: # ask
+            if user_stock_quantity == 0:
+                return None # Nothing to sell
+            quantity = self.rng.randint(1, min(max_qty, user_stock_quantity))
+
+        if quantity == 0:
+            return None
+        return bid_or_ask, order_type, quantity, order_price
+
+    def place_random_order(self, trader_id):
+        """Place a random order for a trader based on the order mix."""
+        try:
+            order = self.draw_random_order(trader_id)
+            if order is None:
                 return None
+            bid_or_ask, order_type, quantity, order_price = order
 
             # Place the order
             result = self.exchange.place_order(
                 self.stock_id, trader_id, bid_or_ask, order_type, quantity, order_price
             )
             
-            # Print order details
-            if result:
-                order_details = f"Trader {trader_id}: Placed {order_type} {bid_or_ask} for {quantity} shares"
-                if order_type == "limit":
-                    order_details += f" @ ${order_price:.2f}"
-                
-                if bid_or_ask == "bid":
-                    bought, spent = result
-                    if bought > 0:
-                        order_details += f" -> BOUGHT {bought} for ${spent:.2f}"
-                else:
-                    sold, earned = result
-                    if sold > 0:
-                        order_details += f" -> SOLD {sold} for ${earned:.2f}"
-                
-                print(order_details)
+            # Log order details; the level check keeps this nearly free when DEBUG is off
+            if result and self.verbose and logger.enabled_for(EventLog.DEBUG):
+                filled, value, order_id = result
+                logger.debug("Trader %s: Placed %s %s for %s shares", trader_id, order_type, bid_or_ask, quantity,
+                             trader_id=trader_id, order_id=order_id, side=bid_or_ask, order_type=order_type,
+                             quantity=quantity, price=order_price, filled=filled, value=round(value, 2))
                     
             return result
                     
         except Exception as e:
             # Silently handle non-critical errors but log serious validation errors
             if "not enough" in str(e).lower() or "insufficient" in str(e).lower():
-                print(f"Warning: Trader {trader_id} validation failed: {e}")
+                logger.warning("Trader %s validation failed: %s", trader_id, e)
             return None
     
+    def generate_orders(self, num_orders):
+        """Draw a whole tick of random orders at once as a columnar batch.
+
+        Follows the same config probabilities as place_random_order, but trader IDs,
+        sides, order types, price offsets and quantities are drawn with one NumPy call
+        each, and quantities are capped against vectorized balance and holding arrays
+        sampled at the start of the tick. Orders that cannot be funded are dropped.
+        Returns a batch for StockExchange.place_orders, or None if nothing can trade.
+        """
+        rng = self.np_rng
+        current_price = self.exchange.get_stock_price(self.stock_id)
+        if current_price is None:
+            return None # Can't trade without a price
+        lowest_ask = self.exchange.get_lowest_ask(self.stock_id)
+        tick_size = self.exchange.get_tick_size(self.stock_id)
+
+        trader_ids = self._trader_id_array[rng.integers(0, len(self._trader_id_array), num_orders)]
+        is_bid = rng.random(num_orders) < self.buy_probability
+        is_limit = rng.random(num_orders) < self.limit_order_probability
+
+        # Limit prices within price_variation_percent of the market, snapped to ticks
+        variation = STOCK_SETTINGS["price_variation_percent"] / 100
+        raw_prices = current_price * (1 + rng.uniform(-variation, variation, num_orders))
+        prices = np.maximum(np.rint(raw_prices / tick_size), 1) * tick_size
+
+        balances = self.exchange.get_user_balances(trader_ids)
+        holdings = self.exchange.get_user_holdings(trader_ids, self.stock_id)
+
+        # Bids are capped by what the balance buys at the limit price (or best ask)
+        effective_prices = np.where(is_limit, prices, lowest_ask if lowest_ask else np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            max_affordable = np.floor(balances / effective_prices)
+        max_affordable = np.nan_to_num(max_affordable, nan=0).astype(np.int64)
+        caps = np.where(is_bid, max_affordable, holdings)
+        caps = np.minimum(caps, STOCK_SETTINGS["max_order_quantity"])
+
+        tradable = caps >= 1
+        tradable &= np.where(is_bid,
+                             balances >= ADVANCED_SETTINGS["min_balance_for_trading"],
+                             holdings >= ADVANCED_SETTINGS["min_stock_for_selling"])
+        if not tradable.any():
+            return None
+
+        caps = caps[tradable]
+        quantities = 1 + (rng.random(len(caps)) * caps).astype(np.int64)
+        return {
+            "stock": [self.stock_id] * len(caps),
+            "user": trader_ids[tradable],
+            "side": np.where(is_bid[tradable], 0, 1),
+            "type": is_limit[tradable].astype(np.int64),
+            "qty": quantities,
+            "price": prices[tradable],
+        }
+
+    def place_random_orders(self, num_orders):
+        """Generate a tick of random orders in one vectorized draw and submit them as a batch.
+
+        Returns the per-order results from StockExchange.place_orders, or None.
+        """
+        batch = self.generate_orders(num_orders)
+        if batch is None:
+            return None
+        return self.exchange.place_orders(batch)
+
     def simulate_trading_session(self, duration_seconds=60, orders_per_second=2):
         """Simulate a trading session with random orders."""
         print(f"Starting trading simulation for {duration_seconds} seconds...")
@@ -118,7 +204,7 @@ class RandomTraders:
         while time.time() - start_time < duration_seconds:
             # Place random orders
             for _ in range(orders_per_second):
-                trader_id = random.choice(self.trader_ids)
+                trader_id = self.rng.choice(self.trader_ids)
                 self.place_random_order(trader_id)
                 order_count += 1
             
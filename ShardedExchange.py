@@ -0,0 +1,403 @@
+import multiprocessing
+import os
+import zlib
+import numpy as np
+from StockExchange import StockExchange, SIDE_CODES, ORDER_TYPE_CODES, ORDER_ACCEPTED
+
+def shard_of(stock_id, num_shards):
+    """Stable shard index of a stock ID (the same in every process and run)."""
+    return zlib.crc32(str(stock_id).encode("utf-8")) % num_shards
+
+# Worker side
+
+def _credit(exchange, credit):
+    """Add cash lent by the central ledger (or take it back, if negative) to users' free balances."""
+    for user_id, amount in credit.items():
+        exchange.users_balances[user_id] += amount
+    if credit:
+        exchange._touch(None, credit)
+
+def _place_order(exchange, credit, args):
+    _credit(exchange, credit)
+    result = exchange.place_order(*args)
+    user_id = args[1]
+    return result, {user_id: exchange.users_balances[user_id]}, {args[0]: exchange.get_lowest_ask(args[0])}
+
+def _place_orders(exchange, credit, batch):
+    _credit(exchange, credit)
+    results = exchange.place_orders(batch)
+    balances = {user_id: exchange.users_balances[user_id] for user_id in set(batch["user"])}
+    asks = {stock_id: exchange.get_lowest_ask(stock_id) for stock_id in set(batch["stock"])}
+    return results, balances, asks
+
+def _sweep(exchange, keep):
+    """Take every user's free cash above keep out of the shard and return the amounts."""
+    swept = {}
+    for user_id, balance in exchange.users_balances.items():
+        if balance > keep:
+            swept[user_id] = balance - keep
+    _credit(exchange, {user_id: -amount for user_id, amount in swept.items()})
+    return swept
+
+def _add_users(exchange, user_ids):
+    for user_id in user_ids:
+        exchange.add_user(user_id, 0)
+
+def _totals(exchange):
+    return exchange.get_total_money(), exchange.get_share_totals()
+
+# Plain dicts, so a compact ledger's row view does not pickle the whole ledger with it
+def _user_portfolio(exchange, user_id):
+    return dict(exchange.get_user_portfolio(user_id))
+
+def _user_reserved(exchange, user_id):
+    balance, holdings = exchange.get_user_reserved(user_id)
+    return balance, dict(holdings)
+
+WORKER_OPERATIONS = {
+    "place_order": _place_order,
+    "place_orders": _place_orders,
+    "sweep": _sweep,
+    "add_users": _add_users,
+    "totals": _totals,
+    "get_user_portfolio": _user_portfolio,
+    "get_user_reserved": _user_reserved,
+}
+
+def _serve(connection, ledger):
+    """Worker process loop: apply (method, args) messages to a private StockExchange."""
+    exchange = StockExchange(ledger=ledger)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        method, args = message
+        try:
+            operation = WORKER_OPERATIONS.get(method)
+            if operation is not None:
+                result = operation(exchange, *args)
+            else:
+                result = getattr(exchange, method)(*args)
+        except Exception as error:
+            # Keep serving; the coordinator raises the same type of error
+            connection.send((False, (type(error), str(error))))
+        else:
+            connection.send((True, result))
+    connection.close()
+
+# Coordinator side
+
+class ShardedExchange:
+    """Order books partitioned by stock across worker processes.
+
+    Each worker runs an ordinary StockExchange for the stocks routed to it
+    (see shard_of), so matching for different stocks runs on different cores.
+    Shares never leave their stock's shard. Cash lives in a central ledger in
+    this process and is lent to shards as per-user credit: before an order is
+    sent, a bid's notional (limit price, or the shard's last reported best ask
+    for a market bid, fetched from the shard if none is known) is topped up on
+    that shard in steps of at least credit_chunk. sweep() pulls free cash back
+    to the centre and runs automatically every sweep_every batches, so proceeds
+    from selling on one shard can fund buying on another.
+
+    The API follows StockExchange. Order IDs are made global by encoding the
+    shard: global_id = local_id * num_shards + shard. place_orders sends each
+    shard its part of a batch before waiting for any reply, which is where the
+    parallelism comes from; single place_order calls are a round trip each.
+    User IDs must be picklable and stock IDs are routed by their str().
+    """
+
+    def __init__(self, num_shards=None, ledger="dict", credit_chunk=1_000.0, sweep_every=100, start_method=None):
+        self.num_shards = num_shards or os.cpu_count() or 1
+        self.credit_chunk = credit_chunk
+        self.sweep_every = sweep_every
+        self.central_balances = {} # free cash not lent to any shard, per user_id
+        self.shard_balances = [{} for _ in range(self.num_shards)] # last reported free cash per user on each shard
+        self.ask_hints = {} # last reported lowest ask per stock, used to fund market bids
+        self.stocks = set()
+        self.issued_money = 0 # initial balances given to users
+        self.issued_shares = {} # shares issued per stock at its IPO
+        self._batches = 0
+
+        context = multiprocessing.get_context(start_method)
+        self._connections = []
+        self._processes = []
+        for _ in range(self.num_shards):
+            parent_end, child_end = context.Pipe()
+            process = context.Process(target=_serve, args=(child_end, ledger), daemon=True)
+            process.start()
+            child_end.close()
+            self._connections.append(parent_end)
+            self._processes.append(process)
+        self.central_balances[0] = 0 # The market user_id, which every worker's exchange already has
+
+    def close(self):
+        """Stop the worker processes."""
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join()
+        self._connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _call(self, shard, method, *args):
+        self._connections[shard].send((method, args))
+        return self._receive(shard)
+
+    def _receive(self, shard):
+        ok, result = self._connections[shard].recv()
+        if not ok:
+            error_type, message = result
+            raise error_type(message)
+        return result
+
+    def _broadcast(self, method, *args):
+        """Send the same call to every shard, then collect the results in shard order."""
+        for connection in self._connections:
+            connection.send((method, args))
+        return [self._receive(shard) for shard in range(self.num_shards)]
+
+    def _shard(self, stock_id):
+        if stock_id not in self.stocks:
+            raise ValueError("Stock does not exist.")
+        return shard_of(stock_id, self.num_shards)
+
+    def _order_shard(self, order_id):
+        return order_id % self.num_shards, order_id // self.num_shards
+
+    def _global_order_id(self, shard, local_id):
+        return local_id * self.num_shards + shard if local_id else 0
+
+    def _fund(self, shard, needs):
+        """Move cash from the central ledger to a shard so each user can cover needs[user_id]."""
+        credit = {}
+        shard_balances = self.shard_balances[shard]
+        for user_id, need in needs.items():
+            missing = need - shard_balances.get(user_id, 0)
+            if missing > 0:
+                amount = min(max(missing, self.credit_chunk), self.central_balances[user_id])
+                if amount > 0:
+                    self.central_balances[user_id] -= amount
+                    shard_balances[user_id] = shard_balances.get(user_id, 0) + amount
+                    credit[user_id] = amount
+        return credit
+
+    def _bid_notional(self, stock_id, order_type, quantity, order_price):
+        if order_type == "limit":
+            return order_price * quantity
+        ask = self.ask_hints.get(stock_id)
+        if ask is None:
+            # Nothing reported for this stock yet, so ask its shard
+            ask = self.ask_hints[stock_id] = self.get_lowest_ask(stock_id)
+        return ask * quantity if ask else 0
+
+    def ipo_stock(self, stock_id, quantity, price=100, tick_size=0.01, ladder="sorted"):
+        """Initial Public Offering for a stock on its shard."""
+        shard = shard_of(stock_id, self.num_shards)
+        self._call(shard, "ipo_stock", stock_id, quantity, price, tick_size, ladder)
+        self.stocks.add(stock_id)
+        self.issued_shares[stock_id] = quantity
+
+    def add_user(self, user_id, initial_balance=0):
+        """Add a user with an initial balance, held by the central ledger."""
+        self.add_users([user_id], initial_balance)
+
+    def add_users(self, user_ids, initial_balance=0):
+        """Add several users with the same initial balance in one round trip per shard."""
+        user_ids = list(user_ids)
+        if initial_balance < 0:
+            raise ValueError("Initial balance cannot be negative.")
+        if any(user_id in self.central_balances for user_id in user_ids) or len(set(user_ids)) != len(user_ids):
+            raise ValueError("User already exists.")
+        self._broadcast("add_users", user_ids)
+        for user_id in user_ids:
+            self.central_balances[user_id] = initial_balance
+        self.issued_money += initial_balance * len(user_ids)
+
+    def place_order(self, stock_id, user_id, bid_or_ask, order_type, quantity, order_price=None):
+        """Place an order on the stock's shard. Returns (filled_quantity, total_value, order_id)."""
+        shard = self._shard(stock_id)
+        if user_id not in self.central_balances:
+            raise ValueError("User does not exist.")
+        credit = {}
+        if bid_or_ask == "bid" and quantity and quantity > 0 and (order_type != "limit" or order_price):
+            credit = self._fund(shard, {user_id: self._bid_notional(stock_id, order_type, quantity, order_price)})
+        # A rejected order leaves its credit on the shard; the next sweep returns it
+        (filled, value, local_id), balances, asks = self._call(
+            shard, "place_order", credit, (stock_id, user_id, bid_or_ask, order_type, quantity, order_price))
+        self.shard_balances[shard].update(balances)
+        self.ask_hints.update(asks)
+        return filled, value, self._global_order_id(shard, local_id)
+
+    def place_orders(self, batch):
+        """Place a columnar batch (see StockExchange.place_orders) across the shards in parallel.
+
+        Each shard receives its orders in submission order; orders for different
+        stocks are not ordered relative to each other. Returns the same dict of
+        arrays as StockExchange.place_orders, with global order IDs.
+        """
+        columns = []
+        for name in ("stock", "user", "side", "type", "qty", "price"):
+            column = batch[name]
+            columns.append(column.tolist() if isinstance(column, np.ndarray) else list(column))
+        stock_ids, user_ids, sides, order_types, quantities, prices = columns
+        n = len(stock_ids)
+        if not (len(user_ids) == len(sides) == len(order_types) == len(quantities) == len(prices) == n):
+            raise ValueError("All batch columns must have the same length.")
+        if not set(stock_ids) <= self.stocks:
+            raise ValueError("Stock does not exist.")
+        if not set(user_ids) <= self.central_balances.keys():
+            raise ValueError("User does not exist.")
+
+        # Split the batch by shard and work out the cash each user needs there
+        positions = [[] for _ in range(self.num_shards)]
+        needs = [{} for _ in range(self.num_shards)]
+        for i in range(n):
+            shard = shard_of(stock_ids[i], self.num_shards)
+            positions[shard].append(i)
+            if SIDE_CODES.get(sides[i]) == "bid":
+                order_type = ORDER_TYPE_CODES.get(order_types[i])
+                price = prices[i] if order_type == "limit" else None
+                if quantities[i] > 0 and (order_type != "limit" or (price is not None and price > 0)):
+                    shard_needs = needs[shard]
+                    shard_needs[user_ids[i]] = shard_needs.get(user_ids[i], 0) + \
+                        self._bid_notional(stock_ids[i], order_type, quantities[i], price)
+
+        sent = []
+        for shard, shard_positions in enumerate(positions):
+            if not shard_positions:
+                continue
+            credit = self._fund(shard, needs[shard])
+            shard_batch = {name: [column[i] for i in shard_positions]
+                           for name, column in zip(("stock", "user", "side", "type", "qty", "price"), columns)}
+            self._connections[shard].send(("place_orders", (credit, shard_batch)))
+            sent.append(shard)
+
+        filled = np.zeros(n, dtype=np.int64)
+        value = np.zeros(n, dtype=np.float64)
+        order_ids = np.zeros(n, dtype=np.int64)
+        status = np.full(n, ORDER_ACCEPTED, dtype=np.int8)
+        error = None
+        for shard in sent:
+            try:
+                results, balances, asks = self._receive(shard)
+            except Exception as shard_error:
+                error = shard_error # keep draining the other shards
+                continue
+            self.shard_balances[shard].update(balances)
+            self.ask_hints.update(asks)
+            index = np.array(positions[shard])
+            filled[index] = results["filled"]
+            value[index] = results["value"]
+            local_ids = results["order_id"]
+            order_ids[index] = np.where(local_ids > 0, local_ids * self.num_shards + shard, 0)
+            status[index] = results["status"]
+        if error is not None:
+            raise error
+
+        self._batches += 1
+        if self.sweep_every and self._batches % self.sweep_every == 0:
+            self.sweep()
+        return {"filled": filled, "value": value, "order_id": order_ids, "status": status}
+
+    def sweep(self, keep=0):
+        """Return free cash above keep per user from every shard to the central ledger."""
+        for shard, swept in enumerate(self._broadcast("sweep", keep)):
+            shard_balances = self.shard_balances[shard]
+            for user_id, amount in swept.items():
+                self.central_balances[user_id] += amount
+                shard_balances[user_id] = keep
+            # Users with nothing to sweep hold at most keep on the shard
+            for user_id, balance in shard_balances.items():
+                if user_id not in swept:
+                    shard_balances[user_id] = min(balance, keep)
+
+    def cancel_order(self, order_id):
+        """Cancel a resting order. Returns the quantity that was still open."""
+        shard, local_id = self._order_shard(order_id)
+        return self._call(shard, "cancel_order", local_id)
+
+    def amend_order(self, order_id, new_qty):
+        """Change the open quantity of a resting order; the shard must hold enough credit or shares."""
+        shard, local_id = self._order_shard(order_id)
+        return self._call(shard, "amend_order", local_id, new_qty)
+
+    def transfer_stock(self, from_user_id, to_user_id, stock_id, quantity):
+        """Transfer stock between users on the stock's shard."""
+        self._call(self._shard(stock_id), "transfer_stock", from_user_id, to_user_id, stock_id, quantity)
+
+    def transfer_money(self, from_user_id, to_user_id, amount):
+        """Transfer money between users in the central ledger, sweeping the shards first if needed."""
+        if from_user_id not in self.central_balances or to_user_id not in self.central_balances:
+            raise ValueError("One of the users does not exist.")
+        if amount <= 0:
+            raise ValueError("Amount must be greater than zero.")
+        if self.central_balances[from_user_id] < amount:
+            self.sweep()
+        if self.central_balances[from_user_id] < amount:
+            raise ValueError(f"Not enough balance to transfer. Has {self.central_balances[from_user_id]}, needs {amount}")
+        self.central_balances[from_user_id] -= amount
+        self.central_balances[to_user_id] += amount
+
+    def get_user_balance(self, user_id):
+        """Get a user's available cash: central balance plus free credit on every shard."""
+        if user_id not in self.central_balances:
+            raise ValueError("User does not exist.")
+        return self.central_balances[user_id] + sum(self._broadcast("get_user_balance", user_id))
+
+    def get_user_portfolio(self, user_id):
+        """Get a user's free holdings across all shards."""
+        if user_id not in self.central_balances:
+            raise ValueError("User does not exist.")
+        portfolio = {}
+        for shard_portfolio in self._broadcast("get_user_portfolio", user_id):
+            portfolio.update(shard_portfolio)
+        return portfolio
+
+    def get_user_reserved(self, user_id):
+        """Get (reserved balance, reserved holdings) across all shards."""
+        if user_id not in self.central_balances:
+            raise ValueError("User does not exist.")
+        reserved_balance = 0
+        reserved_holdings = {}
+        for balance, holdings in self._broadcast("get_user_reserved", user_id):
+            reserved_balance += balance
+            reserved_holdings.update(holdings)
+        return reserved_balance, reserved_holdings
+
+    def get_stock_price(self, stock_id):
+        return self._call(self._shard(stock_id), "get_stock_price", stock_id)
+
+    def get_last_traded_price(self, stock_id):
+        return self._call(self._shard(stock_id), "get_last_traded_price", stock_id)
+
+    def get_lowest_ask(self, stock_id):
+        return self._call(self._shard(stock_id), "get_lowest_ask", stock_id)
+
+    def get_highest_bid(self, stock_id):
+        return self._call(self._shard(stock_id), "get_highest_bid", stock_id)
+
+    def get_depth(self, stock_id, side, n_levels):
+        return self._call(self._shard(stock_id), "get_depth", stock_id, side, n_levels)
+
+    def get_tick_size(self, stock_id):
+        return self._call(self._shard(stock_id), "get_tick_size", stock_id)
+
+    def verify_conservation(self, tolerance=1e-6):
+        """Whether money across the central ledger and all shards, and each stock's shares, still add up to what was issued."""
+        total_money = sum(self.central_balances.values())
+        stock_totals = {}
+        for shard_money, shard_stocks in self._broadcast("totals"):
+            total_money += shard_money
+            stock_totals.update(shard_stocks)
+        if abs(total_money - self.issued_money) > tolerance * max(self.issued_money, 1):
+            return False
+        return all(stock_totals.get(stock_id, 0) == issued for stock_id, issued in self.issued_shares.items())
@@ -1,94 +1,616 @@
-from sortedcontainers import SortedDict
+from contextlib import contextmanager, nullcontext
+from decimal import Decimal
+import gc
+from itertools import count
+import threading
+import numpy as np
+import EventLog
+import ExchangeSnapshot
+from Journal import read_journal
+from Ledger import ArrayLedger
+from PriceLadder import LADDERS, PriceLevel
+
+logger = EventLog.get_logger(__name__)
+
+# Per-order status codes returned by StockExchange.place_orders
+ORDER_ACCEPTED = 0
+ORDER_REJECTED = 1
+
+# Batch columns may use the strings or these integer codes
+SIDE_CODES = {"bid": "bid", "ask": "ask", 0: "bid", 1: "ask"}
+ORDER_TYPE_CODES = {"market": "market", "limit": "limit", 0: "market", 1: "limit"}
+
+class Order:
+    """A resting order in the book, addressed by its order ID."""
+    __slots__ = ("order_id", "stock_id", "user_id", "bid_or_ask", "tick", "quantity")
+
+    def __init__(self, order_id, stock_id, user_id, bid_or_ask, tick, quantity):
+        self.order_id = order_id
+        self.stock_id = stock_id
+        self.user_id = user_id
+        self.bid_or_ask = bid_or_ask
+        self.tick = tick # limit price in integer ticks
+        self.quantity = quantity
+
+    def __repr__(self):
+        return f"Order({self.order_id}, user={self.user_id}, {self.bid_or_ask} {self.quantity} @ tick {self.tick})"
+
+# Stands in for the second lock of a pair of users that share a stripe
+_NO_LOCK = nullcontext()
+
+class ChangeSet:
+    """Stocks and users touched since a consumer last drained it.
+
+    Obtained from StockExchange.track_changes(); every book or ledger mutation adds
+    to all registered change sets so each consumer sees its own dirty sets. A
+    change set created with levels=True also collects the (stock_id, side, tick)
+    price levels whose aggregate quantity may have changed.
+    """
+
+    def __init__(self, lock, levels=False):
+        self.stocks = set()
+        self.users = set()
+        self.levels = set() if levels else None
+        self._lock = lock # the exchange lock that guards additions
+
+    def drain(self):
+        """Return (stocks, users) changed since the last drain and start over."""
+        with self._lock:
+            stocks, users = self.stocks, self.users
+            self.stocks, self.users = set(), set()
+        return stocks, users
+
+    def drain_levels(self):
+        """Return the price levels changed since the last drain_levels and start over."""
+        with self._lock:
+            levels = self.levels
+            self.levels = set()
+        return levels
 
 class StockExchange:
-    """A simple order book for multiple stock trading simulation."""
+    """A simple order book for multiple stock trading simulation.
+
+    ledger selects how balances and holdings are stored: 'dict' (a dict per user)
+    or 'compact' (an ArrayLedger of NumPy arrays indexed by dense user and stock
+    indices, for large numbers of traders). Both are accessed through the same
+    users_balances/users_portfolios mappings.
+
+    If journal is a Journal, every accepted command is appended to it so the
+    state can be rebuilt with StockExchange.replay.
+
+    The exchange can be driven from several threads. Each book has its own lock
+    and users' cash is guarded by lock_stripes striped locks, so orders on
+    different stocks match in parallel and only serialize on the cash rows they
+    share. Locks are always taken book first, then stripes in stripe order.
+    Holdings of a stock only change under its book lock. Adding users or stocks,
+    snapshots and whole-ledger totals hold every lock (see locked()). With
+    several matching threads the journal records orders in admission order,
+    which replays exactly as long as no user's cash is contended across stocks.
+    """
     
-    def __init__(self):
-        self.stocks = {} # contains SortedDicts bids and asks for each stock
-        self.users_balances = {} # contains money in bank of each user_id
-        self.users_portfolios = {} # contains dict of stocks in portfolio of each user_id
+    def __init__(self, ledger="dict", journal=None, lock_stripes=64):
+        if ledger not in ("dict", "compact"):
+            raise ValueError("ledger must be 'dict' or 'compact'.")
+        self.stocks = {} # contains bid and ask PriceLadders for each stock, price tick -> PriceLevel of order_id -> Order
+        self.orders = {} # index of resting orders by order_id
+        self._order_ids = count(1) # source of stable order IDs
+        self.ledger = ArrayLedger() if ledger == "compact" else None
+        if self.ledger is None:
+            self.users_balances = {} # contains money in bank of each user_id
+            self.users_portfolios = {} # contains dict of stocks in portfolio of each user_id
+            self.reserved_balances = {} # money escrowed behind each user_id's resting bids
+            self.reserved_holdings = {} # dict of stocks escrowed behind each user_id's resting asks
+        else:
+            # Same mappings, backed by the ledger's arrays
+            self.users_balances = self.ledger.balance_view("balances")
+            self.users_portfolios = self.ledger.holdings_view("holdings")
+            self.reserved_balances = self.ledger.balance_view("reserved_balances")
+            self.reserved_holdings = self.ledger.holdings_view("reserved_holdings")
         self.last_traded_prices = {} # track last traded price for each stock
+        self.trade_count = 0 # fills executed since the exchange was created
+        self.order_count = 0 # orders accepted
+        self.reject_count = 0 # orders rejected because the user could not cover them
+        self.cancel_count = 0 # resting orders cancelled
+        self.issued_money = 0 # initial balances given to users, what all cash must add up to
+        self.issued_shares = {} # shares issued per stock at its IPO
+        self.sequence = 0 # bumped on every book or ledger mutation
+        self._change_sets = [] # ChangeSets handed out by track_changes
+        self._trade_listeners = () # callables fed every fill, see add_trade_listener
+        self.user_locks = [threading.RLock() for _ in range(lock_stripes)] # cash stripes, by hash(user_id)
+        self._structure_lock = threading.RLock() # serializes locked() callers
+        self._meta_lock = threading.Lock() # order IDs, journal admission, sequence and change sets; taken last
+        self.journal = None
         self.add_user(0) # The market user_id
+        self.journal = journal # set after the market user, which every exchange creates itself
+
+    @classmethod
+    def replay(cls, path, ledger="dict", journal=None, base=None):
+        """Rebuild an exchange by re-applying the commands recorded in a journal file.
+
+        Order IDs, book queues and balances come out exactly as they were when the
+        journal was written. Pass journal (usually a Journal reopened on the same
+        path) to keep recording on the rebuilt exchange. If the journal was started
+        on a restored exchange, base is the snapshot it was restored from.
+        """
+        exchange = cls(ledger=ledger) if base is None else cls.restore(base, ledger=ledger)
+        for method, args in read_journal(path):
+            getattr(exchange, method)(*args)
+        exchange.journal = journal
+        return exchange
+
+    def snapshot(self, path=None):
+        """Serialize books, balances, holdings and last prices to the binary snapshot format.
+
+        Returns the snapshot as bytes, or writes it to path if one is given. The
+        format is a JSON header followed by aligned NumPy sections (see
+        ExchangeSnapshot), so restore can memory-map a file instead of parsing it.
+        """
+        with self.locked():
+            return self._snapshot(path)
+
+    def _snapshot(self, path):
+        users = list(self.users_balances)
+        stock_ids = list(self.stocks)
+        if self.ledger is not None:
+            ledger = self.ledger
+            rows = ledger.rows(users)
+            columns = [ledger.stock_index[stock_id] for stock_id in stock_ids]
+            balances = ledger.balances[rows]
+            reserved_balances = ledger.reserved_balances[rows]
+            holdings = ledger.holdings[np.ix_(rows, columns)]
+            reserved_holdings = ledger.reserved_holdings[np.ix_(rows, columns)]
+        else:
+            balances = np.array([self.users_balances[user_id] for user_id in users], dtype=np.float64)
+            reserved_balances = np.array([self.reserved_balances[user_id] for user_id in users], dtype=np.float64)
+            holdings = np.zeros((len(users), len(stock_ids)), dtype=np.int64)
+            reserved_holdings = np.zeros((len(users), len(stock_ids)), dtype=np.int64)
+            for column, stock_id in enumerate(stock_ids):
+                for row, user_id in enumerate(users):
+                    holdings[row, column] = self.users_portfolios[user_id].get(stock_id, 0)
+                    reserved_holdings[row, column] = self.reserved_holdings[user_id].get(stock_id, 0)
+
+        # Resting orders in book order, so restore can rebuild each level in one go
+        user_rows = {user_id: row for row, user_id in enumerate(users)}
+        rows = []
+        for column, stock_id in enumerate(stock_ids):
+            for side_code, side in enumerate(("bids", "asks")):
+                for tick, level in self.stocks[stock_id][side].items():
+                    for order in level.values():
+                        rows.append((order.order_id, column, user_rows[order.user_id], side_code, tick, order.quantity))
+        orders = np.array(rows, dtype=ExchangeSnapshot.ORDER_DTYPE)
+
+        next_order_id = next(self._order_ids)
+        self._order_ids = count(next_order_id)
+        header = {
+            "next_order_id": next_order_id,
+            "users": users,
+            "stocks": [{
+                "stock_id": stock_id,
+                "tick_size": self.stocks[stock_id]["tick_size"],
+                "ladder": self.stocks[stock_id]["ladder"],
+                "last_price": self.last_traded_prices.get(stock_id),
+            } for stock_id in stock_ids],
+        }
+        data = ExchangeSnapshot.encode(header, {
+            "balances": balances,
+            "reserved_balances": reserved_balances,
+            "holdings": holdings,
+            "reserved_holdings": reserved_holdings,
+            "orders": orders,
+        })
+        if path is None:
+            return data
+        with open(path, "wb") as f:
+            f.write(data)
 
-    def ipo_stock(self, stock_id, quantity, price=100):
-        """Initial Public Offering for a stock. Sets the initial price."""
-        if stock_id in self.stocks:
-            raise ValueError("Stock already exists.")
+    @classmethod
+    def restore(cls, source, ledger="dict", journal=None):
+        """Build an exchange from snapshot bytes or a snapshot file written by snapshot().
+
+        Levels and ledger rows are loaded directly from the snapshot's arrays; no
+        order goes through matching, so large prebuilt books load quickly. A
+        journal passed here records commands from the restored state onward.
+        """
+        header, arrays = ExchangeSnapshot.decode(source)
+        exchange = cls(ledger=ledger)
+        users = header["users"]
+        stock_ids = [stock["stock_id"] for stock in header["stocks"]]
+
+        for stock in header["stocks"]:
+            exchange.stocks[stock["stock_id"]] = exchange._new_book(stock["tick_size"], stock["ladder"])
+            exchange.last_traded_prices[stock["stock_id"]] = stock["last_price"]
+
+        # Ledger
+        if exchange.ledger is not None:
+            exchange.ledger.load(users, stock_ids, arrays["balances"], arrays["reserved_balances"],
+                                 arrays["holdings"], arrays["reserved_holdings"])
+        else:
+            exchange.users_balances = dict(zip(users, arrays["balances"].tolist()))
+            exchange.reserved_balances = dict(zip(users, arrays["reserved_balances"].tolist()))
+            for name, holdings in (("users_portfolios", arrays["holdings"]), ("reserved_holdings", arrays["reserved_holdings"])):
+                portfolios = {user_id: {} for user_id in users}
+                for row, column in zip(*np.nonzero(holdings)):
+                    portfolios[users[row]][stock_ids[column]] = int(holdings[row, column])
+                setattr(exchange, name, portfolios)
+
+        # Books: one PriceLevel per run of orders sharing stock, side and tick
+        orders = arrays["orders"]
+        gc_enabled = gc.isenabled()
+        gc.disable() # millions of new Orders would otherwise trigger repeated full collections
+        try:
+            exchange._load_book(orders, users, stock_ids)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        exchange._order_ids = count(header["next_order_id"])
+        # What the snapshot holds is what later conservation checks start from
+        exchange.issued_money = exchange.get_total_money()
+        share_totals = exchange.get_share_totals()
+        exchange.issued_shares = {stock_id: share_totals.get(stock_id, 0) for stock_id in stock_ids}
+        exchange.sequence += 1
+        exchange.journal = journal
+        return exchange
+
+    def _load_book(self, orders, users, stock_ids):
+        """Rebuild price levels and the order index from a snapshot's order rows."""
+        if len(orders):
+            order_ids = orders["order_id"].tolist()
+            quantities = orders["quantity"].tolist()
+            ticks = orders["tick"].tolist()
+            user_ids = np.array(users, dtype=object)[orders["user"]].tolist()
+            order_stocks = np.array(stock_ids, dtype=object)[orders["stock"]].tolist()
+            order_sides = np.array(["bid", "ask"], dtype=object)[orders["side"]].tolist()
+            resting = list(map(Order, order_ids, order_stocks, user_ids, order_sides, ticks, quantities))
+            self.orders = dict(zip(order_ids, resting))
+
+            level_key = np.column_stack((orders["stock"], orders["side"], orders["tick"]))
+            starts = np.flatnonzero(np.concatenate(([True], np.any(level_key[1:] != level_key[:-1], axis=1))))
+            level_quantities = np.add.reduceat(orders["quantity"], starts).tolist()
+            ends = starts[1:].tolist() + [len(orders)]
+            for start, end, level_quantity in zip(starts.tolist(), ends, level_quantities):
+                first = resting[start]
+                level = PriceLevel()
+                level.update(zip(order_ids[start:end], resting[start:end]))
+                level.quantity = level_quantity
+                self.stocks[first.stock_id][first.bid_or_ask+"s"][first.tick] = level
+
+    def ipo_stock(self, stock_id, quantity, price=100, tick_size=0.01, ladder="sorted"):
+        """Initial Public Offering for a stock. Sets the initial price.
+
+        Order prices are quantized to multiples of tick_size and stored as integer
+        ticks. ladder selects the book layout: 'sorted' (SortedDict, any price spread)
+        or 'dense' (array indexed by tick offset, O(1) best price and level access).
+        """
         if quantity <= 0:
             raise ValueError("Quantity must be greater than zero.")
+        if tick_size <= 0:
+            raise ValueError("Tick size must be greater than zero.")
+        if ladder not in LADDERS:
+            raise ValueError(f"ladder must be one of {', '.join(LADDERS)}.")
         
-        # Create empty order book
-        self.stocks[stock_id] = {
-            "bids": SortedDict(),
-            "asks": SortedDict()
-        }
-        
-        # Initialize market user portfolio if it doesn't exist
-        if stock_id not in self.users_portfolios[0]:
-            self.users_portfolios[0][stock_id] = 0
-        self.users_portfolios[0][stock_id] += quantity  # Market user gets the stock directly
-        self.last_traded_prices[stock_id] = price  # Set initial price
+        with self.locked():
+            if stock_id in self.stocks:
+                raise ValueError("Stock already exists.")
+            
+            # Create empty order book
+            self.stocks[stock_id] = self._new_book(tick_size, ladder)
+            
+            # Initialize market user portfolio if it doesn't exist
+            if stock_id not in self.users_portfolios[0]:
+                self.users_portfolios[0][stock_id] = 0
+            self.users_portfolios[0][stock_id] += quantity  # Market user gets the stock directly
+            self.issued_shares[stock_id] = quantity
+            self.last_traded_prices[stock_id] = price  # Set initial price
+            self._touch(stock_id, (0,))
+            if self.journal is not None:
+                self.journal.record_ipo(stock_id, quantity, price, tick_size, ladder)
+
 
+    def _new_book(self, tick_size, ladder):
+        """Empty bid and ask ladders, the book lock and the tick settings of one stock."""
+        ladder_class = LADDERS[ladder]
+        return {
+            "bids": ladder_class("bid"),
+            "asks": ladder_class("ask"),
+            "lock": threading.RLock(),
+            "tick_size": tick_size,
+            "price_decimals": max(0, -Decimal(str(tick_size)).as_tuple().exponent),
+            "ladder": ladder,
+        }
 
     def add_user(self, user_id, initial_balance=0):
         """Add a user with an initial balance."""
-        if user_id in self.users_balances:
-            raise ValueError("User already exists.")
         if initial_balance < 0:
             raise ValueError("Initial balance cannot be negative.")
         
-        self.users_balances[user_id] = initial_balance
-        self.users_portfolios[user_id] = {}
+        with self.locked():
+            if user_id in self.users_balances:
+                raise ValueError("User already exists.")
+            
+            self.users_balances[user_id] = initial_balance
+            self.users_portfolios[user_id] = {}
+            self.reserved_balances[user_id] = 0
+            self.reserved_holdings[user_id] = {}
+            self.issued_money += initial_balance
+            self._touch(None, (user_id,))
+            if self.journal is not None:
+                self.journal.record_add_user(user_id, initial_balance)
+
+    @contextmanager
+    def locked(self):
+        """Hold every book and cash lock for the duration of the block.
+
+        Nothing else can match, cancel or transfer meanwhile, so the block sees a
+        consistent engine. The locks are reentrant: the block may call back into
+        the exchange from the same thread.
+        """
+        with self._structure_lock:
+            locks = [stock["lock"] for stock in self.stocks.values()] + self.user_locks
+            for lock in locks:
+                lock.acquire()
+            try:
+                yield self
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+
+    def book_lock(self, stock_id):
+        """The lock guarding a stock's book, for reading several book values consistently."""
+        if stock_id not in self.stocks:
+            raise ValueError("Stock does not exist.")
+        return self.stocks[stock_id]["lock"]
+
+    def _stripe(self, user_id):
+        """The cash lock of a user."""
+        return self.user_locks[hash(user_id) % len(self.user_locks)]
+
+    def _stripe_pair(self, first_user_id, second_user_id):
+        """The cash locks of two users in acquisition order; the second is a no-op if they share a stripe."""
+        locks = self.user_locks
+        i = hash(first_user_id) % len(locks)
+        j = hash(second_user_id) % len(locks)
+        if i == j:
+            return locks[i], _NO_LOCK
+        return (locks[i], locks[j]) if i < j else (locks[j], locks[i])
+
+    def track_changes(self, levels=False):
+        """Register and return a ChangeSet that collects stocks and users (and optionally price levels) touched from now on."""
+        with self._meta_lock:
+            change_set = ChangeSet(self._meta_lock, levels)
+            self._change_sets.append(change_set)
+        return change_set
+
+    def add_trade_listener(self, listener):
+        """Call listener(stock_id, price, quantity, buyer_id, seller_id, aggressor) for every fill from now on.
+
+        aggressor is the side of the incoming order, "bid" or "ask".
+
+        Listeners run on the matching thread while the stock's book lock is held,
+        so they must be quick and must not call back into the exchange.
+        """
+        with self._meta_lock:
+            self._trade_listeners = self._trade_listeners + (listener,)
+
+    def remove_trade_listener(self, listener):
+        with self._meta_lock:
+            self._trade_listeners = tuple(registered for registered in self._trade_listeners if registered is not listener)
+
+    def _touch(self, stock_id, user_ids, trades=0, levels=(), orders=0, rejects=0, cancels=0, stock_ids=()):
+        """Bump the sequence number, count trades and orders and mark a stock's book (or several, in stock_ids), some users and price levels as dirty."""
+        with self._meta_lock:
+            self.sequence += 1
+            self.trade_count += trades
+            self.order_count += orders
+            self.reject_count += rejects
+            self.cancel_count += cancels
+            for change_set in self._change_sets:
+                if stock_id is not None:
+                    change_set.stocks.add(stock_id)
+                change_set.stocks.update(stock_ids)
+                change_set.users.update(user_ids)
+                if change_set.levels is not None:
+                    change_set.levels.update(levels)
+
+    def _admit(self, stock_id, user_id, bid_or_ask, order_type, quantity, order_price):
+        """Allocate the next order ID, journaling the order atomically with it if there is a journal."""
+        # Under the lock even without a journal: place_orders swaps the ID counter for a new one
+        with self._meta_lock:
+            if self.journal is not None:
+                self.journal.record_order(stock_id, user_id, bid_or_ask, order_type, quantity, order_price)
+            return next(self._order_ids)
     
 
     def get_user_balance(self, user_id):
-        """Get the balance of a user."""
+        """Get the available balance of a user, excluding money reserved by resting bids."""
         if user_id not in self.users_balances:
             raise ValueError("User does not exist.")
         return self.users_balances[user_id]
     
 
     def get_user_portfolio(self, user_id):
-        """Get the portfolio of a user."""
+        """Get the portfolio of a user, excluding shares reserved by resting asks."""
         if user_id not in self.users_portfolios:
             raise ValueError("User does not exist.")
         return self.users_portfolios[user_id]
+
+    def get_user_reserved(self, user_id):
+        """Get (reserved balance, reserved holdings) escrowed behind a user's resting orders."""
+        if user_id not in self.users_balances:
+            raise ValueError("User does not exist.")
+        return self.reserved_balances[user_id], self.reserved_holdings[user_id]
     
+    def get_user_balances(self, user_ids):
+        """Get the available balances of several users as an array."""
+        if self.ledger is not None:
+            return self.ledger.balances[self.ledger.rows(user_ids)]
+        balances = self.users_balances
+        try:
+            return np.fromiter((balances[user_id] for user_id in user_ids), dtype=np.float64, count=len(user_ids))
+        except KeyError:
+            raise ValueError("User does not exist.")
+
+    def get_user_holdings(self, user_ids, stock_id):
+        """Get the free (unreserved) holdings of one stock for several users as an array."""
+        if self.ledger is not None:
+            rows = self.ledger.rows(user_ids)
+            column = self.ledger.stock_index.get(stock_id)
+            if column is None:
+                return np.zeros(len(rows), dtype=np.int64)
+            return self.ledger.holdings[rows, column]
+        portfolios = self.users_portfolios
+        try:
+            return np.fromiter((portfolios[user_id].get(stock_id, 0) for user_id in user_ids), dtype=np.int64, count=len(user_ids))
+        except KeyError:
+            raise ValueError("User does not exist.")
+
+    def get_total_money(self):
+        """Get the total free plus reserved money held by all users."""
+        with self.locked():
+            if self.ledger is not None:
+                return self.ledger.total_money()
+            return sum(self.users_balances.values()) + sum(self.reserved_balances.values())
+
+    def get_share_totals(self):
+        """Get the total free plus reserved shares of each stock held by all users."""
+        with self.locked():
+            if self.ledger is not None:
+                return self.ledger.share_totals()
+            stock_totals = {}
+            for holdings in (self.users_portfolios, self.reserved_holdings):
+                for portfolio in holdings.values():
+                    for stock_id, quantity in portfolio.items():
+                        stock_totals[stock_id] = stock_totals.get(stock_id, 0) + quantity
+            return stock_totals
+
+    def get_mark_to_market(self, user_ids=None):
+        """Get the value of each user's cash and shares at current stock prices.
+
+        Reserved cash and shares are included. Returns an array aligned with
+        user_ids, or with every user in registration order if user_ids is None.
+        """
+        with self.locked():
+            return self._mark_to_market(user_ids)
+
+    def _mark_to_market(self, user_ids):
+        if self.ledger is not None:
+            prices = [self.get_stock_price(stock_id) or 0 for stock_id in self.ledger.stock_ids]
+            rows = None if user_ids is None else self.ledger.rows(user_ids)
+            return self.ledger.mark_to_market(prices, rows)
+        if user_ids is None:
+            user_ids = list(self.users_balances)
+        prices = {stock_id: self.get_stock_price(stock_id) or 0 for stock_id in self.stocks}
+        values = np.empty(len(user_ids), dtype=np.float64)
+        for i, user_id in enumerate(user_ids):
+            if user_id not in self.users_balances:
+                raise ValueError("User does not exist.")
+            value = self.users_balances[user_id] + self.reserved_balances[user_id]
+            for holdings in (self.users_portfolios[user_id], self.reserved_holdings[user_id]):
+                for stock_id, quantity in holdings.items():
+                    value += quantity * prices[stock_id]
+            values[i] = value
+        return values
+
+    def get_tick_size(self, stock_id):
+        """Get the minimum price increment of a stock."""
+        if stock_id not in self.stocks:
+            raise ValueError("Stock does not exist.")
+        return self.stocks[stock_id]["tick_size"]
+
     def get_stock_orders(self, stock_id):
         """Get the current orders for a stock."""
         if stock_id not in self.stocks:
             raise ValueError("Stock does not exist.")
         return self.stocks[stock_id]
 
+    def get_depth(self, stock_id, side, n_levels):
+        """Get the top n_levels aggregated price levels of one side of a book.
+
+        Returns a list of (price, total_quantity, order_count) from the best price
+        outward. The cost depends on n_levels, not on the size of the book.
+        """
+        if stock_id not in self.stocks:
+            raise ValueError("Stock does not exist.")
+        if side not in ["bid", "ask"]:
+            raise ValueError("side must be 'bid' or 'ask'.")
+        
+        stock = self.stocks[stock_id]
+        with stock["lock"]:
+            return [(self._tick_price(stock, tick), level.quantity, len(level))
+                    for tick, level in stock[side+"s"].top(n_levels)]
+
+    def get_level_quantities(self, stock_id, levels):
+        """Get the current aggregate quantity of some (side, tick) price levels of a book.
+
+        Returns a list of (side, price, quantity) in the order given; a level that
+        no longer exists has quantity 0.
+        """
+        if stock_id not in self.stocks:
+            raise ValueError("Stock does not exist.")
+        stock = self.stocks[stock_id]
+        with stock["lock"]:
+            quantities = []
+            for side, tick in levels:
+                level = stock[side+"s"].get(tick)
+                quantities.append((side, self._tick_price(stock, tick), level.quantity if level is not None else 0))
+            return quantities
+
     def get_last_traded_price(self, stock_id):
         """Get the last traded price for a stock."""
         if stock_id not in self.stocks:
             raise ValueError("Stock does not exist.")
         return self.last_traded_prices.get(stock_id, None)
 
+    def _tick_price(self, stock, tick):
+        """Convert an integer price tick to a price."""
+        return round(tick * stock["tick_size"], stock["price_decimals"])
+
+    def _price_tick(self, stock, price):
+        """Quantize a price to the nearest integer tick."""
+        tick = round(price / stock["tick_size"])
+        if tick <= 0:
+            raise ValueError("Price must be at least one tick.")
+        return tick
+
+    def tick_to_price(self, stock_id, tick):
+        """Convert a book price tick for a stock to a price."""
+        if stock_id not in self.stocks:
+            raise ValueError("Stock does not exist.")
+        return self._tick_price(self.stocks[stock_id], tick)
+
+    def round_to_tick(self, stock_id, price):
+        """Round a price to the nearest valid tick for a stock."""
+        if stock_id not in self.stocks:
+            raise ValueError("Stock does not exist.")
+        stock = self.stocks[stock_id]
+        return self._tick_price(stock, self._price_tick(stock, price))
+
     def get_stock_price(self, stock_id):
         """Get the current price of a stock based on the best ask."""
         if stock_id not in self.stocks:
             raise ValueError("Stock does not exist.")
         stock = self.stocks[stock_id]
-        
+        with stock["lock"]:
+            return self._stock_price(stock_id, stock)
+
+    def _stock_price(self, stock_id, stock):
         # If a trade has occurred, use the last traded price
         if stock_id in self.last_traded_prices and self.last_traded_prices[stock_id] is not None:
             return self.last_traded_prices[stock_id]
 
         # If we have both bids and asks, return the midpoint
         if stock["bids"] and stock["asks"]:
-            highest_bid = next(iter(reversed(stock["bids"].keys())))
-            lowest_ask = next(iter(stock["asks"].keys()))
+            highest_bid = self._tick_price(stock, stock["bids"].best_tick())
+            lowest_ask = self._tick_price(stock, stock["asks"].best_tick())
             return (highest_bid + lowest_ask) / 2
         
         # If we only have asks, return the lowest ask
         elif stock["asks"]:
-            return next(iter(stock["asks"].keys()))
+            return self._tick_price(stock, stock["asks"].best_tick())
         
         # If we only have bids, return the highest bid
         elif stock["bids"]:
-            return next(iter(reversed(stock["bids"].keys())))
+            return self._tick_price(stock, stock["bids"].best_tick())
         
         # If no orders exist, return None
         else:
@@ -100,18 +622,20 @@ class StockExchange:
         if stock_id not in self.stocks:
             raise ValueError("Stock does not exist.")
         stock = self.stocks[stock_id]
-        if not stock["asks"]:
-            return None
-        return next(iter(stock["asks"].keys()))
+        with stock["lock"]:
+            if not stock["asks"]:
+                return None
+            return self._tick_price(stock, stock["asks"].best_tick())
 
     def get_highest_bid(self, stock_id):
         """Get the highest bid price for a stock."""
         if stock_id not in self.stocks:
             raise ValueError("Stock does not exist.")
         stock = self.stocks[stock_id]
-        if not stock["bids"]:
-            return None
-        return next(iter(reversed(stock["bids"].keys())))
+        with stock["lock"]:
+            if not stock["bids"]:
+                return None
+            return self._tick_price(stock, stock["bids"].best_tick())
 
     def transfer_stock(self, from_user_id, to_user_id, stock_id, quantity):
         """Transfer stock from one user to another."""
@@ -121,21 +645,29 @@ class StockExchange:
         if quantity <= 0:
             raise ValueError("Quantity must be greater than zero.")
         
-        # Check if sender has enough stock
-        from_stock_quantity = self.users_portfolios[from_user_id].get(stock_id, 0)
-        if from_stock_quantity < quantity:
-            raise ValueError(f"Not enough stock to transfer. Has {from_stock_quantity}, needs {quantity}")
-        
-        # Perform the transfer
-        self.users_portfolios[from_user_id][stock_id] -= quantity
-        
-        # Clean up zero quantities
-        if self.users_portfolios[from_user_id][stock_id] == 0:
-            del self.users_portfolios[from_user_id][stock_id]
-        
-        if stock_id not in self.users_portfolios[to_user_id]:
-            self.users_portfolios[to_user_id][stock_id] = 0
-        self.users_portfolios[to_user_id][stock_id] += quantity
+        # Holdings of a listed stock are guarded by its book lock
+        stock = self.stocks.get(stock_id)
+        book_lock = stock["lock"] if stock is not None else self._structure_lock
+        first, second = self._stripe_pair(from_user_id, to_user_id)
+        with book_lock, first, second:
+            # Check if sender has enough stock
+            from_stock_quantity = self.users_portfolios[from_user_id].get(stock_id, 0)
+            if from_stock_quantity < quantity:
+                raise ValueError(f"Not enough stock to transfer. Has {from_stock_quantity}, needs {quantity}")
+            
+            # Perform the transfer
+            self.users_portfolios[from_user_id][stock_id] -= quantity
+            
+            # Clean up zero quantities
+            if self.users_portfolios[from_user_id][stock_id] == 0:
+                del self.users_portfolios[from_user_id][stock_id]
+            
+            if stock_id not in self.users_portfolios[to_user_id]:
+                self.users_portfolios[to_user_id][stock_id] = 0
+            self.users_portfolios[to_user_id][stock_id] += quantity
+            self._touch(None, (from_user_id, to_user_id))
+            if self.journal is not None:
+                self.journal.record_transfer_stock(from_user_id, to_user_id, stock_id, quantity)
 
     def transfer_money(self, from_user_id, to_user_id, amount):
         """Transfer money from one user to another."""
@@ -145,15 +677,24 @@ class StockExchange:
         if amount <= 0:
             raise ValueError("Amount must be greater than zero.")
         
-        if self.users_balances[from_user_id] < amount:
-            raise ValueError(f"Not enough balance to transfer. Has {self.users_balances[from_user_id]}, needs {amount}")
-        
-        # Perform the transfer
-        self.users_balances[from_user_id] -= amount
-        self.users_balances[to_user_id] += amount
+        first, second = self._stripe_pair(from_user_id, to_user_id)
+        with first, second:
+            if self.users_balances[from_user_id] < amount:
+                raise ValueError(f"Not enough balance to transfer. Has {self.users_balances[from_user_id]}, needs {amount}")
+            
+            # Perform the transfer
+            self.users_balances[from_user_id] -= amount
+            self.users_balances[to_user_id] += amount
+            self._touch(None, (from_user_id, to_user_id))
+            if self.journal is not None:
+                self.journal.record_transfer_money(from_user_id, to_user_id, amount)
 
     def place_order(self, stock_id, user_id, bid_or_ask, order_type, quantity, order_price=None):
-        """Place an order for a user. order_type can be 'market' or 'limit'."""
+        """Place an order for a user. order_type can be 'market' or 'limit'.
+
+        Returns (filled_quantity, total_value, order_id). The order_id is stable and
+        can be passed to cancel_order/amend_order while the order rests in the book.
+        """
         if stock_id not in self.stocks:
             raise ValueError("Stock does not exist.")
         
@@ -174,245 +715,535 @@ class StockExchange:
         if order_type == "limit" and order_price is None:
             raise ValueError("For limit orders, price must be specified.")
 
-        # Validate user has sufficient resources BEFORE any order processing
+        # Quantize the limit price to the stock's tick grid
+        order_tick = None
+        if order_type == "limit":
+            order_tick = self._price_tick(stock, order_price)
+            order_price = self._tick_price(stock, order_tick)
+
+        with stock["lock"]:
+            # Validate user has sufficient resources BEFORE any order processing
+            shortfall = self._resource_shortfall(stock_id, stock, user_id, bid_or_ask, order_type, quantity, order_price)
+            if shortfall:
+                with self._meta_lock:
+                    self.reject_count += 1
+                raise ValueError(shortfall)
+
+            order_id = self._admit(stock_id, user_id, bid_or_ask, order_type, quantity, order_price)
+            return self._execute_order(stock_id, stock, user_id, bid_or_ask, order_type, quantity, order_tick, order_id)
+
+    def place_orders(self, batch):
+        """Place a columnar batch of orders and return per-order results as arrays.
+
+        batch is a mapping of equal-length columns (or a NumPy structured array) with
+        fields "stock", "user", "side", "type", "qty" and "price". side is "bid"/"ask"
+        or 0/1, type is "market"/"limit" or 0/1, and price is ignored for market
+        orders. The batch is validated once as a whole: unknown stocks or users,
+        invalid codes, non-positive quantities or missing or sub-tick limit prices
+        raise ValueError before anything is matched. Orders then run sequentially in
+        submission order; an order its user cannot cover is rejected rather than
+        raising.
+
+        The bookkeeping is done per batch rather than per order: the book lock of
+        each stock in the batch is taken once for the whole batch, the batch gets
+        one block of order IDs (order i gets the block's first ID + i, so the IDs
+        of rejected orders go unused) and is journaled as one record in the same
+        step, and what it changed is marked dirty once at the end.
+
+        Returns a dict of arrays: "filled", "value", "order_id" and "status"
+        (ORDER_ACCEPTED or ORDER_REJECTED; rejected orders have order_id 0).
+        """
+        # Work on plain Python lists: indexing NumPy arrays element by element is slow
+        columns = []
+        for name in ("stock", "user", "side", "type", "qty", "price"):
+            column = batch[name]
+            columns.append(column.tolist() if isinstance(column, np.ndarray) else list(column))
+        stock_ids, user_ids, sides, order_types, quantities, prices = columns
+
+        n = len(stock_ids)
+        if not (len(user_ids) == len(sides) == len(order_types) == len(quantities) == len(prices) == n):
+            raise ValueError("All batch columns must have the same length.")
+
+        # Validate the batch once, column by column
+        stocks = self.stocks
+        batch_stocks = set(stock_ids)
+        if not batch_stocks <= stocks.keys():
+            raise ValueError("Stock does not exist.")
+        if not set(user_ids) <= self.users_balances.keys():
+            raise ValueError("User does not exist.")
+        if not set(sides) <= SIDE_CODES.keys():
+            raise ValueError("bid_or_ask must be 'bid' or 'ask'.")
+        if not set(order_types) <= ORDER_TYPE_CODES.keys():
+            raise ValueError("order_type must be 'market' or 'limit'.")
+        if n and min(quantities) <= 0:
+            raise ValueError("Quantity must be specified and greater than zero.")
+        sides = [SIDE_CODES[side] for side in sides]
+        order_types = [ORDER_TYPE_CODES[t] for t in order_types]
+
+        # Quantize limit prices to their stock's tick grid
+        price_tick = self._price_tick
+        tick_price = self._tick_price
+        ticks = [None] * n
+        order_prices = [None] * n
+        for i, order_type in enumerate(order_types):
+            if order_type == "limit":
+                price = prices[i]
+                if price is None or not price > 0:
+                    raise ValueError("For limit orders, price must be specified.")
+                stock = stocks[stock_ids[i]]
+                ticks[i] = price_tick(stock, price)
+                order_prices[i] = tick_price(stock, ticks[i])
+
+        filled = [0] * n
+        value = [0.0] * n
+        order_ids = [0] * n
+        status = [ORDER_ACCEPTED] * n
+        if not n:
+            return {"filled": np.array(filled, dtype=np.int64), "value": np.array(value, dtype=np.float64),
+                    "order_id": np.array(order_ids, dtype=np.int64), "status": np.array(status, dtype=np.int8)}
+
+        # Take the books in the order locked() takes them, so batches cannot deadlock with it or each other
+        if len(batch_stocks) == 1:
+            book_locks = [stocks[stock_ids[0]]["lock"]]
+        else:
+            book_locks = [stock["lock"] for stock_id, stock in stocks.items() if stock_id in batch_stocks]
+        resource_shortfall = self._resource_shortfall
+        execute_order = self._execute_order
+        touched = [] # users touched by the whole batch, marked dirty once at the end
+        touched_levels = [] # and the price levels
+        accepted = 0
+        for lock in book_locks:
+            lock.acquire()
+        try:
+            with self._meta_lock:
+                first_id = next(self._order_ids)
+                self._order_ids = count(first_id + n)
+                if self.journal is not None:
+                    self.journal.record_orders(stock_ids, user_ids, sides, order_types, quantities, order_prices)
+            for i in range(n):
+                stock_id = stock_ids[i]
+                stock = stocks[stock_id]
+                user_id = user_ids[i]
+                bid_or_ask = sides[i]
+                order_type = order_types[i]
+                quantity = quantities[i]
+                if resource_shortfall(stock_id, stock, user_id, bid_or_ask, order_type, quantity, order_prices[i]):
+                    status[i] = ORDER_REJECTED
+                    continue
+                filled[i], value[i], order_ids[i] = execute_order(stock_id, stock, user_id, bid_or_ask, order_type, quantity, ticks[i], first_id + i, touched, touched_levels)
+                accepted += 1
+        finally:
+            for lock in reversed(book_locks):
+                lock.release()
+
+        # Each accepted order added its own user plus one counterparty per fill
+        self._touch(None, set(touched), len(touched) - accepted, set(touched_levels), accepted, n - accepted, stock_ids=batch_stocks)
+
+        filled = np.array(filled, dtype=np.int64)
+        value = np.array(value, dtype=np.float64)
+        order_ids = np.array(order_ids, dtype=np.int64)
+        status = np.array(status, dtype=np.int8)
+        return {"filled": filled, "value": value, "order_id": order_ids, "status": status}
+
+    def _resource_shortfall(self, stock_id, stock, user_id, bid_or_ask, order_type, quantity, order_price):
+        """Return an error message if the user cannot cover the order, otherwise None."""
         if bid_or_ask == "ask":
             # Check if user has enough stock to sell
             user_stock_quantity = self.users_portfolios[user_id].get(stock_id, 0)
             if user_stock_quantity < quantity:
-                raise ValueError(f"Not enough stock to sell. Has {user_stock_quantity}, needs {quantity}")
+                return f"Not enough stock to sell. Has {user_stock_quantity}, needs {quantity}"
         
-        elif bid_or_ask == "bid":
+        else:
             # For market orders, check against lowest ask price
             # For limit orders, check against the limit price
-            price_to_check = order_price if order_type == "limit" else self.get_lowest_ask(stock_id)
+            if order_type == "limit":
+                price_to_check = order_price
+            elif stock["asks"]:
+                price_to_check = self._tick_price(stock, stock["asks"].best_tick())
+            else:
+                price_to_check = None
             if price_to_check is not None:
                 required_balance = price_to_check * quantity
                 if self.users_balances[user_id] < required_balance:
-                    raise ValueError(f"Not enough balance to buy. Has {self.users_balances[user_id]}, needs {required_balance}")
+                    return f"Not enough balance to buy. Has {self.users_balances[user_id]}, needs {required_balance}"
+        return None
+
+    def _execute_order(self, stock_id, stock, user_id, bid_or_ask, order_type, quantity, order_tick, order_id, touched=None, touched_levels=None):
+        """Match a validated, funded, admitted order and rest any limit remainder.
+
+        The caller holds the stock's book lock. Returns (filled_quantity,
+        total_value, order_id). If touched and touched_levels are lists, the users
+        and price levels this order touched are appended to them and the caller is
+        responsible for marking them dirty and counting the trades; otherwise the
+        order does both itself.
+        """
+        balances = self.users_balances
+        portfolios = self.users_portfolios
+        trade_listeners = self._trade_listeners
+        # Users whose ledger rows this order touches
+        counterparties = [user_id] if touched is None else touched
+        if touched is not None:
+            counterparties.append(user_id)
+        levels = [] if touched_levels is None else touched_levels
 
         if bid_or_ask == "bid":
             bought_quantity = 0
             total_spent = 0
             remaining_quantity = quantity
+            asks = stock["asks"]
+            buyer_portfolio = portfolios[user_id]
+            funded = True
             
-            # Try to match with existing asks first
-            for price in list(stock["asks"].keys()):
-                if order_type == "limit" and price > order_price:
-                    break
-                if remaining_quantity <= 0:
+            # Try to match with existing asks first, peeking at the best level only
+            while funded and remaining_quantity > 0 and asks:
+                tick, orders_at_price = asks.best()
+                if order_type == "limit" and tick > order_tick:
                     break
-
-                orders_at_price = stock["asks"][price]
+                levels.append((stock_id, "ask", tick))
+                price = self._tick_price(stock, tick)
                 
-                # Process orders at this price level
-                orders_to_remove = []
-                for i, (seller_id, seller_quantity) in enumerate(orders_at_price):
-                    if remaining_quantity <= 0:
-                        break
-                    
-                    trade_quantity = min(remaining_quantity, seller_quantity)
+                # Consume orders from the front of the level in time priority
+                while remaining_quantity > 0 and orders_at_price:
+                    resting = next(iter(orders_at_price.values()))
+                    trade_quantity = min(remaining_quantity, resting.quantity)
                     cost = price * trade_quantity
                     
-                    # Double-check resources are still available
-                    if (self.users_balances[user_id] < cost or 
-                        self.users_portfolios[seller_id].get(stock_id, 0) < trade_quantity):
-                        continue  # Skip this order if resources not available
-                    
-                    # Execute the trade
-                    self.transfer_money(user_id, seller_id, cost)
-                    self.transfer_stock(seller_id, user_id, stock_id, trade_quantity)
+                    # Execute the trade: the seller's shares come out of escrow
+                    seller_id = resting.user_id
+                    first, second = self._stripe_pair(user_id, seller_id)
+                    with first, second:
+                        # A market order can sweep past what the buyer can afford:
+                        # take what the cash still covers here, then stop
+                        if balances[user_id] < cost:
+                            funded = False
+                            trade_quantity = int(balances[user_id] // price)
+                            if price * trade_quantity > balances[user_id]:
+                                trade_quantity -= 1
+                            if trade_quantity <= 0:
+                                break
+                            cost = price * trade_quantity
+                        balances[user_id] -= cost
+                        balances[seller_id] += cost
+                    counterparties.append(seller_id)
+                    seller_reserved = self.reserved_holdings[seller_id]
+                    seller_reserved[stock_id] -= trade_quantity
+                    if seller_reserved[stock_id] == 0:
+                        del seller_reserved[stock_id]
+                    buyer_portfolio[stock_id] = buyer_portfolio.get(stock_id, 0) + trade_quantity
                     
                     self.last_traded_prices[stock_id] = price
+                    for listener in trade_listeners:
+                        listener(stock_id, price, trade_quantity, user_id, seller_id, "bid")
                     
                     remaining_quantity -= trade_quantity
                     bought_quantity += trade_quantity
                     total_spent += cost
                     
-                    if trade_quantity == seller_quantity:
-                        # Mark order for removal
-                        orders_to_remove.append(i)
-                    else:
-                        # Update the remaining quantity
-                        orders_at_price[i] = (seller_id, seller_quantity - trade_quantity)
-                
-                # Remove completed orders (in reverse order to maintain indices)
-                for i in reversed(orders_to_remove):
-                    orders_at_price.pop(i)
+                    resting.quantity -= trade_quantity
+                    orders_at_price.quantity -= trade_quantity
+                    if resting.quantity == 0:
+                        # Pop the filled order off the front of the queue
+                        orders_at_price.popitem(last=False)
+                        del self.orders[resting.order_id]
+                    if not funded:
+                        break
                     
                 if not orders_at_price:
                     # Remove price level if all orders are gone
-                    stock["asks"].pop(price)
+                    del asks[tick]
 
             # If there's remaining quantity and it's a limit order, add to order book
             if order_type == "limit" and remaining_quantity > 0:
-                # Re-validate the user still has enough money for the limit order
-                required_balance = order_price * remaining_quantity
-                if self.users_balances[user_id] >= required_balance:
-                    stock["bids"].setdefault(order_price, []).append((user_id, remaining_quantity))
-                    
-            return bought_quantity, total_spent
+                with self._stripe(user_id):
+                    # Another stock's thread may have spent the cash since validation
+                    price = self._tick_price(stock, order_tick)
+                    rested_quantity = remaining_quantity
+                    if balances[user_id] < price * remaining_quantity:
+                        rested_quantity = int(balances[user_id] // price)
+                        if price * rested_quantity > balances[user_id]:
+                            rested_quantity -= 1
+                    if rested_quantity > 0:
+                        self._rest_order(Order(order_id, stock_id, user_id, "bid", order_tick, rested_quantity))
+                        levels.append((stock_id, "bid", order_tick))
+                if rested_quantity < remaining_quantity:
+                    self._record_cut_bid(order_id, remaining_quantity, rested_quantity)
+            
+            if touched is None:
+                self._touch(stock_id, counterparties, len(counterparties) - 1, levels, orders=1)
+            return bought_quantity, total_spent, order_id
         
         elif bid_or_ask == "ask":
             sold_quantity = 0
             total_earned = 0
             remaining_quantity = quantity
+            bids = stock["bids"]
+            seller_portfolio = portfolios[user_id]
             
-            # Try to match with existing bids first
-            for price in reversed(list(stock["bids"].keys())):
-                if order_type == "limit" and price < order_price:
-                    break
-                if remaining_quantity <= 0:
+            # Try to match with existing bids first, peeking at the best level only
+            while remaining_quantity > 0 and bids:
+                tick, orders_at_price = bids.best()
+                if order_type == "limit" and tick < order_tick:
                     break
-
-                orders_at_price = stock["bids"][price]
+                levels.append((stock_id, "bid", tick))
+                price = self._tick_price(stock, tick)
                 
-                # Process orders at this price level
-                orders_to_remove = []
-                for i, (buyer_id, buyer_quantity) in enumerate(orders_at_price):
-                    if remaining_quantity <= 0:
-                        break
-                    
-                    trade_quantity = min(remaining_quantity, buyer_quantity)
+                # Consume orders from the front of the level in time priority
+                while remaining_quantity > 0 and orders_at_price:
+                    resting = next(iter(orders_at_price.values()))
+                    trade_quantity = min(remaining_quantity, resting.quantity)
                     cost = price * trade_quantity
                     
-                    # Double-check resources are still available
-                    if (self.users_balances[buyer_id] < cost or 
-                        self.users_portfolios[user_id].get(stock_id, 0) < trade_quantity):
-                        continue  # Skip this order if resources not available
-                    
-                    # Execute the trade
-                    self.transfer_money(buyer_id, user_id, cost)
-                    self.transfer_stock(user_id, buyer_id, stock_id, trade_quantity)
+                    # Execute the trade: the buyer's money comes out of escrow
+                    buyer_id = resting.user_id
+                    counterparties.append(buyer_id)
+                    first, second = self._stripe_pair(user_id, buyer_id)
+                    with first, second:
+                        self.reserved_balances[buyer_id] -= cost
+                        balances[user_id] += cost
+                    seller_portfolio[stock_id] -= trade_quantity
+                    buyer_portfolio = portfolios[buyer_id]
+                    buyer_portfolio[stock_id] = buyer_portfolio.get(stock_id, 0) + trade_quantity
                     
                     self.last_traded_prices[stock_id] = price
+                    for listener in trade_listeners:
+                        listener(stock_id, price, trade_quantity, buyer_id, user_id, "ask")
                     
                     remaining_quantity -= trade_quantity
                     sold_quantity += trade_quantity
                     total_earned += cost
                     
-                    if trade_quantity == buyer_quantity:
-                        # Mark order for removal
-                        orders_to_remove.append(i)
-                    else:
-                        # Update the remaining quantity
-                        orders_at_price[i] = (buyer_id, buyer_quantity - trade_quantity)
-                
-                # Remove completed orders (in reverse order to maintain indices)
-                for i in reversed(orders_to_remove):
-                    orders_at_price.pop(i)
+                    resting.quantity -= trade_quantity
+                    orders_at_price.quantity -= trade_quantity
+                    if resting.quantity == 0:
+                        # Pop the filled order off the front of the queue
+                        orders_at_price.popitem(last=False)
+                        del self.orders[resting.order_id]
                     
                 if not orders_at_price:
                     # Remove price level if all orders are gone
-                    stock["bids"].pop(price)
+                    del bids[tick]
+
+            # Clean up zero quantities
+            if seller_portfolio.get(stock_id) == 0:
+                del seller_portfolio[stock_id]
 
             # If there's remaining quantity and it's a limit order, add to order book
             if order_type == "limit" and remaining_quantity > 0:
-                # Re-validate the user still has enough stock for the limit order
-                if self.users_portfolios[user_id].get(stock_id, 0) >= remaining_quantity:
-                    stock["asks"].setdefault(order_price, []).append((user_id, remaining_quantity))
-                    
-            return sold_quantity, total_earned
-        
-    def cancel_order(self, stock_id, user_id, bid_or_ask, order_price):
-        """Cancel an order for a user."""
-        if stock_id not in self.stocks:
-            raise ValueError("Stock does not exist.")
-        
-        stock = self.stocks[stock_id]
+                self._rest_order(Order(order_id, stock_id, user_id, "ask", order_tick, remaining_quantity))
+                levels.append((stock_id, "ask", order_tick))
+            
+            if touched is None:
+                self._touch(stock_id, counterparties, len(counterparties) - 1, levels, orders=1)
+            return sold_quantity, total_earned, order_id
 
-        if user_id not in self.users_balances:
-            raise ValueError("User does not exist.")
-        
-        if bid_or_ask not in ["bid", "ask"]:
-            raise ValueError("bid_or_ask must be 'bid' or 'ask'.")
-        
-        if order_price not in stock[bid_or_ask+"s"]:
+    def _record_cut_bid(self, order_id, remaining_quantity, rested_quantity):
+        """Log and journal a limit bid remainder cut short because its cash was spent after validation.
+
+        The journal gets the amend (or the cancel, if nothing rested) that takes
+        the order from its full remainder to what actually rested.
+        """
+        logger.warning("Order %s rested %s of its %s remaining shares: the cash for the rest was spent after validation",
+                       order_id, rested_quantity, remaining_quantity)
+        if self.journal is not None:
+            if rested_quantity:
+                self.journal.record_amend(order_id, rested_quantity)
+            else:
+                self.journal.record_cancel(order_id)
+
+    def _reserve(self, order, quantity):
+        """Move the cash or shares backing quantity of an order into escrow.
+
+        The caller holds the order's book lock and, for bids, the user's cash lock
+        across its funding check.
+        """
+        user_id = order.user_id
+        if order.bid_or_ask == "bid":
+            amount = self._tick_price(self.stocks[order.stock_id], order.tick) * quantity
+            self.users_balances[user_id] -= amount
+            self.reserved_balances[user_id] += amount
+        else:
+            portfolio = self.users_portfolios[user_id]
+            portfolio[order.stock_id] -= quantity
+            if portfolio[order.stock_id] == 0:
+                del portfolio[order.stock_id]
+            reserved = self.reserved_holdings[user_id]
+            reserved[order.stock_id] = reserved.get(order.stock_id, 0) + quantity
+
+    def _release(self, order, quantity):
+        """Return the escrowed cash or shares backing quantity of an order to its owner."""
+        user_id = order.user_id
+        if order.bid_or_ask == "bid":
+            amount = self._tick_price(self.stocks[order.stock_id], order.tick) * quantity
+            with self._stripe(user_id):
+                self.reserved_balances[user_id] -= amount
+                self.users_balances[user_id] += amount
+        else:
+            reserved = self.reserved_holdings[user_id]
+            reserved[order.stock_id] -= quantity
+            if reserved[order.stock_id] == 0:
+                del reserved[order.stock_id]
+            portfolio = self.users_portfolios[user_id]
+            portfolio[order.stock_id] = portfolio.get(order.stock_id, 0) + quantity
+
+    def _rest_order(self, order):
+        """Escrow an order's resources and append it to the back of its price level."""
+        self._reserve(order, order.quantity)
+        self._link_order(order)
+
+    def _link_order(self, order):
+        """Append an order to the back of its price level and index it by ID."""
+        level = self.stocks[order.stock_id][order.bid_or_ask+"s"].setdefault(order.tick)
+        level[order.order_id] = order
+        level.quantity += order.quantity
+        self.orders[order.order_id] = order
+
+    def _unlink_order(self, order):
+        """Remove a resting order from its price level and from the ID index."""
+        side = self.stocks[order.stock_id][order.bid_or_ask+"s"]
+        level = side[order.tick]
+        del level[order.order_id]
+        level.quantity -= order.quantity
+        if not level:
+            del side[order.tick]
+        del self.orders[order.order_id]
+
+    def get_order(self, order_id):
+        """Get a resting order by its ID, or None if it is no longer in the book."""
+        return self.orders.get(order_id)
+
+    def cancel_order(self, order_id):
+        """Cancel a resting order. Returns the quantity that was still open."""
+        with self._order_book_lock(order_id):
+            order = self.orders.get(order_id)
+            if order is None:
+                raise ValueError("No such order exists.")
+            
+            self._unlink_order(order)
+            self._release(order, order.quantity)
+            self._touch(order.stock_id, (order.user_id,), levels=((order.stock_id, order.bid_or_ask, order.tick),), cancels=1)
+            if self.journal is not None:
+                self.journal.record_cancel(order_id)
+            return order.quantity
+
+    def _order_book_lock(self, order_id):
+        """The book lock of a resting order's stock.
+
+        Look the order up again once the lock is held: it may have filled meanwhile.
+        """
+        order = self.orders.get(order_id)
+        if order is None:
             raise ValueError("No such order exists.")
+        return self.stocks[order.stock_id]["lock"]
+
+    def amend_order(self, order_id, new_qty):
+        """Change the open quantity of a resting order.
+
+        Reducing the quantity keeps the order's time priority; increasing it moves
+        the order to the back of its price level.
+        """
+        if new_qty is None or new_qty <= 0:
+            raise ValueError("Quantity must be specified and greater than zero.")
         
-        orders = stock[bid_or_ask+"s"][order_price]
-        for i, (user_id2, quantity) in enumerate(orders):
-            if user_id2 == user_id:
-                orders.pop(i)
-                return quantity
+        with self._order_book_lock(order_id):
+            order = self.orders.get(order_id)
+            if order is None:
+                raise ValueError("No such order exists.")
             
-        raise ValueError("No order found for this user at the specified price.")
+            if new_qty > order.quantity:
+                # Validate the user can cover the larger order
+                extra_quantity = new_qty - order.quantity
+                with self._stripe(order.user_id):
+                    if order.bid_or_ask == "ask":
+                        user_stock_quantity = self.users_portfolios[order.user_id].get(order.stock_id, 0)
+                        if user_stock_quantity < extra_quantity:
+                            raise ValueError(f"Not enough stock to sell. Has {user_stock_quantity}, needs {extra_quantity}")
+                    else:
+                        required_balance = self.tick_to_price(order.stock_id, order.tick) * extra_quantity
+                        if self.users_balances[order.user_id] < required_balance:
+                            raise ValueError(f"Not enough balance to buy. Has {self.users_balances[order.user_id]}, needs {required_balance}")
+                    
+                    self._reserve(order, extra_quantity)
+            elif new_qty < order.quantity:
+                self._release(order, order.quantity - new_qty)
+            
+            level = self.stocks[order.stock_id][order.bid_or_ask+"s"][order.tick]
+            if new_qty > order.quantity:
+                # Lose time priority
+                level.move_to_end(order_id)
+            level.quantity += new_qty - order.quantity
+            order.quantity = new_qty
+            self._touch(order.stock_id, (order.user_id,), levels=((order.stock_id, order.bid_or_ask, order.tick),))
+            if self.journal is not None:
+                self.journal.record_amend(order_id, new_qty)
+            return order.quantity
     
     def print_market_summary(self):
         """Print a summary of the market."""
         print("Market Summary:")
         for stock_id, stock in self.stocks.items():
             print(f"Stock: {stock_id}")
-            for price, orders in reversed(stock["asks"].items()):
-                print(f"  Ask at {price}, Orders: {orders}")
+            for tick, orders in reversed(stock["asks"].items()):
+                print(f"  Ask at {self._tick_price(stock, tick)}, Orders: {list(orders.values())}")
             print("---")
-            for price, orders in reversed(stock["bids"].items()):
-                print(f"  Bid at {price}, Orders: {orders}")
+            for tick, orders in reversed(stock["bids"].items()):
+                print(f"  Bid at {self._tick_price(stock, tick)}, Orders: {list(orders.values())}")
         print()
         for user_id, balance in self.users_balances.items():
-            print(f"User {user_id}: Balance = {balance}")
+            print(f"User {user_id}: Balance = {balance}, Reserved = {self.reserved_balances[user_id]}")
         print()
         for user_id, portfolio in self.users_portfolios.items():
-            print(f"User {user_id}: Portfolio = {portfolio}")
+            print(f"User {user_id}: Portfolio = {portfolio}, Reserved = {self.reserved_holdings[user_id]}")
         print()
 
-    def verify_conservation(self):
-        """Verify that money and stocks are conserved in the system."""
-        total_money = sum(self.users_balances.values())
-        stock_totals = {}
-        
-        for user_id, portfolio in self.users_portfolios.items():
-            for stock_id, quantity in portfolio.items():
-                if stock_id not in stock_totals:
-                    stock_totals[stock_id] = 0
-                stock_totals[stock_id] += quantity
-        
-        # Add stocks in open orders
-        for stock_id, stock in self.stocks.items():
-            for price, orders in stock["asks"].items():
-                for user_id, quantity in orders:
-                    if stock_id not in stock_totals:
-                        stock_totals[stock_id] = 0
-                    stock_totals[stock_id] += quantity
-        
-        print(f"Total money in system: ${total_money:.2f}")
-        for stock_id, total in stock_totals.items():
-            print(f"Total {stock_id} shares: {total}")
-        
-        return total_money, stock_totals
-    
-    def clean_invalid_orders(self, stock_id):
-        """Remove orders where users no longer have sufficient resources."""
-        if stock_id not in self.stocks:
-            return
-        
-        stock = self.stocks[stock_id]
-        
-        # Clean invalid bids (users without enough money)
-        for price in list(stock["bids"].keys()):
-            orders = stock["bids"][price]
-            valid_orders = []
-            
-            for user_id, quantity in orders:
-                required_balance = price * quantity
-                if self.users_balances.get(user_id, 0) >= required_balance:
-                    valid_orders.append((user_id, quantity))
-            
-            if valid_orders:
-                stock["bids"][price] = valid_orders
-            else:
-                del stock["bids"][price]
-        
-        # Clean invalid asks (users without enough stock)
-        for price in list(stock["asks"].keys()):
-            orders = stock["asks"][price]
-            valid_orders = []
-            
-            for user_id, quantity in orders:
-                user_stock = self.users_portfolios.get(user_id, {}).get(stock_id, 0)
-                if user_stock >= quantity:
-                    valid_orders.append((user_id, quantity))
-            
-            if valid_orders:
-                stock["asks"][price] = valid_orders
-            else:
-                del stock["asks"][price]
\ No newline at end of file
+    def verify_conservation(self, tolerance=1e-6):
+        """Whether money and shares are conserved and escrow matches the book; see conservation_problems."""
+        return not self.conservation_problems(tolerance)
+
+    def conservation_problems(self, tolerance=1e-6):
+        """Describe every way the ledger disagrees with what was issued or with the resting orders.
+
+        All cash must add up to the money issued to users and each stock's
+        shares to its IPO; no free or reserved cash may be negative; every
+        level's quantity must be the sum of its orders; and each user's
+        reserved cash and shares must be what their resting bids and asks
+        escrow. Cash is compared to within tolerance relative to the money
+        issued (per user, to the average initial balance). Holds every lock
+        while checking. Returns a list of messages, empty if all is well.
+        """
+        problems = []
+        with self.locked():
+            money_tolerance = tolerance * max(self.issued_money, 1)
+            user_tolerance = money_tolerance / max(len(self.users_balances), 1)
+            total_money = self.get_total_money()
+            if abs(total_money - self.issued_money) > money_tolerance:
+                problems.append(f"money {total_money} != {self.issued_money} issued")
+            share_totals = self.get_share_totals()
+            for stock_id, issued in self.issued_shares.items():
+                if share_totals.get(stock_id, 0) != issued:
+                    problems.append(f"{stock_id} shares {share_totals.get(stock_id, 0)} != {issued} issued")
+
+            # What the resting orders escrow
+            reserved_cash = {}
+            reserved_shares = {}
+            for stock_id, stock in self.stocks.items():
+                for side in ("bids", "asks"):
+                    for tick, level in stock[side].items():
+                        if level.quantity != sum(order.quantity for order in level.values()):
+                            problems.append(f"{stock_id} {side} level {tick} quantity does not match its orders")
+                        for order in level.values():
+                            if side == "bids":
+                                amount = self._tick_price(stock, tick) * order.quantity
+                                reserved_cash[order.user_id] = reserved_cash.get(order.user_id, 0) + amount
+                            else:
+                                key = (order.user_id, stock_id)
+                                reserved_shares[key] = reserved_shares.get(key, 0) + order.quantity
+
+            for user_id in self.users_balances:
+                if self.users_balances[user_id] < -user_tolerance or self.reserved_balances[user_id] < -user_tolerance:
+                    problems.append(f"user {user_id} has a negative balance")
+                if abs(self.reserved_balances[user_id] - reserved_cash.get(user_id, 0)) > user_tolerance:
+                    problems.append(f"user {user_id} reserved cash does not match resting bids")
+                for stock_id in self.stocks:
+                    if self.reserved_holdings[user_id].get(stock_id, 0) != reserved_shares.get((user_id, stock_id), 0):
+                        problems.append(f"user {user_id} reserved {stock_id} does not match resting asks")
+        return problems
@@ -0,0 +1,249 @@
+from bisect import bisect_right
+import math
+import os
+import threading
+import time
+import numpy as np
+
+# Aggressor column codes: the side of the incoming order that caused the fill
+AGGRESSOR_CODES = {"bid": 0, "ask": 1}
+
+# One row per fill. The cum_ columns are running totals over the stock's whole
+# tape up to and including the row, so any range of rows can be summarized
+# from its two end rows without a pass over the range.
+TAPE_DTYPE = np.dtype([
+    ("time", "<f8"), # epoch seconds
+    ("price", "<f8"),
+    ("quantity", "<i8"),
+    ("buyer", "<i8"),
+    ("seller", "<i8"),
+    ("aggressor", "u1"), # AGGRESSOR_CODES
+    ("cum_volume", "<i8"),
+    ("cum_notional", "<f8"), # sum of price * quantity
+    ("cum_sq_return", "<f8"), # sum of squared log returns between consecutive fills
+])
+
+# Fields of a fill as recorded, before the running totals are filled in
+_RECORD_FIELDS = ("time", "price", "quantity", "buyer", "seller", "aggressor")
+
+class _StockTape:
+    """Ring of one stock's fills plus the fills recorded since the last flush."""
+    __slots__ = ("rows", "head", "flushed", "columns", "flush_lock", "last_price",
+                 "cum_volume", "cum_notional", "cum_sq_return", "spill_file", "spill_start", "spilled")
+
+    def __init__(self, capacity):
+        self.rows = np.zeros(capacity, dtype=TAPE_DTYPE)
+        self.head = 0 # slot of the next row
+        self.flushed = 0 # rows written to the ring since the tape started
+        # Fills recorded but not yet in the ring, one list per _RECORD_FIELDS entry.
+        # Appended without a lock, time last, so the time column's length counts
+        # complete fills.
+        self.columns = tuple([] for _ in _RECORD_FIELDS)
+        self.flush_lock = threading.Lock() # one flusher at a time; held by readers of the ring
+        self.last_price = None
+        self.cum_volume = 0
+        self.cum_notional = 0.0
+        self.cum_sq_return = 0.0
+        self.spill_file = None
+        self.spill_start = 0 # rows already in the spill file when this tape opened it
+        self.spilled = 0 # rows this tape wrote to the spill file
+
+class TradeTape:
+    """Time and sales: every fill of every stock in a columnar ring per stock.
+
+    Register on_trade with StockExchange.add_trade_listener. Recording a fill
+    only timestamps it and appends its fields to the stock's pending columns;
+    every flush_size fills (or when the tape is read) they are flushed into a
+    preallocated TAPE_DTYPE ring in one vectorized step that also fills in the
+    running totals. The ring keeps the newest capacity fills. With spill_dir
+    set, each chunk_size rows are appended to <spill_dir>/<stock_id>.tape as
+    they fill, so the full history stays on disk (see spilled). The file is
+    only ever appended to, so a later tape over the same directory adds its
+    rows after the earlier ones, and every row is written exactly once even
+    when the tape keeps recording after close().
+
+    Readers get views into the ring, not copies. A view is only valid until
+    capacity more fills have been recorded; copy what you keep. stats()
+    summarizes any trailing time window from the running totals with two
+    binary searches, whatever the window's size.
+    """
+
+    def __init__(self, capacity=131_072, chunk_size=16_384, flush_size=4_096, spill_dir=None, clock=time.time):
+        if capacity % chunk_size:
+            raise ValueError("capacity must be a multiple of chunk_size.")
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        self.flush_size = flush_size
+        self.spill_dir = spill_dir
+        self.clock = clock # source of fill timestamps, epoch seconds
+        self._tapes = {} # stock_id -> _StockTape
+        self._lock = threading.Lock() # guards adding stocks
+
+    def on_trade(self, stock_id, price, quantity, buyer_id, seller_id, aggressor):
+        """Record one fill."""
+        tape = self._tapes.get(stock_id) or self._add_stock(stock_id)
+        times, prices, quantities, buyers, sellers, aggressors = tape.columns
+        prices.append(price)
+        quantities.append(quantity)
+        buyers.append(buyer_id)
+        sellers.append(seller_id)
+        aggressors.append(AGGRESSOR_CODES[aggressor])
+        times.append(self.clock())
+        if len(times) >= self.flush_size:
+            self._flush(tape, stock_id)
+
+    def _add_stock(self, stock_id):
+        with self._lock:
+            tape = self._tapes.get(stock_id)
+            if tape is None:
+                tape = self._tapes[stock_id] = _StockTape(self.capacity)
+            return tape
+
+    def _flush(self, tape, stock_id):
+        """Move pending fills into the ring, filling in the running totals and spilling full chunks."""
+        with tape.flush_lock:
+            count = len(tape.columns[0])
+            if not count:
+                return
+            block = np.empty(count, dtype=TAPE_DTYPE)
+            for name, column in zip(_RECORD_FIELDS, tape.columns):
+                block[name] = column[:count]
+                # Fields of a fill being recorded meanwhile stay for the next flush
+                del column[:count]
+            prices, quantities = block["price"], block["quantity"]
+            log_prices = np.log(prices)
+            returns = np.diff(log_prices, prepend=log_prices[0] if tape.last_price is None else math.log(tape.last_price))
+            block["cum_volume"] = tape.cum_volume + np.cumsum(quantities)
+            block["cum_notional"] = tape.cum_notional + np.cumsum(prices * quantities)
+            block["cum_sq_return"] = tape.cum_sq_return + np.cumsum(returns * returns)
+            last = block[-1]
+            tape.last_price = float(last["price"])
+            tape.cum_volume = int(last["cum_volume"])
+            tape.cum_notional = float(last["cum_notional"])
+            tape.cum_sq_return = float(last["cum_sq_return"])
+
+            # Copy in pieces that never cross a chunk boundary
+            written = 0
+            while written < count:
+                head = tape.head
+                take = min(count - written, self.chunk_size - head % self.chunk_size)
+                tape.rows[head:head + take] = block[written:written + take]
+                written += take
+                tape.head = (head + take) % self.capacity
+                if (head + take) % self.chunk_size == 0 and self.spill_dir is not None:
+                    self._spill(tape, stock_id, head + take, tape.flushed + written)
+            tape.flushed += count
+
+    def _spill(self, tape, stock_id, end, flushed):
+        """Append the ring rows before slot end that are not on disk yet; flushed counts the rows up to end.
+
+        Only the current chunk can hold unspilled rows, so they never wrap.
+        Caller holds flush_lock.
+        """
+        rows = tape.rows[end - (flushed - tape.spilled):end]
+        if not len(rows):
+            return
+        if tape.spill_file is None:
+            tape.spill_file = open(self._spill_path(stock_id), "ab")
+            if not tape.spilled:
+                tape.spill_start = tape.spill_file.tell() // TAPE_DTYPE.itemsize
+        tape.spill_file.write(rows.tobytes())
+        tape.spill_file.flush()
+        tape.spilled += len(rows)
+
+    def _spill_path(self, stock_id):
+        return os.path.join(self.spill_dir, f"{stock_id}.tape")
+
+    def _segments(self, tape):
+        """Views of the ring's rows, oldest first: one, or two if it has wrapped. Caller holds flush_lock."""
+        if tape.flushed <= self.capacity:
+            return [tape.rows[:tape.flushed]] if tape.flushed else []
+        return [segment for segment in (tape.rows[tape.head:], tape.rows[:tape.head]) if len(segment)]
+
+    def segments(self, stock_id):
+        """Views of the stock's fills in memory, oldest first (one view, or two once the ring has wrapped)."""
+        tape = self._tapes.get(stock_id)
+        if tape is None:
+            return []
+        self._flush(tape, stock_id)
+        with tape.flush_lock:
+            return self._segments(tape)
+
+    def last(self, stock_id, count):
+        """Views of the stock's newest count fills in memory, oldest first."""
+        views = []
+        for segment in reversed(self.segments(stock_id)):
+            if count <= 0:
+                break
+            views.append(segment[-count:])
+            count -= len(views[-1])
+        return views[::-1]
+
+    def count(self, stock_id):
+        """Fills recorded for the stock since the tape started, including any spilled or overwritten."""
+        tape = self._tapes.get(stock_id)
+        return 0 if tape is None else tape.flushed + len(tape.columns[0])
+
+    def stats(self, stock_id, window=None, now=None):
+        """Trade count, volume, VWAP, last price and realized volatility of the fills in the last window seconds.
+
+        window None covers every fill still in memory. Realized volatility is the
+        square root of the summed squared log returns between consecutive fills
+        in the window (not annualized).
+        """
+        stats = {"trades": 0, "volume": 0, "vwap": None, "last_price": None, "realized_volatility": 0.0}
+        tape = self._tapes.get(stock_id)
+        if tape is None:
+            return stats
+        self._flush(tape, stock_id)
+        with tape.flush_lock:
+            segments = self._segments(tape)
+            if not segments:
+                return stats
+            if window is None:
+                position, index = 0, 0
+            else:
+                cutoff = (self.clock() if now is None else now) - window
+                for position, segment in enumerate(segments):
+                    # bisect reads a few rows in place; searchsorted would copy the strided column
+                    index = bisect_right(segment["time"], cutoff)
+                    if index < len(segment):
+                        break
+                else:
+                    return stats
+            first, last = segments[position][index], segments[-1][-1]
+            trades = sum(len(segment) for segment in segments[position:]) - index
+            volume = int(last["cum_volume"] - first["cum_volume"] + first["quantity"])
+            notional = float(last["cum_notional"] - first["cum_notional"] + first["price"] * first["quantity"])
+            stats.update(
+                trades=trades,
+                volume=volume,
+                vwap=notional / volume if volume else None,
+                last_price=float(last["price"]),
+                realized_volatility=math.sqrt(max(float(last["cum_sq_return"] - first["cum_sq_return"]), 0.0)),
+            )
+        return stats
+
+    def spilled(self, stock_id):
+        """Read-only memory map of the rows this tape spilled for the stock (empty without spill_dir or before the first chunk)."""
+        tape = self._tapes.get(stock_id)
+        if tape is None or not tape.spilled:
+            return np.zeros(0, dtype=TAPE_DTYPE)
+        with tape.flush_lock:
+            return np.memmap(self._spill_path(stock_id), dtype=TAPE_DTYPE, mode="r",
+                             offset=tape.spill_start * TAPE_DTYPE.itemsize, shape=(tape.spilled,))
+
+    def close(self):
+        """Flush every stock and close the spill files; the rows after the last full chunk are spilled too.
+
+        Fills recorded after close() are spilled from where it stopped, to the
+        end of the same file.
+        """
+        for stock_id, tape in list(self._tapes.items()):
+            self._flush(tape, stock_id)
+            with tape.flush_lock:
+                if self.spill_dir is not None:
+                    self._spill(tape, stock_id, tape.head or self.capacity, tape.flushed)
+                if tape.spill_file is not None:
+                    tape.spill_file.close()
+                    tape.spill_file = None
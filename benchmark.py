@@ -0,0 +1,1213 @@
+#!/usr/bin/env python3
+"""
+Matching Engine Benchmarks
+
+Micro-benchmarks for StockExchange. Each benchmark prints a small table and
+returns its results so they can be compared between versions.
+
+To run:
+    python benchmark.py depth
+    python benchmark.py batch
+    python benchmark.py ledger
+    python benchmark.py journal
+    python benchmark.py snapshot
+    python benchmark.py simulate --traders 1000 --orders 100000 --output results.json
+    python benchmark.py sharded --stocks 200 --shards 1 2 4
+    python benchmark.py gateway --producers 1 4 16
+    python benchmark.py stress --threads 1 4 8
+    python benchmark.py deltas --traders 1000 --orders-per-tick 100
+    python benchmark.py publisher --clients 500 --slow-fraction 0.2
+    python benchmark.py candles --trades 1000000
+    python benchmark.py tape --orders 200000
+    python benchmark.py leaderboard --traders 1000 10000 100000
+    python benchmark.py pnl --users 100000 --stocks 100
+    python benchmark.py logging --orders 50000
+    python benchmark.py metrics --ticks 2000
+    python benchmark.py profiler --ticks 300
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import numpy as np
+from BookFeed import BookFeed
+from CandleAggregator import CandleAggregator, downsample
+import EventLog
+from Journal import Journal, FSYNC_POLICIES
+from Leaderboard import Leaderboard
+from Metrics import Metrics, exchange_collector
+from OrderGateway import OrderGateway
+from Profiler import Profiler, SAMPLING, DETERMINISTIC
+from MarketPublisher import MarketPublisher, encode_frame, DELTA
+from MarketSnapshot import MarketSnapshot
+from PnLEngine import PnLEngine
+from RandomTraders import RandomTraders
+from ShardedExchange import ShardedExchange
+from StockExchange import StockExchange
+from TradeTape import TradeTape
+
+# Best ask of the synthetic books; best bid sits one tick below
+BOOK_MID = 200_000
+
+def build_deep_book(num_levels, stock_id="BENCH", spare_shares=100_000, ladder="sorted"):
+    """Create an exchange with num_levels resting price levels on each side."""
+    exchange = StockExchange()
+    exchange.ipo_stock(stock_id, num_levels + 2 * spare_shares, 100, tick_size=1, ladder=ladder)
+    exchange.add_user(1, (num_levels + spare_shares) * 2 * BOOK_MID)
+    exchange.add_user(2, 0)
+    exchange.transfer_stock(0, 2, stock_id, spare_shares)
+
+    # Asks from BOOK_MID up and bids from BOOK_MID - 1 down, one order per level
+    for i in range(num_levels):
+        exchange.place_order(stock_id, 0, "ask", "limit", 1, BOOK_MID + i)
+        exchange.place_order(stock_id, 1, "bid", "limit", 1, BOOK_MID - 1 - i)
+    return exchange
+
+def bench_book_depth(depths=(10, 100, 1_000, 10_000, 100_000), num_orders=20_000, ladder="sorted"):
+    """Measure per-order matching cost as the number of resting levels grows.
+
+    Every iteration sends a marketable order that consumes the best level and a
+    limit order that replenishes it, so the book depth stays constant.
+    """
+    stock_id = "BENCH"
+    results = []
+    print(f"{'levels':>10} {'orders':>10} {'us/order':>10}")
+    for depth in depths:
+        exchange = build_deep_book(depth, stock_id, spare_shares=num_orders, ladder=ladder)
+        start = time.perf_counter()
+        for i in range(num_orders // 2):
+            if i % 2:
+                exchange.place_order(stock_id, 1, "bid", "market", 1)
+                exchange.place_order(stock_id, 0, "ask", "limit", 1, BOOK_MID)
+            else:
+                exchange.place_order(stock_id, 2, "ask", "market", 1)
+                exchange.place_order(stock_id, 1, "bid", "limit", 1, BOOK_MID - 1)
+        elapsed = time.perf_counter() - start
+        per_order_us = elapsed / num_orders * 1e6
+        results.append({"levels": depth, "ladder": ladder, "orders": num_orders, "us_per_order": per_order_us})
+        print(f"{depth:>10} {num_orders:>10} {per_order_us:>10.2f}")
+    return results
+
+def bench_batch(num_orders=50_000, num_traders=200, seed=1):
+    """Compare place_orders on one columnar batch with the same orders sent one at a time."""
+    stock_id = "BENCH"
+    rng = random.Random(seed)
+    batch = {
+        "stock": [stock_id] * num_orders,
+        "user": [rng.randint(1, num_traders) for _ in range(num_orders)],
+        "side": [rng.randint(0, 1) for _ in range(num_orders)],
+        "type": [1 if rng.random() < 0.7 else 0 for _ in range(num_orders)],
+        "qty": [rng.randint(1, 50) for _ in range(num_orders)],
+        "price": [rng.uniform(95, 105) for _ in range(num_orders)],
+    }
+
+    def fresh_exchange():
+        exchange = StockExchange()
+        exchange.ipo_stock(stock_id, num_traders * 1_000, 100)
+        for user_id in range(1, num_traders + 1):
+            exchange.add_user(user_id, 1_000_000)
+            exchange.transfer_stock(0, user_id, stock_id, 1_000)
+        return exchange
+
+    exchange = fresh_exchange()
+    start = time.perf_counter()
+    for i in range(num_orders):
+        try:
+            exchange.place_order(stock_id, batch["user"][i], ("bid", "ask")[batch["side"][i]],
+                                 ("market", "limit")[batch["type"][i]], batch["qty"][i], batch["price"][i])
+        except ValueError:
+            pass
+    single_rate = num_orders / (time.perf_counter() - start)
+
+    exchange = fresh_exchange()
+    start = time.perf_counter()
+    exchange.place_orders(batch)
+    batch_rate = num_orders / (time.perf_counter() - start)
+
+    print(f"{'mode':>10} {'orders/s':>12}")
+    print(f"{'single':>10} {single_rate:>12.0f}")
+    print(f"{'batch':>10} {batch_rate:>12.0f}")
+    return {"orders": num_orders, "single_orders_per_sec": single_rate, "batch_orders_per_sec": batch_rate}
+
+def bench_ledger(trader_counts=(1_000, 10_000, 100_000), num_orders=50_000, seed=1):
+    """Compare the dict and compact ledgers: memory, order rate and a conservation query."""
+    stock_id = "BENCH"
+    results = []
+    print(f"{'ledger':>8} {'traders':>8} {'MB':>8} {'orders/s':>10} {'query ms':>9}")
+    for num_traders in trader_counts:
+        rng = random.Random(seed)
+        orders = [(rng.randint(1, num_traders), rng.choice(("bid", "ask")), rng.randint(1, 20), rng.uniform(95, 105))
+                  for _ in range(num_orders)]
+        for ledger in ("dict", "compact"):
+            tracemalloc.start()
+            exchange = StockExchange(ledger=ledger)
+            exchange.ipo_stock(stock_id, num_traders * 100, 100)
+            for user_id in range(1, num_traders + 1):
+                exchange.add_user(user_id, 100_000)
+                exchange.transfer_stock(0, user_id, stock_id, 100)
+            memory_mb = tracemalloc.get_traced_memory()[0] / 1e6
+            tracemalloc.stop()
+
+            start = time.perf_counter()
+            for user_id, side, quantity, price in orders:
+                try:
+                    exchange.place_order(stock_id, user_id, side, "limit", quantity, price)
+                except ValueError:
+                    pass
+            order_rate = num_orders / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            exchange.get_total_money()
+            exchange.get_share_totals()
+            exchange.get_mark_to_market()
+            query_ms = (time.perf_counter() - start) * 1e3
+
+            results.append({"ledger": ledger, "traders": num_traders, "memory_mb": memory_mb,
+                            "orders_per_sec": order_rate, "query_ms": query_ms})
+            print(f"{ledger:>8} {num_traders:>8} {memory_mb:>8.1f} {order_rate:>10.0f} {query_ms:>9.2f}")
+    return results
+
+def bench_journal(num_orders=50_000, num_traders=200, group_size=1024, seed=1):
+    """Compare place_order throughput with and without a journal under each fsync policy.
+
+    Also reports the raw record rate of the journal on its own, which must stay
+    well above the matching rate for journaling not to become the bottleneck.
+    """
+    stock_id = "BENCH"
+    rng = random.Random(seed)
+    orders = [(rng.randint(1, num_traders), rng.choice(("bid", "ask")), rng.randint(1, 20), rng.uniform(95, 105))
+              for _ in range(num_orders)]
+    results = []
+    print(f"{'journal':>10} {'orders/s':>10} {'MB':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.journal")
+        for fsync in (None,) + FSYNC_POLICIES:
+            journal = None if fsync is None else Journal(path, fsync=fsync, group_size=group_size, truncate=True)
+            exchange = StockExchange(journal=journal)
+            exchange.ipo_stock(stock_id, num_traders * 1_000, 100)
+            for user_id in range(1, num_traders + 1):
+                exchange.add_user(user_id, 1_000_000)
+                exchange.transfer_stock(0, user_id, stock_id, 1_000)
+
+            start = time.perf_counter()
+            for user_id, side, quantity, price in orders:
+                try:
+                    exchange.place_order(stock_id, user_id, side, "limit", quantity, price)
+                except ValueError:
+                    pass
+            if journal is not None:
+                journal.close()
+            order_rate = num_orders / (time.perf_counter() - start)
+            size_mb = os.path.getsize(path) / 1e6 if journal is not None else 0.0
+            name = fsync or "off"
+            results.append({"journal": name, "orders_per_sec": order_rate, "size_mb": size_mb})
+            print(f"{name:>10} {order_rate:>10.0f} {size_mb:>8.2f}")
+
+        # Journal alone
+        journal = Journal(path, fsync="always", group_size=group_size, truncate=True)
+        start = time.perf_counter()
+        for user_id, side, quantity, price in orders:
+            journal.record_order(stock_id, user_id, side, "limit", quantity, price)
+        journal.close()
+        record_rate = num_orders / (time.perf_counter() - start)
+        results.append({"journal": "records only", "records_per_sec": record_rate})
+        print(f"{'records':>10} {record_rate:>10.0f}")
+    return results
+
+def bench_snapshot(num_orders=1_000_000, num_traders=1_000, ledger="dict", seed=1):
+    """Time building a book of num_orders resting orders against snapshot and restore.
+
+    The snapshot file doubles as a prebuilt scenario: restoring it loads the
+    whole book without sending a single order through matching.
+    """
+    stock_id = "BENCH"
+    rng = np.random.default_rng(seed)
+    # Bids below and asks above the mid so nothing crosses
+    sides = rng.integers(0, 2, num_orders)
+    offsets = rng.integers(1, 5_000, num_orders)
+    batch = {
+        "stock": [stock_id] * num_orders,
+        "user": rng.integers(1, num_traders + 1, num_orders),
+        "side": sides,
+        "type": np.ones(num_orders, dtype=np.int8),
+        "qty": rng.integers(1, 50, num_orders),
+        "price": np.where(sides == 0, BOOK_MID - offsets, BOOK_MID + offsets),
+    }
+
+    start = time.perf_counter()
+    exchange = StockExchange(ledger=ledger)
+    exchange.ipo_stock(stock_id, num_orders * 50, 100, tick_size=1)
+    for user_id in range(1, num_traders + 1):
+        exchange.add_user(user_id, num_orders * 50 * BOOK_MID)
+        exchange.transfer_stock(0, user_id, stock_id, num_orders * 50 // num_traders)
+    exchange.place_orders(batch)
+    build_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "scenario.snapshot")
+        start = time.perf_counter()
+        exchange.snapshot(path)
+        snapshot_seconds = time.perf_counter() - start
+        size_mb = os.path.getsize(path) / 1e6
+
+        start = time.perf_counter()
+        restored = StockExchange.restore(path, ledger=ledger)
+        restore_seconds = time.perf_counter() - start
+
+    print(f"{'orders':>10} {'build s':>9} {'snapshot s':>11} {'restore s':>10} {'MB':>8}")
+    print(f"{len(restored.orders):>10} {build_seconds:>9.2f} {snapshot_seconds:>11.2f} {restore_seconds:>10.2f} {size_mb:>8.1f}")
+    return {"orders": len(restored.orders), "build_s": build_seconds, "snapshot_s": snapshot_seconds,
+            "restore_s": restore_seconds, "size_mb": size_mb}
+
+def run_simulation(num_traders=1_000, num_orders=100_000, depth=100, buy_probability=0.5,
+                   limit_order_probability=0.7, mode="per_order", batch_size=100,
+                   ledger="dict", ladder="sorted", seed=1):
+    """Run the StockExchange + RandomTraders workload headless, with no sleeps or Flask.
+
+    Every random draw comes from seed, so two runs with the same arguments place
+    the same orders and end in the same state (trade_count and final_price in
+    the results double as a check). depth resting levels are placed on each
+    side before the timed run. In "per_order" mode each place_order call is
+    timed; in "vectorized" mode RandomTraders.place_random_orders batches of
+    batch_size are timed and latency is the batch time per order.
+    """
+    stock_id = "SIM"
+    shares_per_trader = 100
+    level_quantity = 100
+    exchange = StockExchange(ledger=ledger)
+    exchange.ipo_stock(stock_id, num_traders * shares_per_trader + depth * level_quantity, 100, ladder=ladder)
+    traders = RandomTraders(exchange, stock_id, num_traders, 20_000, seed=seed, buy_probability=buy_probability,
+                            limit_order_probability=limit_order_probability, verbose=False)
+    for trader_id in traders.trader_ids:
+        exchange.transfer_stock(0, trader_id, stock_id, shares_per_trader)
+
+    # Resting depth: the market user offers above the IPO price, a market maker bids below
+    market_maker = num_traders + 1
+    exchange.add_user(market_maker, depth * level_quantity * 100)
+    tick_size = exchange.get_tick_size(stock_id)
+    for i in range(1, depth + 1):
+        exchange.place_order(stock_id, 0, "ask", "limit", level_quantity, 100 + i * tick_size)
+        exchange.place_order(stock_id, market_maker, "bid", "limit", level_quantity, 100 - i * tick_size)
+
+    trades_before = exchange.trade_count
+    latencies = []
+    placed = rejected = 0
+    clock = time.perf_counter_ns
+    wall_start = time.perf_counter()
+    if mode == "per_order":
+        rng = traders.rng
+        for _ in range(num_orders):
+            trader_id = rng.choice(traders.trader_ids)
+            order = traders.draw_random_order(trader_id)
+            if order is None:
+                continue
+            bid_or_ask, order_type, quantity, order_price = order
+            start = clock()
+            try:
+                exchange.place_order(stock_id, trader_id, bid_or_ask, order_type, quantity, order_price)
+            except ValueError:
+                rejected += 1
+            latencies.append(clock() - start)
+            placed += 1
+    else:
+        for _ in range(num_orders // batch_size):
+            batch = traders.generate_orders(batch_size)
+            if batch is None:
+                continue
+            start = clock()
+            results = exchange.place_orders(batch)
+            elapsed = clock() - start
+            size = len(results["status"])
+            latencies.extend([elapsed / size] * size)
+            placed += size
+            rejected += int(results["status"].sum())
+    wall_seconds = time.perf_counter() - wall_start
+
+    latencies = np.array(latencies, dtype=np.float64)
+    engine_seconds = latencies.sum() / 1e9
+    fills = exchange.trade_count - trades_before
+    p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9]) / 1e3 if len(latencies) else (0.0, 0.0, 0.0)
+    return {
+        "config": {"traders": num_traders, "orders": num_orders, "depth": depth, "buy_probability": buy_probability,
+                   "limit_order_probability": limit_order_probability, "mode": mode, "batch_size": batch_size,
+                   "ledger": ledger, "ladder": ladder, "seed": seed},
+        "orders_placed": placed,
+        "orders_rejected": rejected,
+        "fills": fills,
+        "orders_per_sec": placed / engine_seconds if engine_seconds else 0.0,
+        "fills_per_sec": fills / engine_seconds if engine_seconds else 0.0,
+        "wall_orders_per_sec": placed / wall_seconds if wall_seconds else 0.0,
+        "latency_us": {"p50": float(p50), "p99": float(p99), "p99.9": float(p999)},
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "trade_count": exchange.trade_count,
+        "final_price": exchange.get_stock_price(stock_id),
+        "python": platform.python_version(),
+        "commit": _git_commit(),
+    }
+
+def bench_sharded(num_stocks=200, shard_counts=(1, 2, 4), num_orders=200_000, batch_size=10_000,
+                  num_traders=1_000, seed=1):
+    """Compare one StockExchange with ShardedExchange at several shard counts on many symbols.
+
+    The market user offers every stock and traders bid for them, in batches that
+    mix all symbols, so each shard gets a slice of every batch.
+    """
+    stock_ids = [f"S{i:04d}" for i in range(num_stocks)]
+    rng = np.random.default_rng(seed)
+    batches = []
+    for _ in range(num_orders // batch_size):
+        sides = rng.integers(0, 2, batch_size)
+        batches.append({
+            "stock": [stock_ids[i] for i in rng.integers(0, num_stocks, batch_size)],
+            "user": np.where(sides == 1, 0, rng.integers(1, num_traders + 1, batch_size)),
+            "side": sides,
+            "type": np.ones(batch_size, dtype=np.int8),
+            "qty": rng.integers(1, 20, batch_size),
+            "price": rng.uniform(95, 105, batch_size),
+        })
+
+    def run(exchange):
+        for stock_id in stock_ids:
+            exchange.ipo_stock(stock_id, num_orders * 20, 100)
+        if isinstance(exchange, ShardedExchange):
+            exchange.add_users(range(1, num_traders + 1), 10_000_000)
+        else:
+            for user_id in range(1, num_traders + 1):
+                exchange.add_user(user_id, 10_000_000)
+        filled = 0
+        start = time.perf_counter()
+        for batch in batches:
+            filled += int(exchange.place_orders(batch)["filled"].sum())
+        return num_orders / (time.perf_counter() - start), filled
+
+    results = []
+    print(f"{'exchange':>12} {'orders/s':>10} {'filled':>10}")
+    rate, filled = run(StockExchange())
+    results.append({"shards": 0, "orders_per_sec": rate, "filled": filled})
+    print(f"{'single':>12} {rate:>10.0f} {filled:>10}")
+    for num_shards in shard_counts:
+        with ShardedExchange(num_shards=num_shards) as exchange:
+            rate, filled = run(exchange)
+        results.append({"shards": num_shards, "orders_per_sec": rate, "filled": filled})
+        print(f"{f'{num_shards} shards':>12} {rate:>10.0f} {filled:>10}")
+    print(f"({os.cpu_count()} CPUs available)")
+    return results
+
+def bench_gateway(num_orders=100_000, producer_counts=(1, 4, 16), num_traders=200, max_batch=512, seed=1):
+    """Compare direct place_order calls with orders sent through an OrderGateway.
+
+    Thread producers submit their whole share and then wait for the acks;
+    coroutine producers run on the gateway loop and await each ack in turn,
+    like simulated agents would. Ack latency is measured per order.
+    """
+    stock_id = "BENCH"
+    rng = random.Random(seed)
+    orders = [(rng.randint(1, num_traders), rng.choice(("bid", "ask")), rng.randint(1, 20), rng.uniform(95, 105))
+              for _ in range(num_orders)]
+
+    def fresh_exchange():
+        exchange = StockExchange()
+        exchange.ipo_stock(stock_id, num_traders * 1_000, 100)
+        for user_id in range(1, num_traders + 1):
+            exchange.add_user(user_id, 1_000_000)
+            exchange.transfer_stock(0, user_id, stock_id, 1_000)
+        return exchange
+
+    def report(name, elapsed, latencies, gateway=None):
+        row = {"producers": name, "orders_per_sec": num_orders / elapsed}
+        line = f"{name:>14} {row['orders_per_sec']:>10.0f}"
+        if latencies is not None:
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1e6
+            row.update(p50_us=p50, p99_us=p99, mean_batch=gateway.processed / gateway.batches)
+            line += f" {p50:>8.1f} {p99:>8.1f} {row['mean_batch']:>6.1f}"
+        results.append(row)
+        print(line)
+
+    results = []
+    print(f"{'producers':>14} {'orders/s':>10} {'p50 us':>8} {'p99 us':>8} {'batch':>6}")
+    exchange = fresh_exchange()
+    start = time.perf_counter()
+    for user_id, side, quantity, price in orders:
+        try:
+            exchange.place_order(stock_id, user_id, side, "limit", quantity, price)
+        except ValueError:
+            pass
+    report("direct", time.perf_counter() - start, None)
+
+    for num_producers in producer_counts:
+        gateway = OrderGateway(fresh_exchange(), max_queue=num_orders, max_batch=max_batch)
+        latencies = np.zeros(num_orders)
+
+        def produce(first):
+            submitted = []
+            for i in range(first, num_orders, num_producers):
+                user_id, side, quantity, price = orders[i]
+                ack = gateway.submit("order", stock_id, user_id, side, "limit", quantity, price)
+                ack.add_done_callback(lambda _, i=i, sent=time.perf_counter(): latencies.__setitem__(i, time.perf_counter() - sent))
+                submitted.append(ack)
+            for ack in submitted:
+                ack.exception()
+
+        threads = [threading.Thread(target=produce, args=(first,)) for first in range(num_producers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report(f"{num_producers} threads", time.perf_counter() - start, latencies, gateway)
+        gateway.close()
+
+        gateway = OrderGateway(fresh_exchange(), max_queue=max_batch, max_batch=max_batch)
+        latencies = np.zeros(num_orders)
+
+        async def agent(first):
+            for i in range(first, num_orders, num_producers):
+                user_id, side, quantity, price = orders[i]
+                sent = time.perf_counter()
+                try:
+                    await gateway.send("order", stock_id, user_id, side, "limit", quantity, price)
+                except ValueError:
+                    pass
+                latencies[i] = time.perf_counter() - sent
+
+        async def agents():
+            await asyncio.gather(*(agent(first) for first in range(num_producers)))
+
+        start = time.perf_counter()
+        gateway.spawn(agents()).result()
+        report(f"{num_producers} coroutines", time.perf_counter() - start, latencies, gateway)
+        gateway.close()
+    return results
+
+def bench_stress(thread_counts=(1, 4, 8), num_stocks=8, num_ops=100_000, num_traders=200, ledger="dict", seed=1):
+    """Drive one StockExchange from several matching threads and check it afterwards.
+
+    Every thread places, cancels and amends orders on random stocks and moves
+    cash between random traders, so both books and cash rows are contended. A
+    reader thread polls depth, prices and totals meanwhile. Once the threads
+    join, exchange.verify_conservation() must hold (see
+    StockExchange.conservation_problems) and the reader must not have failed.
+    Raises RuntimeError otherwise.
+    """
+    stock_ids = [f"S{i:02d}" for i in range(num_stocks)]
+    initial_balance = 100_000
+    shares_each = 1_000
+
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"Python {platform.python_version()}, GIL {'enabled' if gil else 'disabled'}, {os.cpu_count()} CPUs")
+    print(f"{'threads':>8} {'ops/s':>10} {'trades':>8} {'reads':>8} {'check':>6}")
+    results = []
+    for num_threads in thread_counts:
+        exchange = StockExchange(ledger=ledger)
+        for stock_id in stock_ids:
+            exchange.ipo_stock(stock_id, num_traders * shares_each, 100)
+        for user_id in range(1, num_traders + 1):
+            exchange.add_user(user_id, initial_balance)
+            for stock_id in stock_ids:
+                exchange.transfer_stock(0, user_id, stock_id, shares_each)
+
+        def trade(thread_seed, num_ops):
+            rng = random.Random(thread_seed)
+            placed = []
+            for _ in range(num_ops):
+                action = rng.random()
+                try:
+                    if action < 0.8 or not placed:
+                        side = rng.choice(("bid", "ask"))
+                        order_type = "limit" if rng.random() < 0.8 else "market"
+                        _, _, order_id = exchange.place_order(rng.choice(stock_ids), rng.randint(1, num_traders), side,
+                                                              order_type, rng.randint(1, 20), rng.uniform(95, 105))
+                        placed.append(order_id)
+                    elif action < 0.9:
+                        exchange.cancel_order(placed.pop(rng.randrange(len(placed))))
+                    elif action < 0.95:
+                        exchange.amend_order(rng.choice(placed), rng.randint(1, 30))
+                    else:
+                        exchange.transfer_money(rng.randint(1, num_traders), rng.randint(1, num_traders), rng.uniform(1, 100))
+                except ValueError:
+                    pass # unfunded, or the order already filled or was cancelled
+
+        reader_errors = []
+        reads = 0
+        running = threading.Event()
+        running.set()
+
+        def read():
+            nonlocal reads
+            while running.is_set():
+                try:
+                    for stock_id in stock_ids:
+                        exchange.get_depth(stock_id, "bid", 10)
+                        exchange.get_stock_price(stock_id)
+                    exchange.get_share_totals()
+                    reads += 1
+                except Exception as error:
+                    reader_errors.append(f"reader: {type(error).__name__}: {error}")
+
+        reader = threading.Thread(target=read)
+        threads = [threading.Thread(target=trade, args=(seed + i, num_ops // num_threads)) for i in range(num_threads)]
+        start = time.perf_counter()
+        reader.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        running.clear()
+        reader.join()
+
+        problems = reader_errors
+        if not exchange.verify_conservation():
+            problems = reader_errors + exchange.conservation_problems()
+        rate = num_ops / elapsed
+        results.append({"threads": num_threads, "ops_per_sec": rate, "trades": exchange.trade_count,
+                        "reads": reads, "problems": problems})
+        print(f"{num_threads:>8} {rate:>10.0f} {exchange.trade_count:>8} {reads:>8} {'ok' if not problems else 'FAIL':>6}")
+        for problem in problems[:10]:
+            print(f"  {problem}")
+    if any(result["problems"] for result in results):
+        raise RuntimeError("Concurrent matching broke an exchange invariant.")
+    return results
+
+def bench_deltas(num_traders=1_000, orders_per_tick=100, num_ticks=500, max_levels=18, seed=1):
+    """Compare the full per-tick market_update payload with BookFeed diffs.
+
+    Runs the visualizer's per-tick workload (orders_per_tick random orders,
+    then one publish) and measures the JSON size and encoding time of both the
+    MarketSnapshot payload that used to be emitted every tick and the BookFeed
+    diff that replaces it. The diff is measured in steady state, after the
+    initial snapshot a client receives once on connect.
+    """
+    exchange = StockExchange()
+    exchange.ipo_stock("TECH", num_traders * 100, 100)
+    traders = RandomTraders(exchange, "TECH", num_traders, 10_000, seed=seed, verbose=False)
+    for trader_id in traders.trader_ids:
+        exchange.transfer_stock(0, trader_id, "TECH", 100)
+    market_snapshot = MarketSnapshot(exchange, "TECH", traders.trader_ids, max_levels=max_levels)
+    feed = BookFeed(exchange, "TECH", traders.trader_ids)
+    snapshot_bytes = len(json.dumps(feed.snapshot()))
+
+    full_bytes = delta_bytes = 0
+    full_time = delta_time = 0.0
+    for _ in range(num_ticks):
+        for _ in range(orders_per_tick):
+            traders.place_random_order(traders.rng.choice(traders.trader_ids))
+
+        start = time.perf_counter()
+        full_bytes += len(json.dumps({"market_data": market_snapshot.get(include_full_history=False)}))
+        full_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        delta_bytes += len(json.dumps({"delta": feed.delta()}))
+        delta_time += time.perf_counter() - start
+
+    print(f"{'payload':>10} {'bytes/tick':>11} {'us/tick':>9}")
+    print(f"{'full':>10} {full_bytes / num_ticks:>11.0f} {full_time / num_ticks * 1e6:>9.0f}")
+    print(f"{'delta':>10} {delta_bytes / num_ticks:>11.0f} {delta_time / num_ticks * 1e6:>9.0f}")
+    print(f"initial snapshot {snapshot_bytes} bytes; delta is {full_bytes / delta_bytes:.1f}x smaller, "
+          f"{full_time / delta_time:.1f}x faster to build and encode")
+    return {"full_bytes_per_tick": full_bytes / num_ticks, "delta_bytes_per_tick": delta_bytes / num_ticks,
+            "full_us_per_tick": full_time / num_ticks * 1e6, "delta_us_per_tick": delta_time / num_ticks * 1e6,
+            "snapshot_bytes": snapshot_bytes}
+
+def bench_publisher(num_clients=500, slow_fraction=0.2, slow_ack=1.0, intervals=(0.1, 0.2, 0.5, 1.0),
+                    num_traders=1_000, orders_per_tick=100, tick=0.05, duration=10.0, seed=1):
+    """Fan BookFeed diffs out to many simulated clients through MarketPublisher.
+
+    Every tick the trading thread places orders_per_tick orders and publishes
+    one diff, as the visualizer's trading_loop does. Clients ask for one of
+    intervals at random; fast ones acknowledge each frame immediately, the
+    slow_fraction of slow ones only after slow_ack seconds, so their updates
+    must be conflated. Reports the cost of publish() on the trading thread,
+    frames encoded vs. delivered and bytes sent, against emitting the JSON diff
+    to every client every tick.
+    """
+    rng = random.Random(seed)
+    exchange = StockExchange()
+    exchange.ipo_stock("TECH", num_traders * 100, 100)
+    traders = RandomTraders(exchange, "TECH", num_traders, 10_000, seed=seed, verbose=False)
+    for trader_id in traders.trader_ids:
+        exchange.transfer_stock(0, trader_id, "TECH", 100)
+    feed = BookFeed(exchange, "TECH", [])
+    leaderboard = Leaderboard(exchange, traders.trader_ids)
+
+    slow = set(rng.sample(range(num_clients), int(num_clients * slow_fraction)))
+    pending_acks = [] # (due, callback) of slow clients
+    pending_lock = threading.Lock()
+
+    def send(sid, frame, callback):
+        if sid in slow:
+            with pending_lock:
+                pending_acks.append((time.monotonic() + slow_ack, callback))
+        else:
+            callback()
+
+    stop = threading.Event()
+
+    def acker():
+        while not stop.wait(0.01):
+            now = time.monotonic()
+            with pending_lock:
+                due = [callback for when, callback in pending_acks if when <= now]
+                pending_acks[:] = [(when, callback) for when, callback in pending_acks if when > now]
+            for callback in due:
+                callback()
+
+    acker_thread = threading.Thread(target=acker, daemon=True)
+    acker_thread.start()
+    publisher = MarketPublisher(send, feed.snapshot, default_interval=min(intervals), min_interval=min(intervals))
+    for sid in range(num_clients):
+        publisher.add_client(sid, rng.choice(intervals))
+
+    publish_times = []
+    json_bytes = num_ticks = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        started = time.monotonic()
+        for _ in range(orders_per_tick):
+            traders.place_random_order(traders.rng.choice(traders.trader_ids))
+        delta = feed.delta()
+        leaderboard.update()
+        board = leaderboard.board(10, "TECH")
+        start = time.perf_counter()
+        publisher.publish(delta, None, board)
+        publish_times.append(time.perf_counter() - start)
+        json_bytes += len(json.dumps({"delta": delta})) * num_clients
+        num_ticks += 1
+        time.sleep(max(0.0, tick - (time.monotonic() - started)))
+
+    publisher.close()
+    stop.set()
+    acker_thread.join()
+    publish_us = np.array(publish_times) * 1e6
+    print(f"{num_clients} clients ({len(slow)} slow), {num_ticks} ticks of {tick * 1000:.0f} ms")
+    print(f"publish() on the trading thread: mean {publish_us.mean():.1f} us, max {publish_us.max():.1f} us")
+    print(f"frames encoded {publisher.frames_encoded}, sent {publisher.frames_sent} "
+          f"({publisher.frames_sent / max(publisher.frames_encoded, 1):.1f} sends per encode)")
+    print(f"bytes sent {publisher.bytes_sent / 1e6:.1f} MB vs. {json_bytes / 1e6:.1f} MB of JSON diffs to every client "
+          f"every tick ({json_bytes / max(publisher.bytes_sent, 1):.1f}x)")
+    return {"ticks": num_ticks, "publish_us_mean": float(publish_us.mean()), "publish_us_max": float(publish_us.max()),
+            "frames_encoded": publisher.frames_encoded, "frames_sent": publisher.frames_sent,
+            "bytes_sent": publisher.bytes_sent, "json_bytes": json_bytes}
+
+def bench_candles(num_trades=1_000_000, trades_per_second=200, capacity=1_000, max_points=400, seed=1):
+    """Feed a synthetic trade stream to CandleAggregator and read it back.
+
+    Trades arrive at trades_per_second of simulated time, so a million trades
+    span well over an hour and every resolution wraps its ring. Reports the
+    per-fill cost of on_trade, the memory held by the rings (which stays fixed
+    however long the stream runs), the cost of reading bars back, and of a
+    range query over the middle half of the history merged to max_points bars.
+    """
+    rng = np.random.default_rng(seed)
+    prices = np.round(100 + np.cumsum(rng.normal(0, 0.02, num_trades)), 2).tolist()
+    quantities = rng.integers(1, 11, num_trades).tolist()
+    timestamps = (1_700_000_000 + np.cumsum(rng.exponential(1 / trades_per_second, num_trades))).tolist()
+    aggregator = CandleAggregator(capacity=capacity)
+
+    start = time.perf_counter()
+    on_trade = aggregator.on_trade
+    for price, quantity, timestamp in zip(prices, quantities, timestamps):
+        on_trade("BENCH", price, quantity, timestamp=timestamp)
+    feed_time = time.perf_counter() - start
+
+    ring_bytes = sum(ring.starts.nbytes + ring.bars.nbytes for ring in aggregator._stocks["BENCH"].rings)
+    print(f"{num_trades} trades over {(timestamps[-1] - timestamps[0]) / 60:.0f} simulated minutes: "
+          f"{feed_time / num_trades * 1e6:.2f} us per trade, rings hold {ring_bytes / 1024:.0f} KB")
+    print(f"{'resolution':>10} {'bars kept':>10} {'read 100 us':>12} {'read all us':>12} {'range us':>9}")
+    results = {"us_per_trade": feed_time / num_trades * 1e6, "ring_bytes": ring_bytes, "read_us": {}, "range_us": {}}
+    for resolution in aggregator.resolutions:
+        start = time.perf_counter()
+        aggregator.candles("BENCH", resolution, 100)
+        read_100 = time.perf_counter() - start
+        start = time.perf_counter()
+        starts = aggregator.arrays("BENCH", resolution)[0]
+        read_all = time.perf_counter() - start
+        quarter = (starts[-1] - starts[0]) // 4
+        start = time.perf_counter()
+        downsample(*aggregator.range_arrays("BENCH", resolution, starts[0] + quarter, starts[-1] - quarter), max_points)
+        range_time = time.perf_counter() - start
+        print(f"{resolution:>9}s {len(starts):>10} {read_100 * 1e6:>12.0f} {read_all * 1e6:>12.0f} {range_time * 1e6:>9.0f}")
+        results["read_us"][resolution] = read_100 * 1e6
+        results["range_us"][resolution] = range_time * 1e6
+    return results
+
+def bench_tape(num_orders=200_000, num_traders=1_000, capacity=1 << 17, seed=1):
+    """Cost of recording every fill on a TradeTape, and of querying it.
+
+    Places the same seeded random orders on an exchange without a listener and
+    on one feeding a TradeTape, then times stats() over windows of various
+    sizes and reading the newest fills as views.
+    """
+    def workload(tape):
+        exchange = StockExchange()
+        exchange.ipo_stock("TECH", num_traders * 100, 100)
+        if tape is not None:
+            exchange.add_trade_listener(tape.on_trade)
+        traders = RandomTraders(exchange, "TECH", num_traders, 10_000, seed=seed, verbose=False)
+        for trader_id in traders.trader_ids:
+            exchange.transfer_stock(0, trader_id, "TECH", 100)
+        user_ids = [traders.rng.choice(traders.trader_ids) for _ in range(num_orders)]
+        start = time.perf_counter()
+        for user_id in user_ids:
+            traders.place_random_order(user_id)
+        return time.perf_counter() - start, exchange.trade_count
+
+    plain_time, _ = workload(None)
+    tape = TradeTape(capacity=capacity)
+    tape_time, _ = workload(tape)
+    recorded = tape.count("TECH")
+    print(f"{num_orders} orders, {recorded} fills recorded")
+    print(f"{'':>10} {'orders/s':>10}")
+    print(f"{'no tape':>10} {num_orders / plain_time:>10.0f}")
+    print(f"{'tape':>10} {num_orders / tape_time:>10.0f}  "
+          f"({(tape_time - plain_time) / max(recorded, 1) * 1e6:+.2f} us per fill)")
+
+    now = tape.last("TECH", 1)[0]["time"][-1]
+    print(f"{'window s':>10} {'trades':>8} {'stats us':>9}")
+    for window in (1, 10, 60, None):
+        start = time.perf_counter()
+        for _ in range(1_000):
+            stats = tape.stats("TECH", window, now)
+        print(f"{window if window is not None else 'all':>10} {stats['trades']:>8} {(time.perf_counter() - start) * 1e3:>9.1f}")
+    start = time.perf_counter()
+    views = tape.last("TECH", capacity)
+    print(f"reading the newest {sum(map(len, views))} fills as views: {(time.perf_counter() - start) * 1e6:.0f} us")
+    return {"plain_orders_per_sec": num_orders / plain_time, "tape_orders_per_sec": num_orders / tape_time,
+            "fills": recorded}
+
+def bench_leaderboard(trader_counts=(1_000, 10_000, 100_000), orders_per_tick=100, num_ticks=100, size=10, seed=1):
+    """Per-tick cost and frame size of the leaderboard vs. sending every trader.
+
+    Each tick places orders_per_tick random orders, then either updates the
+    Leaderboard and encodes its top and bottom size rows into a frame, or reads
+    and encodes every trader's row, which is what clients needed to rank the
+    traders themselves. Also times a page() of the full ranking.
+    """
+    results = {}
+    print(f"{'traders':>8} {'all us/tick':>12} {'all bytes':>10} {'board us/tick':>14} {'board bytes':>12} {'page us':>8} {'remarks':>8}")
+    for num_traders in trader_counts:
+        exchange = StockExchange()
+        exchange.ipo_stock("TECH", num_traders * 100, 100)
+        traders = RandomTraders(exchange, "TECH", num_traders, 10_000, seed=seed, verbose=False)
+        for trader_id in traders.trader_ids:
+            exchange.transfer_stock(0, trader_id, "TECH", 100)
+        feed = BookFeed(exchange, "TECH", traders.trader_ids)
+        leaderboard = Leaderboard(exchange, traders.trader_ids)
+
+        all_time = board_time = 0.0
+        all_bytes = board_bytes = 0
+        for _ in range(num_ticks):
+            for _ in range(orders_per_tick):
+                traders.place_random_order(traders.rng.choice(traders.trader_ids))
+
+            start = time.perf_counter()
+            rows = [row for row in map(feed._user_row, feed.user_ids) if row is not None]
+            all_bytes += len(encode_frame(DELTA, 0, 0, {}, None, [], [], (rows, [])))
+            all_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            leaderboard.update()
+            board_bytes += len(encode_frame(DELTA, 0, 0, {}, None, [], [], leaderboard.board(size, "TECH")))
+            board_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for offset in range(0, 100 * size, size):
+            leaderboard.page(offset, size)
+        page_us = (time.perf_counter() - start) / 100 * 1e6
+        results[num_traders] = {"all_us": all_time / num_ticks * 1e6, "all_bytes": all_bytes / num_ticks,
+                                "board_us": board_time / num_ticks * 1e6, "board_bytes": board_bytes / num_ticks,
+                                "page_us": page_us, "remarks": leaderboard.remarks}
+        row = results[num_traders]
+        print(f"{num_traders:>8} {row['all_us']:>12.0f} {row['all_bytes']:>10.0f} {row['board_us']:>14.0f} "
+              f"{row['board_bytes']:>12.0f} {page_us:>8.0f} {leaderboard.remarks:>8}")
+    return results
+
+def bench_pnl(num_users=100_000, num_stocks=100, num_fills=1_000_000, repeats=20, seed=1):
+    """PnLEngine per-fill cost and full-market revaluation time.
+
+    Feeds num_fills random fills between num_users users in num_stocks stocks
+    straight to on_trade, then times revalue() and stock_summary() over every
+    position at fresh prices, against a Python loop over the same positions.
+    """
+    rng = np.random.default_rng(seed)
+    engine = PnLEngine(user_capacity=num_users, stock_capacity=num_stocks)
+    stock_ids = [f"S{column}" for column in range(num_stocks)]
+    for user_id in range(num_users):
+        engine._add_user(user_id)
+    for stock_id in stock_ids:
+        engine._add_stock(stock_id)
+    stocks = rng.integers(0, num_stocks, num_fills).tolist()
+    prices = np.round(rng.uniform(90, 110, num_fills), 2).tolist()
+    quantities = rng.integers(1, 100, num_fills).tolist()
+    buyers = rng.integers(0, num_users, num_fills).tolist()
+    sellers = rng.integers(0, num_users, num_fills).tolist()
+    start = time.perf_counter()
+    for stock, price, quantity, buyer, seller in zip(stocks, prices, quantities, buyers, sellers):
+        engine.on_trade(stock_ids[stock], price, quantity, buyer, seller, "bid")
+    fill_us = (time.perf_counter() - start) / num_fills * 1e6
+
+    marks = [{stock_id: float(price) for stock_id, price in zip(stock_ids, rng.uniform(90, 110, num_stocks))}
+             for _ in range(repeats)]
+    start = time.perf_counter()
+    for prices in marks:
+        values = engine.revalue(prices)
+    revalue_ms = (time.perf_counter() - start) / repeats * 1e3
+    start = time.perf_counter()
+    for prices in marks[:5]:
+        engine.stock_summary(prices)
+    summary_ms = (time.perf_counter() - start) / 5 * 1e3
+
+    # The same unrealized P&L the way it had to be done before: a loop over every position
+    positions, costs = engine.positions.tolist(), engine.costs.tolist()
+    price_list = [marks[-1][stock_id] for stock_id in stock_ids]
+    start = time.perf_counter()
+    looped = [sum(position * price - cost for position, cost, price in zip(position_row, cost_row, price_list))
+              for position_row, cost_row in zip(positions, costs)]
+    loop_ms = (time.perf_counter() - start) * 1e3
+    assert np.allclose(looped, values["unrealized"])
+
+    print(f"{num_users} users x {num_stocks} stocks, {num_fills} fills")
+    print(f"on_trade: {fill_us:.2f} us per fill")
+    print(f"revalue(): {revalue_ms:.1f} ms, stock_summary(): {summary_ms:.1f} ms, Python loop: {loop_ms:.0f} ms")
+    return {"fill_us": fill_us, "revalue_ms": revalue_ms, "summary_ms": summary_ms, "loop_ms": loop_ms}
+
+def bench_logging(num_orders=50_000, num_calls=200_000, num_traders=1_000, seed=1):
+    """Cost of logging on the calling thread, and of per-order logging in the trading workload.
+
+    Times a disabled debug call, an enabled call handed to the EventLog writer
+    (writing to a temporary file) and print() of the same line to a file, then
+    places the same seeded random orders with per-order logging off (INFO) and
+    on (DEBUG). Each enabled run also reports how long the writer needed to
+    catch up.
+    """
+    logger = EventLog.get_logger("benchmark")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.log")
+
+        def per_call_us(call):
+            start = time.perf_counter()
+            for i in range(num_calls):
+                call(i)
+            return (time.perf_counter() - start) / num_calls * 1e6
+
+        def drain(writer, records):
+            start = time.perf_counter()
+            while writer.records_written < records:
+                time.sleep(0.001)
+            return time.perf_counter() - start
+
+        writer = EventLog.configure(level="INFO", path=path, console=False)
+        disabled_us = per_call_us(lambda i: logger.debug("Order %s placed", i))
+        enabled_us = per_call_us(lambda i: logger.info("Order %s placed", i))
+        drain_s = drain(writer, num_calls)
+        batches = writer.batches_written
+        with open(os.path.join(directory, "print.log"), "w") as stream:
+            print_us = per_call_us(lambda i: print(f"Order {i} placed", file=stream, flush=True))
+        print(f"{'call':>22} {'us/call':>8}")
+        print(f"{'disabled debug':>22} {disabled_us:>8.2f}")
+        print(f"{'enabled info':>22} {enabled_us:>8.2f}  (writer caught up {drain_s * 1e3:.0f} ms later, "
+              f"{num_calls / batches:.0f} records per write)")
+        print(f"{'print to file':>22} {print_us:>8.2f}")
+
+        results = {"disabled_us": disabled_us, "enabled_us": enabled_us, "print_us": print_us}
+        print(f"{'order logging':>22} {'orders/s':>10}")
+        for level in ("INFO", "DEBUG"):
+            writer = EventLog.configure(level=level, path=path, console=False)
+            exchange = StockExchange()
+            exchange.ipo_stock("TECH", num_traders * 100, 100)
+            traders = RandomTraders(exchange, "TECH", num_traders, 10_000, seed=seed)
+            for trader_id in traders.trader_ids:
+                exchange.transfer_stock(0, trader_id, "TECH", 100)
+            user_ids = [traders.rng.choice(traders.trader_ids) for _ in range(num_orders)]
+            start = time.perf_counter()
+            for user_id in user_ids:
+                traders.place_random_order(user_id)
+            elapsed = time.perf_counter() - start
+            print(f"{'off (INFO)' if level == 'INFO' else 'on (DEBUG)':>22} {num_orders / elapsed:>10.0f}")
+            results[f"orders_per_sec_{level.lower()}"] = num_orders / elapsed
+        EventLog.shutdown()
+    return results
+
+def bench_metrics(num_ticks=2_000, orders_per_tick=100, num_traders=1_000, num_calls=200_000, seed=1):
+    """Cost of stage timing per call and its overhead on trading_loop ticks.
+
+    Times an enabled and a disabled metrics.time() block. Then runs
+    trading_loop's work without the sleep: a vectorized batch of
+    orders_per_tick orders, a book diff and a leaderboard update and board
+    through an OrderGateway, each stage timed. Ticks alternate between
+    enabled and disabled metrics, so drift in machine load hits both alike,
+    and their medians are compared. Also times a render() of the result.
+    """
+    def per_call_us(metrics):
+        start = time.perf_counter()
+        for _ in range(num_calls):
+            with metrics.time("stage"):
+                pass
+        return (time.perf_counter() - start) / num_calls * 1e6
+
+    enabled_us, disabled_us = per_call_us(Metrics()), per_call_us(Metrics(enabled=False))
+    print(f"metrics.time(): enabled {enabled_us:.2f} us, disabled {disabled_us:.2f} us per block")
+
+    exchange = StockExchange()
+    exchange.ipo_stock("TECH", num_traders * 100, 100)
+    traders = RandomTraders(exchange, "TECH", num_traders, 10_000, seed=seed, verbose=False)
+    for trader_id in traders.trader_ids:
+        exchange.transfer_stock(0, trader_id, "TECH", 100)
+    feed = BookFeed(exchange, "TECH", [])
+    leaderboard = Leaderboard(exchange, traders.trader_ids)
+    gateway = OrderGateway(exchange)
+    enabled, disabled = Metrics(), Metrics(enabled=False)
+    enabled.add_collector(lambda: gateway.call(exchange_collector, exchange).result())
+    tick_times = {True: [], False: []}
+    try:
+        for tick in range(num_ticks):
+            metrics = enabled if tick % 2 else disabled
+            tick_start = time.perf_counter()
+            with metrics.time("orders"):
+                gateway.call(traders.place_random_orders, orders_per_tick).result()
+            with metrics.time("book_delta"):
+                gateway.call(feed.delta).result()
+            with metrics.time("leaderboard"):
+                gateway.call(leaderboard.update).result()
+                leaderboard.board(10, "TECH")
+            elapsed = time.perf_counter() - tick_start
+            metrics.observe("tick", elapsed)
+            tick_times[metrics.enabled].append(elapsed)
+        start = time.perf_counter()
+        text = enabled.render()
+        render_ms = (time.perf_counter() - start) * 1e3
+    finally:
+        gateway.close()
+
+    median = {mode: float(np.median(times)) * 1e6 for mode, times in tick_times.items()}
+    overhead = (median[True] - median[False]) / median[False] * 100
+    expected = len(enabled.stages) * enabled_us / median[False] * 100
+    print(f"{'metrics':>10} {'median us/tick':>15}")
+    print(f"{'disabled':>10} {median[False]:>15.0f}")
+    print(f"{'enabled':>10} {median[True]:>15.0f}  ({overhead:+.1f}%; {len(enabled.stages)} timings per tick "
+          f"at the per-block cost would be {expected:+.2f}%)")
+    tick = enabled.histogram("tick")
+    print(f"tick p50 <= {tick.quantile(0.5) * 1e6:.0f} us, p99 <= {tick.quantile(0.99) * 1e6:.0f} us; "
+          f"render(): {render_ms:.2f} ms, {len(text)} bytes")
+    return {"enabled_us": enabled_us, "disabled_us": disabled_us, "tick_us_disabled": median[False],
+            "tick_us_enabled": median[True], "overhead_percent": overhead, "render_ms": render_ms}
+
+def bench_profiler(num_ticks=300, orders_per_tick=100, num_traders=1_000, interval=0.005, rounds=3, seed=1):
+    """Overhead of each profiling mode on trading_loop ticks.
+
+    Runs trading_loop's work without the sleep (a vectorized batch of orders, a
+    book diff and a leaderboard update and board through an OrderGateway),
+    checkpointing the tick thread and the sequencer as trading_loop does. Blocks
+    of num_ticks ticks run with no session, a sampling session every interval
+    seconds and a deterministic session, rounds times in turn, and the median
+    tick of each mode is compared.
+    """
+    exchange = StockExchange()
+    exchange.ipo_stock("TECH", num_traders * 100, 100)
+    traders = RandomTraders(exchange, "TECH", num_traders, 10_000, seed=seed, verbose=False)
+    for trader_id in traders.trader_ids:
+        exchange.transfer_stock(0, trader_id, "TECH", 100)
+    feed = BookFeed(exchange, "TECH", [])
+    leaderboard = Leaderboard(exchange, traders.trader_ids)
+    gateway = OrderGateway(exchange)
+    modes = (None, SAMPLING, DETERMINISTIC)
+    tick_times = {mode: [] for mode in modes}
+    samples = 0
+    with tempfile.TemporaryDirectory() as directory:
+        profiler = Profiler(directory)
+        try:
+            for _ in range(rounds):
+                for mode in modes:
+                    if mode is not None:
+                        profiler.start(mode, interval)
+                    for _ in range(num_ticks):
+                        start = time.perf_counter()
+                        profiler.checkpoint()
+                        if profiler.deterministic:
+                            gateway.call(profiler.checkpoint)
+                        gateway.call(traders.place_random_orders, orders_per_tick).result()
+                        gateway.call(feed.delta).result()
+                        gateway.call(leaderboard.update).result()
+                        leaderboard.board(10, "TECH")
+                        tick_times[mode].append(time.perf_counter() - start)
+                    if mode is not None:
+                        result = profiler.stop(wake=lambda: gateway.call(profiler.checkpoint))
+                        samples += result.get("samples", 0)
+            profiler.leave()
+        finally:
+            gateway.close()
+
+    median = {mode: float(np.median(times)) * 1e6 for mode, times in tick_times.items()}
+    print(f"{'profiling':>14} {'median us/tick':>15}")
+    for mode in modes:
+        overhead = (median[mode] - median[None]) / median[None] * 100
+        print(f"{mode or 'off':>14} {median[mode]:>15.0f}" + (f"  ({overhead:+.1f}%)" if mode else ""))
+    print(f"sampling took {samples} samples of every thread")
+    return {mode or "off": median[mode] for mode in modes}
+
+def _git_commit():
+    """Short hash of the checked-out commit, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_simulation(results):
+    """Print the headline numbers of a run_simulation result."""
+    latency = results["latency_us"]
+    print(f"{'orders/s':>10} {'fills/s':>10} {'p50 us':>8} {'p99 us':>8} {'p99.9 us':>9} {'peak MB':>8}")
+    print(f"{results['orders_per_sec']:>10.0f} {results['fills_per_sec']:>10.0f} {latency['p50']:>8.2f} "
+          f"{latency['p99']:>8.2f} {latency['p99.9']:>9.2f} {results['peak_rss_mb']:>8.1f}")
+    print(f"placed {results['orders_placed']}, rejected {results['orders_rejected']}, "
+          f"fills {results['fills']}, final price {results['final_price']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="StockExchange benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    depth_parser = subparsers.add_parser("depth", help="per-order cost vs. resting price levels")
+    depth_parser.add_argument("--orders", type=int, default=20_000)
+    depth_parser.add_argument("--ladder", choices=["sorted", "dense"], default="sorted")
+
+    batch_parser = subparsers.add_parser("batch", help="place_orders vs. one place_order per order")
+    batch_parser.add_argument("--orders", type=int, default=50_000)
+
+    ledger_parser = subparsers.add_parser("ledger", help="dict vs. compact ledger memory and speed")
+    ledger_parser.add_argument("--orders", type=int, default=50_000)
+
+    journal_parser = subparsers.add_parser("journal", help="place_order throughput with journaling")
+    journal_parser.add_argument("--orders", type=int, default=50_000)
+    journal_parser.add_argument("--group-size", type=int, default=1024)
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="book build vs. snapshot restore time")
+    snapshot_parser.add_argument("--orders", type=int, default=1_000_000)
+    snapshot_parser.add_argument("--ledger", choices=["dict", "compact"], default="dict")
+
+    simulate_parser = subparsers.add_parser("simulate", help="seeded headless RandomTraders workload")
+    simulate_parser.add_argument("--traders", type=int, default=1_000)
+    simulate_parser.add_argument("--orders", type=int, default=100_000)
+    simulate_parser.add_argument("--depth", type=int, default=100, help="resting levels per side before the run")
+    simulate_parser.add_argument("--buy-probability", type=float, default=0.5)
+    simulate_parser.add_argument("--limit-probability", type=float, default=0.7)
+    simulate_parser.add_argument("--mode", choices=["per_order", "vectorized"], default="per_order")
+    simulate_parser.add_argument("--batch-size", type=int, default=100)
+    simulate_parser.add_argument("--ledger", choices=["dict", "compact"], default="dict")
+    simulate_parser.add_argument("--ladder", choices=["sorted", "dense"], default="sorted")
+    simulate_parser.add_argument("--seed", type=int, default=1)
+    simulate_parser.add_argument("--output", help="write the results as JSON to this file")
+
+    sharded_parser = subparsers.add_parser("sharded", help="ShardedExchange throughput vs. shard count")
+    sharded_parser.add_argument("--stocks", type=int, default=200)
+    sharded_parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    sharded_parser.add_argument("--orders", type=int, default=200_000)
+
+    gateway_parser = subparsers.add_parser("gateway", help="OrderGateway throughput and ack latency vs. producers")
+    gateway_parser.add_argument("--orders", type=int, default=100_000)
+    gateway_parser.add_argument("--producers", type=int, nargs="+", default=[1, 4, 16])
+    gateway_parser.add_argument("--max-batch", type=int, default=512)
+
+    stress_parser = subparsers.add_parser("stress", help="concurrent matching threads, then an invariant check")
+    stress_parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8])
+    stress_parser.add_argument("--stocks", type=int, default=8)
+    stress_parser.add_argument("--ops", type=int, default=100_000)
+    stress_parser.add_argument("--ledger", choices=["dict", "compact"], default="dict")
+
+    deltas_parser = subparsers.add_parser("deltas", help="full market_update payload vs. BookFeed diffs")
+    deltas_parser.add_argument("--traders", type=int, default=1_000)
+    deltas_parser.add_argument("--orders-per-tick", type=int, default=100)
+    deltas_parser.add_argument("--ticks", type=int, default=500)
+
+    publisher_parser = subparsers.add_parser("publisher", help="conflating binary fan-out to many clients")
+    publisher_parser.add_argument("--clients", type=int, default=500)
+    publisher_parser.add_argument("--slow-fraction", type=float, default=0.2)
+    publisher_parser.add_argument("--duration", type=float, default=10.0)
+
+    candles_parser = subparsers.add_parser("candles", help="CandleAggregator per-trade cost and bounded memory")
+    candles_parser.add_argument("--trades", type=int, default=1_000_000)
+    candles_parser.add_argument("--capacity", type=int, default=1_000)
+    candles_parser.add_argument("--max-points", type=int, default=400)
+
+    tape_parser = subparsers.add_parser("tape", help="TradeTape recording overhead and query cost")
+    tape_parser.add_argument("--orders", type=int, default=200_000)
+
+    leaderboard_parser = subparsers.add_parser("leaderboard", help="leaderboard top/bottom frames vs. every trader per tick")
+    leaderboard_parser.add_argument("--traders", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    leaderboard_parser.add_argument("--orders-per-tick", type=int, default=100)
+    leaderboard_parser.add_argument("--ticks", type=int, default=100)
+
+    pnl_parser = subparsers.add_parser("pnl", help="PnLEngine per-fill cost and full-market revaluation time")
+    pnl_parser.add_argument("--users", type=int, default=100_000)
+    pnl_parser.add_argument("--stocks", type=int, default=100)
+    pnl_parser.add_argument("--fills", type=int, default=1_000_000)
+
+    logging_parser = subparsers.add_parser("logging", help="per-call logging cost and per-order logging overhead")
+    logging_parser.add_argument("--orders", type=int, default=50_000)
+
+    metrics_parser = subparsers.add_parser("metrics", help="stage timing cost and its overhead on trading ticks")
+    metrics_parser.add_argument("--ticks", type=int, default=2_000)
+    metrics_parser.add_argument("--orders-per-tick", type=int, default=100)
+
+    profiler_parser = subparsers.add_parser("profiler", help="tick overhead of sampling and deterministic profiling")
+    profiler_parser.add_argument("--ticks", type=int, default=300)
+    profiler_parser.add_argument("--interval", type=float, default=0.005)
+
+    args = parser.parse_args()
+    if args.command == "depth":
+        bench_book_depth(num_orders=args.orders, ladder=args.ladder)
+    elif args.command == "batch":
+        bench_batch(num_orders=args.orders)
+    elif args.command == "ledger":
+        bench_ledger(num_orders=args.orders)
+    elif args.command == "journal":
+        bench_journal(num_orders=args.orders, group_size=args.group_size)
+    elif args.command == "snapshot":
+        bench_snapshot(num_orders=args.orders, ledger=args.ledger)
+    elif args.command == "sharded":
+        bench_sharded(num_stocks=args.stocks, shard_counts=args.shards, num_orders=args.orders)
+    elif args.command == "gateway":
+        bench_gateway(num_orders=args.orders, producer_counts=args.producers, max_batch=args.max_batch)
+    elif args.command == "stress":
+        bench_stress(thread_counts=args.threads, num_stocks=args.stocks, num_ops=args.ops, ledger=args.ledger)
+    elif args.command == "deltas":
+        bench_deltas(num_traders=args.traders, orders_per_tick=args.orders_per_tick, num_ticks=args.ticks)
+    elif args.command == "publisher":
+        bench_publisher(num_clients=args.clients, slow_fraction=args.slow_fraction, duration=args.duration)
+    elif args.command == "candles":
+        bench_candles(num_trades=args.trades, capacity=args.capacity, max_points=args.max_points)
+    elif args.command == "tape":
+        bench_tape(num_orders=args.orders)
+    elif args.command == "leaderboard":
+        bench_leaderboard(trader_counts=args.traders, orders_per_tick=args.orders_per_tick, num_ticks=args.ticks)
+    elif args.command == "pnl":
+        bench_pnl(num_users=args.users, num_stocks=args.stocks, num_fills=args.fills)
+    elif args.command == "logging":
+        bench_logging(num_orders=args.orders)
+    elif args.command == "metrics":
+        bench_metrics(num_ticks=args.ticks, orders_per_tick=args.orders_per_tick)
+    elif args.command == "profiler":
+        bench_profiler(num_ticks=args.ticks, interval=args.interval)
+    elif args.command == "simulate":
+        results = run_simulation(num_traders=args.traders, num_orders=args.orders, depth=args.depth,
+                                 buy_probability=args.buy_probability, limit_order_probability=args.limit_probability,
+                                 mode=args.mode, batch_size=args.batch_size, ledger=args.ledger,
+                                 ladder=args.ladder, seed=args.seed)
+        print_simulation(results)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
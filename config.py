@@ -14,6 +14,14 @@ SIMULATION_SETTINGS = {
     
     # Time between market data updates (in seconds)
     "update_interval": 0.2,
+    
+    # How trading_loop generates orders: "vectorized" draws a whole tick with
+    # NumPy and submits one batch, "per_order" places and prints each order
+    "order_generation": "vectorized",
+    
+    # Ledger storage: "dict" (a dict per trader) or "compact" (NumPy arrays
+    # indexed by trader and stock, leaner with many thousands of traders)
+    "ledger": "dict",
 }
 
 # Stock Market Settings
@@ -28,6 +36,13 @@ STOCK_SETTINGS = {
     # Price variation percentage for limit orders (±%)
     "price_variation_percent": 1,
     
+    # Minimum price increment; order prices are rounded to a multiple of this
+    "tick_size": 0.01,
+    
+    # Order book layout: "sorted" (any price spread) or "dense" (array-backed
+    # ladder with O(1) best price, best when prices stay within a narrow band)
+    "price_ladder": "sorted",
+    
     # Maximum quantity per order
     "max_order_quantity": 100,
     
@@ -43,9 +58,19 @@ CHART_SETTINGS = {
     # Interval for each candlestick (in seconds)
     "candlestick_interval": 1,
     
-    # Maximum number of candles to keep in memory
+    # Candles sent with the page and shown at once; older ones load from /api/candles when panning
     "max_candles": 50,
     
+    # Closed candles kept in memory per resolution (a day of 1-second candles)
+    "candle_history": 86_400,
+    
+    # Raw candles per /api/candles page
+    "candle_page_size": 1_000,
+    
+    # Candle resolutions (in seconds) built from trades; each must be a multiple
+    # of the previous one, and candlestick_interval is added if missing
+    "candle_resolutions": [1, 5, 60, 300],
+    
     # Chart colors
     "bullish_color": "#4CAF50",    # Green for up moves
     "bearish_color": "#f44336",    # Red for down moves
@@ -64,6 +89,126 @@ SERVER_SETTINGS = {
     
     # WebSocket async mode
     "async_mode": "threading",
+    
+    # Access token -> trader ID; a socket client connecting with auth {"token": ...}
+    # trades as that trader. Clients without a token can watch but not trade
+    "trader_tokens": {},
+    
+    # Token for the profiling endpoints, sent as "Authorization: Bearer <token>"
+    # or as a socket client's auth token; None keeps profiling switched off
+    "admin_token": None,
+}
+
+# Event Journal Settings
+JOURNAL_SETTINGS = {
+    # Journal file recording every accepted exchange command (None disables it)
+    "path": None,
+    
+    # Rebuild the exchange from an existing journal on startup
+    "recover": True,
+    
+    # fsync policy: "always" (every group commit), "interval" (about once a
+    # second) or "never" (leave it to the operating system)
+    "fsync": "interval",
+    
+    # Records written per group commit
+    "group_size": 1024,
+}
+
+# Order Gateway Settings
+GATEWAY_SETTINGS = {
+    # Commands that can wait for the sequencer; beyond this new ones are refused
+    "max_queue": 10000,
+    
+    # Commands the sequencer applies per wake-up
+    "max_batch": 512,
+    
+    # Seconds a handler waits for its acknowledgement
+    "ack_timeout": 5,
+}
+
+# Market Frame Publisher Settings
+PUBLISHER_SETTINGS = {
+    # Seconds between frames for clients that do not ask for a rate
+    "default_interval": 0.2,
+    
+    # Fastest rate a client may ask for
+    "min_interval": 0.05,
+    
+    # Book diffs kept for conflating slow clients; clients further behind get a full snapshot
+    "history": 256,
+    
+    # Seconds to wait for a client to acknowledge a frame before resyncing it
+    "ack_timeout": 5,
+}
+
+# Trade Tape Settings
+TAPE_SETTINGS = {
+    # Most recent trades kept in memory per stock
+    "capacity": 131_072,
+    
+    # Trades per chunk written to disk; capacity must be a multiple of it
+    "chunk_size": 16_384,
+    
+    # Directory to spill the full trade history to, or None to keep only memory
+    "spill_dir": None,
+    
+    # Seconds of trades covered by the rolling statistics of /api/trades
+    "stats_window": 60,
+}
+
+# Leaderboard Settings
+LEADERBOARD_SETTINGS = {
+    # Traders shown at each end of the board (top and bottom by total value)
+    "size": 10,
+    
+    # Relative price move that triggers re-ranking every trader at the new price
+    "remark_threshold": 0.01,
+    
+    # Most traders one /api/leaderboard or request_leaderboard page may return
+    "page_size": 100,
+}
+
+# Logging Settings
+LOGGING_SETTINGS = {
+    # Lowest level recorded: "DEBUG" adds a line per order placed, "INFO" only market events
+    "level": "INFO",
+    
+    # File the log is appended to as JSON lines, or None for no file
+    "path": None,
+    
+    # Also print log lines to the console
+    "console": True,
+    
+    # Newest entries kept in memory for /api/logs
+    "ring_size": 1000,
+    
+    # Most records the background writer writes at once
+    "batch_size": 256,
+}
+
+# Metrics Settings
+METRICS_SETTINGS = {
+    # Time the trading loop's stages into the /api/metrics latency histograms
+    "enabled": True,
+    
+    # Upper bound of the smallest latency bucket (in seconds); each next one doubles it
+    "bucket_low": 1e-6,
+    
+    # Number of latency buckets, plus one for anything slower
+    "bucket_count": 25,
+}
+
+# Profiler Settings
+PROFILER_SETTINGS = {
+    # Directory profiles from /api/profile/start and /api/profile/stop are written to
+    "directory": "profiles",
+    
+    # Seconds between stack samples in sampling mode
+    "interval": 0.005,
+    
+    # Seconds stopping a deterministic session waits for the profiled threads
+    "stop_timeout": 5,
 }
 
 # Order Book Display Settings
@@ -1,251 +1,436 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, Response, render_template, jsonify, request, send_file
 from flask_socketio import SocketIO, emit
 import threading
 import time
 import json
-import random
-from datetime import datetime
+import functools
+import math
+import os
+import hmac
+import EventLog
 from StockExchange import StockExchange
+from Journal import Journal
+from OrderGateway import OrderGateway
 from RandomTraders import RandomTraders
-from config import SIMULATION_SETTINGS, STOCK_SETTINGS, CHART_SETTINGS, SERVER_SETTINGS, DISPLAY_SETTINGS
+from MarketSnapshot import MarketSnapshot
+from BookFeed import BookFeed
+from CandleAggregator import CandleAggregator, candle_dicts, downsample
+from TradeTape import TradeTape, AGGRESSOR_CODES
+from MarketPublisher import MarketPublisher
+from Leaderboard import Leaderboard
+from PnLEngine import PnLEngine
+from Metrics import Metrics, exchange_collector
+from Profiler import Profiler, SAMPLING
+from config import SIMULATION_SETTINGS, STOCK_SETTINGS, CHART_SETTINGS, SERVER_SETTINGS, DISPLAY_SETTINGS, JOURNAL_SETTINGS, GATEWAY_SETTINGS, PUBLISHER_SETTINGS, TAPE_SETTINGS, LEADERBOARD_SETTINGS, LOGGING_SETTINGS, METRICS_SETTINGS, PROFILER_SETTINGS
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'stock_market_viz'
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SERVER_SETTINGS["async_mode"])
+logger = EventLog.get_logger(__name__)
 
 # Global variables for the exchange and traders
 exchange = None
 traders = None
 price_history = []
-candlestick_data = []
-current_candle = None
+candles = None # CandleAggregator fed by the exchange's fills
+tape = None # TradeTape recording every fill
+leaderboard = None # Leaderboard ranking the traders by total value
+pnl = None # PnLEngine tracking every user's positions and P&L from the fills
+market_snapshot = None
+book_feed = None # BookFeed producing L2 diffs of the default stock
+publisher = None # MarketPublisher delivering book_feed diffs to socket clients at their own rates
+journal = None # Journal recording the exchange, if JOURNAL_SETTINGS["path"] is set
+initial_snapshot = None # exchange snapshot taken right after initialization, restored on reset
+gateway = None # OrderGateway; once the market is initialized every exchange access goes through it
+metrics = Metrics(enabled=METRICS_SETTINGS["enabled"], bucket_low=METRICS_SETTINGS["bucket_low"],
+                  bucket_count=METRICS_SETTINGS["bucket_count"]) # stage latencies, kept across resets
+profiler = Profiler(PROFILER_SETTINGS["directory"]) # on-demand profiling sessions, see start_profiling
+session_traders = {} # socket session ID -> trader it trades as, bound on connect
+session_admins = set() # socket session IDs that connected with the admin token
 trading_active = False
 
-def initialize_market():
-    """Initialize the stock exchange and traders."""
-    global exchange, traders, price_history, candlestick_data, current_candle
+def initialize_market(recover=False):
+    """Initialize the stock exchange and traders.
+
+    If JOURNAL_SETTINGS names a journal file, every accepted command is recorded
+    to it. With recover=True an existing journal is replayed to rebuild the
+    exchange where it left off; otherwise the journal is started over.
+    """
+    global exchange, traders, price_history, market_snapshot, journal, initial_snapshot
     
     try:
-        print("Initializing market...")
+        logger.info("Initializing market...")
         
         # Reset data
         price_history = []
-        candlestick_data = []
-        current_candle = None
-        
-        # Create exchange
-        exchange = StockExchange()
-        print("Exchange created")
         
-        # IPO the stock
         stock_id = STOCK_SETTINGS["default_stock_id"]
         ipo_shares = STOCK_SETTINGS["ipo_shares"]
         ipo_price = STOCK_SETTINGS["ipo_price"]
-        exchange.ipo_stock(stock_id, ipo_shares, ipo_price)
-        print(f"{stock_id} stock IPO completed: {ipo_shares:,} shares at ${ipo_price}")
+        journal_path = JOURNAL_SETTINGS["path"]
+        if journal is not None:
+            # Commands still queued for the old exchange must not reach a closed journal
+            if gateway is None:
+                close_journal()
+            else:
+                gateway.call(close_journal).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
+        
+        # Recover the exchange from the journal if asked to
+        recovered = False
+        if journal_path and recover and os.path.exists(journal_path):
+            base_path = journal_path + ".base"
+            base = base_path if os.path.exists(base_path) else None
+            journal = Journal(journal_path, fsync=JOURNAL_SETTINGS["fsync"], group_size=JOURNAL_SETTINGS["group_size"])
+            exchange = StockExchange.replay(journal_path, ledger=SIMULATION_SETTINGS["ledger"], journal=journal, base=base)
+            recovered = stock_id in exchange.stocks
+            if recovered:
+                logger.info("Exchange recovered from %s", journal_path)
+                if base is not None:
+                    with open(base, "rb") as base_file:
+                        initial_snapshot = base_file.read()
+            else:
+                journal.close()
+                journal = None
+        
+        if not recovered:
+            # Create exchange
+            if journal_path:
+                if os.path.exists(journal_path + ".base"):
+                    os.remove(journal_path + ".base")
+                journal = Journal(journal_path, fsync=JOURNAL_SETTINGS["fsync"], group_size=JOURNAL_SETTINGS["group_size"], truncate=True)
+            exchange = StockExchange(ledger=SIMULATION_SETTINGS["ledger"], journal=journal)
+            logger.info("Exchange created")
+            
+            # IPO the stock
+            exchange.ipo_stock(stock_id, ipo_shares, ipo_price, STOCK_SETTINGS["tick_size"], STOCK_SETTINGS["price_ladder"])
+            logger.info("%s stock IPO completed: %s shares at $%s", stock_id, f"{ipo_shares:,}", ipo_price)
         
         # Create random traders
         num_traders = SIMULATION_SETTINGS["num_traders"]
         initial_balance = SIMULATION_SETTINGS["initial_trader_balance"]
-        traders = RandomTraders(exchange, stock_id, num_traders, initial_balance)
-        print(f"Created {len(traders.trader_ids)} traders with ${initial_balance:,} each")
+        attach_traders(stock_id)
+        logger.info("Created %s traders with $%s each", len(traders.trader_ids), f"{initial_balance:,}")
         
-        # Give some traders initial stock holdings using market orders
-        initial_holders = STOCK_SETTINGS["initial_stock_holders"]
-        initial_quantity = STOCK_SETTINGS["initial_stock_quantity"]
+        # A recovered exchange already has its initial holdings
+        if not recovered:
+            # Give some traders initial stock holdings using market orders
+            initial_holders = STOCK_SETTINGS["initial_stock_holders"]
+            initial_quantity = STOCK_SETTINGS["initial_stock_quantity"]
         
-        # First, market user (id=0) needs to place ask orders to sell stock to traders
-        total_to_distribute = min(initial_holders, num_traders) * initial_quantity
-        if total_to_distribute > 0:
-            # Market user places ask order at IPO price
-            try:
-                exchange.place_order(stock_id, 0, "ask", "limit", total_to_distribute, ipo_price)
-                print(f"Market user placed ask order for {total_to_distribute} shares at ${ipo_price}")
-            except Exception as ask_error:
-                print(f"Error placing market ask order: {ask_error}")
+            # First, market user (id=0) needs to place ask orders to sell stock to traders
+            total_to_distribute = min(initial_holders, num_traders) * initial_quantity
+            if total_to_distribute > 0:
+                # Market user places ask order at IPO price
+                try:
+                    exchange.place_order(stock_id, 0, "ask", "limit", total_to_distribute, ipo_price)
+                    logger.info("Market user placed ask order for %s shares at $%s", total_to_distribute, ipo_price)
+                except Exception as ask_error:
+                    logger.error("Error placing market ask order: %s", ask_error)
         
-        # Now traders place market buy orders to get their initial holdings
-        for trader_id in range(1, min(initial_holders + 1, num_traders + 1)):
-            try:
-                # Trader places market buy order
-                bought, spent = exchange.place_order(stock_id, trader_id, "bid", "market", initial_quantity)
-                if bought > 0:
-                    print(f"Trader {trader_id} bought {bought} {stock_id} shares for ${spent:.2f}")
-                else:
-                    print(f"Trader {trader_id} failed to buy initial stock")
-            except Exception as buy_error:
-                print(f"Error with trader {trader_id} initial purchase: {buy_error}")
+            # Now traders place market buy orders to get their initial holdings
+            for trader_id in range(1, min(initial_holders + 1, num_traders + 1)):
+                try:
+                    # Trader places market buy order
+                    bought, spent, _ = exchange.place_order(stock_id, trader_id, "bid", "market", initial_quantity)
+                    if bought > 0:
+                        logger.debug("Trader %s bought %s %s shares for $%.2f", trader_id, bought, stock_id, spent)
+                    else:
+                        logger.warning("Trader %s failed to buy initial stock", trader_id)
+                except Exception as buy_error:
+                    logger.error("Error with trader %s initial purchase: %s", trader_id, buy_error)
+            
+            # Cache the freshly initialized market so a reset can restore it directly
+            initial_snapshot = exchange.snapshot()
         
-        print("Market initialization completed successfully")
+        bind_gateway()
+        start_publisher()
+        publish_leaderboard()
+        logger.info("Market initialization completed successfully")
         
         # Test market data retrieval
         test_data = get_market_data()
         if test_data:
-            print("Market data retrieval test: SUCCESS")
+            logger.info("Market data retrieval test: SUCCESS")
         else:
-            print("Market data retrieval test: FAILED")
+            logger.error("Market data retrieval test: FAILED")
             
     except Exception as e:
-        print(f"Error initializing market: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error initializing market: %s: %s", type(e).__name__, e)
 
-def update_candlestick_data(price):
-    """Update candlestick data with new price."""
-    global current_candle, candlestick_data
+def attach_traders(stock_id):
+    """Create the random traders, the candle aggregator, the trade tape, the P&L engine, the leaderboard, the market data snapshot and the book feed for the current exchange."""
+    global traders, candles, tape, pnl, leaderboard, market_snapshot, book_feed
     
-    current_time = datetime.now()
-    # Use configurable interval for candles
-    interval_seconds = CHART_SETTINGS["candlestick_interval"]
-    current_interval = current_time.replace(second=(current_time.second // interval_seconds) * interval_seconds, microsecond=0)
+    candles = CandleAggregator(
+        sorted(set(CHART_SETTINGS["candle_resolutions"]) | {CHART_SETTINGS["candlestick_interval"]}),
+        capacity=CHART_SETTINGS["candle_history"],
+    )
+    exchange.add_trade_listener(candles.on_trade)
+    if tape is not None:
+        tape.close()
+    tape = TradeTape(capacity=TAPE_SETTINGS["capacity"], chunk_size=TAPE_SETTINGS["chunk_size"], spill_dir=TAPE_SETTINGS["spill_dir"])
+    exchange.add_trade_listener(tape.on_trade)
+    # Shares already held (IPO, a restored or recovered exchange) are booked at the current price
+    pnl = PnLEngine.from_exchange(exchange)
+    exchange.add_trade_listener(pnl.on_trade)
+    traders = RandomTraders(exchange, stock_id, SIMULATION_SETTINGS["num_traders"], SIMULATION_SETTINGS["initial_trader_balance"])
+    leaderboard = Leaderboard(exchange, traders.trader_ids, remark_threshold=LEADERBOARD_SETTINGS["remark_threshold"])
+    market_snapshot = MarketSnapshot(
+        exchange, stock_id, traders.trader_ids,
+        max_levels=DISPLAY_SETTINGS["max_orders_displayed"],
+        price_decimals=DISPLAY_SETTINGS["price_decimals"],
+        candle_source=get_candle_state,
+    )
+    # Continue past the old feed's sequence numbers so clients notice the switch.
+    # Trader rows reach clients through the leaderboard, so the feed tracks none.
+    book_feed = BookFeed(exchange, stock_id, [], price_decimals=DISPLAY_SETTINGS["price_decimals"],
+                         seq=book_feed.seq + 1 if book_feed is not None else 0)
+
+def close_journal():
+    """Detach the journal from the exchange and close it. With a gateway, run it in the sequencer."""
+    global journal
+    if exchange is not None:
+        exchange.journal = None
+    journal.close()
+    journal = None
+
+def switch_exchange(new_exchange):
+    """Make new_exchange the live exchange, journaled from here on if JOURNAL_SETTINGS names a journal.
+
+    Runs in the sequencer, after every command queued for the old exchange,
+    so none of those writes to a closed journal and none that follow reaches
+    the new exchange before it is journaled and its listeners are attached.
+    The journal restarts with the cached initial snapshot as its base.
+    """
+    global exchange, journal
+    if journal is not None:
+        close_journal()
+    journal_path = JOURNAL_SETTINGS["path"]
+    if journal_path:
+        with open(journal_path + ".base", "wb") as base_file:
+            base_file.write(initial_snapshot)
+        journal = Journal(journal_path, fsync=JOURNAL_SETTINGS["fsync"], group_size=JOURNAL_SETTINGS["group_size"], truncate=True)
+    new_exchange.journal = journal
+    exchange = new_exchange
+    attach_traders(STOCK_SETTINGS["default_stock_id"])
+    if gateway is not None:
+        gateway.exchange = new_exchange
+
+def bind_gateway():
+    """Start the order gateway, or point the running one at the current exchange."""
+    global gateway
     
-    if current_candle is None or current_candle['time'] != current_interval.isoformat():
-        # Start a new candle
-        if current_candle is not None:
-            candlestick_data.append(current_candle)
-        
-        # Get the last traded price as the opening price for new candle
-        last_price = exchange.get_last_traded_price(STOCK_SETTINGS["default_stock_id"])
-        opening_price = last_price if last_price is not None else price
-        
-        current_candle = {
-            'time': current_interval.isoformat(),
-            'open': opening_price,
-            'high': price,
-            'low': price,
-            'close': price,
-            'timestamp': current_interval.isoformat()
-        }
-        print(f"📊 New candle started: Open=${opening_price:.2f}, Price=${price:.2f}")
+    if gateway is None:
+        gateway = OrderGateway(exchange, max_queue=GATEWAY_SETTINGS["max_queue"], max_batch=GATEWAY_SETTINGS["max_batch"])
     else:
-        # Update current candle
-        current_candle['high'] = max(current_candle['high'], price)
-        current_candle['low'] = min(current_candle['low'], price)
-        current_candle['close'] = price
+        gateway.use_exchange(exchange).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
+
+def start_publisher():
+    """Start the market frame publisher if it is not running yet."""
+    global publisher
+    
+    if publisher is None:
+        publisher = MarketPublisher(
+            emit_frame,
+            get_book_snapshot,
+            default_interval=PUBLISHER_SETTINGS["default_interval"],
+            min_interval=PUBLISHER_SETTINGS["min_interval"],
+            history=PUBLISHER_SETTINGS["history"],
+            ack_timeout=PUBLISHER_SETTINGS["ack_timeout"],
+        )
+
+def emit_frame(sid, frame, callback):
+    """Send one market frame to a client, timed as the emit stage."""
+    with metrics.time("emit"):
+        socketio.emit('market_frame', frame, to=sid, callback=callback)
+
+def collect_metrics():
+    """Order, fill, reject and cancel counts and book depth read in the sequencer, plus the gateway's own counters."""
+    if gateway is None or exchange is None:
+        return []
+    samples = gateway.call(exchange_collector, exchange).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
+    samples.append(("gateway_commands_total", "counter", "Commands applied by the order gateway.", [({}, gateway.processed)]))
+    samples.append(("gateway_rejected_full_total", "counter", "Commands refused because the gateway queue was full.",
+                    [({}, gateway.rejected_full)]))
+    samples.append(("gateway_queue_depth", "gauge", "Commands waiting in the gateway queue.", [({}, gateway.queue_depth())]))
+    return samples
+
+metrics.add_collector(collect_metrics)
+
+def start_profiling(mode=SAMPLING, interval=None, threads=None):
+    """Start a profiling session: sampling every thread (or those named in threads), or cProfile on the trading loop and the sequencer."""
+    status = profiler.start(mode, interval or PROFILER_SETTINGS["interval"], threads)
+    logger.info("Profiling started (%s)", mode)
+    return status
+
+def stop_profiling():
+    """End the profiling session and write its file; the sequencer is woken so it stops its own profile."""
+    wake = (lambda: gateway.call(profiler.checkpoint)) if gateway is not None else None
+    result = profiler.stop(wake, timeout=PROFILER_SETTINGS["stop_timeout"])
+    logger.info("Profile written to %s", result["path"])
+    return result
+
+def publish_leaderboard():
+    """Hand the publisher the top and bottom of the leaderboard, so clients see the traders before trading starts."""
+    gateway.call(leaderboard.update).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
+    publisher.publish(None, None, leaderboard.board(LEADERBOARD_SETTINGS["size"], STOCK_SETTINGS["default_stock_id"]))
+
+def reset_market():
+    """Restore the market to its post-initialization state from the cached snapshot.
+
+    Falls back to initialize_market() if no snapshot has been taken yet. With a
+    journal configured, the journal restarts with the snapshot saved next to it
+    as its base.
+    """
+    global price_history
     
-    # Let candlestick_data grow to preserve history for client-side panning/zooming
+    if initial_snapshot is None:
+        initialize_market()
+        return
+    
+    price_history = []
+    
+    # The journal is swapped along with the exchange, in the sequencer
+    restored = StockExchange.restore(initial_snapshot, ledger=SIMULATION_SETTINGS["ledger"])
+    if gateway is None:
+        switch_exchange(restored)
+        bind_gateway()
+    else:
+        gateway.call(switch_exchange, restored).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
+    if publisher is not None:
+        publisher.reset()
+        publish_leaderboard()
+    logger.info("Market reset to its initial state")
+
+def get_candle_state():
+    """Return (candle version, closed candles, current candle) of the chart's latest max_candles for the snapshot cache.
+
+    Older candles are served by /api/candles as the chart is panned.
+    """
+    history = candles.candles(STOCK_SETTINGS["default_stock_id"], CHART_SETTINGS["candlestick_interval"],
+                              CHART_SETTINGS["max_candles"])
+    return candles.version, history[:-1], history[-1] if history else None
+
+def get_book_snapshot():
+    """Full book and trader rows from the book feed, for a client that is (re)starting its local book."""
+    if gateway is None:
+        return book_feed.snapshot()
+    return gateway.call(book_feed.snapshot).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
 
 def get_market_data(include_full_history=True):
     """Get current market data for visualization."""
     if not exchange:
-        print("Error: Exchange not initialized")
+        logger.error("Exchange not initialized")
         return None
     
-    if not traders:
-        print("Error: Traders not initialized")
+    if not traders or not market_snapshot:
+        logger.error("Traders not initialized")
         return None
     
     try:
-        current_price = exchange.get_stock_price(STOCK_SETTINGS["default_stock_id"])
-        lowest_ask = exchange.get_lowest_ask(STOCK_SETTINGS["default_stock_id"])
-        highest_bid = exchange.get_highest_bid(STOCK_SETTINGS["default_stock_id"])
-        stock_orders = exchange.get_stock_orders(STOCK_SETTINGS["default_stock_id"])
-        
-        # Get order book data
-        bids = []
-        asks = []
-        
-        if "bids" in stock_orders:
-            for price, orders in stock_orders["bids"].items():
-                total_quantity = sum(qty for _, qty in orders)
-                bids.append({"price": float(price), "quantity": total_quantity})
-        
-        if "asks" in stock_orders:
-            for price, orders in stock_orders["asks"].items():
-                total_quantity = sum(qty for _, qty in orders)
-                asks.append({"price": float(price), "quantity": total_quantity})
-        
-        # Get user balances and portfolios
-        users_data = []
-        if hasattr(traders, 'trader_ids') and traders.trader_ids:
-            for user_id in traders.trader_ids:
-                try:
-                    balance = exchange.get_user_balance(user_id)
-                    portfolio = exchange.get_user_portfolio(user_id)
-                    stock_quantity = portfolio.get("TECH", 0)
-                    total_value = balance + (stock_quantity * (current_price or 100))
-                    
-                    users_data.append({
-                        "user_id": user_id,
-                        "balance": round(float(balance), 2),
-                        "stock_quantity": int(stock_quantity),
-                        "total_value": round(float(total_value), 2)
-                    })
-                except Exception as user_error:
-                    print(f"Error getting data for user {user_id}: {user_error}")
-                    continue
-        
-        data = {
-            "timestamp": datetime.now().isoformat(),
-            "current_price": round(float(current_price), DISPLAY_SETTINGS["price_decimals"]) if current_price else None,
-            "lowest_ask": round(float(lowest_ask), DISPLAY_SETTINGS["price_decimals"]) if lowest_ask else None,
-            "highest_bid": round(float(highest_bid), DISPLAY_SETTINGS["price_decimals"]) if highest_bid else None,
-            "spread": round(float(lowest_ask - highest_bid), DISPLAY_SETTINGS["price_decimals"]) if (lowest_ask and highest_bid) else None,
-            "bids": sorted(bids, key=lambda x: x["price"], reverse=True)[:DISPLAY_SETTINGS["max_orders_displayed"]],
-            "asks": sorted(asks, key=lambda x: x["price"])[:DISPLAY_SETTINGS["max_orders_displayed"]],
-            "users": users_data,
-        }
-
-        if include_full_history:
-            data["candlestick_data"] = candlestick_data + ([current_candle] if current_candle else [])
-        else:
-            data["latest_candle"] = current_candle
-
-        return data
+        # Served from the snapshot cache; only sections that changed are rebuilt.
+        # Read in the sequencer so the engine is never read mid-update.
+        with metrics.time("market_data"):
+            if gateway is None:
+                return market_snapshot.get(include_full_history)
+            return gateway.call(market_snapshot.get, include_full_history).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
     except Exception as e:
-        print(f"Error getting market data: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error getting market data: %s: %s", type(e).__name__, e)
         return None
 
 def trading_loop():
     """Background trading loop that places random orders."""
     global trading_active, price_history
     
-    print("Trading loop started")
+    logger.info("Trading loop started")
     
     while trading_active:
         try:
             if not exchange or not traders:
-                print("Exchange or traders not initialized, stopping trading loop")
+                logger.error("Exchange or traders not initialized, stopping trading loop")
                 break
-                
-            # Place some random orders
-            for _ in range(SIMULATION_SETTINGS["orders_per_second"]):
-                try:
-                    trader_id = random.choice(traders.trader_ids)
-                    traders.place_random_order(trader_id)
-                except Exception as order_error:
-                    print(f"Error placing order: {order_error}")
-                    continue
             
-            # Clean up invalid orders before market data update
-            exchange.clean_invalid_orders(STOCK_SETTINGS["default_stock_id"])
+            # Join or leave a deterministic profiling session; the sequencer does the
+            # engine work for this loop, so it profiles itself too
+            profiler.checkpoint()
+            if profiler.deterministic:
+                gateway.call(profiler.checkpoint)
             
-            # Get current market price and update the candle
-            current_price = exchange.get_stock_price(STOCK_SETTINGS["default_stock_id"])
-            if current_price:
-                update_candlestick_data(current_price)
+            tick_start = time.perf_counter()
+            # Place some random orders through the gateway; the traders read
+            # balances and prices, so they run inside the sequencer too
+            with metrics.time("orders"):
+                if SIMULATION_SETTINGS["order_generation"] == "vectorized":
+                    try:
+                        gateway.call(traders.place_random_orders, SIMULATION_SETTINGS["orders_per_second"]).result(
+                            timeout=GATEWAY_SETTINGS["ack_timeout"])
+                    except Exception as order_error:
+                        logger.warning("Error placing orders: %s", order_error)
+                else:
+                    acks = [gateway.call(traders.place_random_order, traders.rng.choice(traders.trader_ids))
+                            for _ in range(SIMULATION_SETTINGS["orders_per_second"])]
+                    for ack in acks:
+                        try:
+                            ack.result(timeout=GATEWAY_SETTINGS["ack_timeout"])
+                        except Exception as order_error:
+                            logger.warning("Error placing order: %s", order_error)
+            if journal is not None:
+                with metrics.time("journal"):
+                    journal.commit()
             
-            # Get market data without the full history for the socket emission
-            market_data_for_emit = get_market_data(include_full_history=False)
-
-            if market_data_for_emit:
-                # Emit data to all connected clients
-                try:
-                    socketio.emit('market_update', {
-                        "market_data": market_data_for_emit,
-                    })
-                except Exception as emit_error:
-                    print(f"Error emitting data: {emit_error}")
+            # Hand what changed in the book, the current candle and the top and bottom
+            # of the leaderboard to the publisher; it delivers to each client at that
+            # client's own rate
+            try:
+                stock_id = STOCK_SETTINGS["default_stock_id"]
+                with metrics.time("book_delta"):
+                    delta = gateway.call(book_feed.delta).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
+                with metrics.time("leaderboard"):
+                    gateway.call(leaderboard.update).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
+                    board = leaderboard.board(LEADERBOARD_SETTINGS["size"], stock_id)
+                with metrics.time("publish"):
+                    publisher.publish(delta, candles.latest(stock_id, CHART_SETTINGS["candlestick_interval"]), board)
+            except Exception as publish_error:
+                logger.error("Error publishing data: %s", publish_error)
+            metrics.observe("tick", time.perf_counter() - tick_start)
             
             time.sleep(SIMULATION_SETTINGS["update_interval"])  # Configurable update interval
             
         except Exception as e:
-            print(f"Error in trading loop: {type(e).__name__}: {str(e)}")
+            logger.exception("Error in trading loop: %s: %s", type(e).__name__, e)
             time.sleep(1)
     
-    print("Trading loop stopped")
+    profiler.leave()
+    logger.info("Trading loop stopped")
+
+def token_matches(known_token, token):
+    """Compare tokens in constant time so the reply does not hint at near misses."""
+    return hmac.compare_digest(str(known_token).encode(), str(token).encode())
+
+def trader_for_token(token):
+    """The trader an access token from SERVER_SETTINGS["trader_tokens"] trades as, or None."""
+    trader = None
+    for known_token, user_id in SERVER_SETTINGS["trader_tokens"].items():
+        if token_matches(known_token, token):
+            trader = user_id
+    return trader
+
+def is_admin_token(token):
+    """Whether token is SERVER_SETTINGS["admin_token"]; always False while none is configured."""
+    admin_token = SERVER_SETTINGS["admin_token"]
+    return admin_token is not None and token is not None and token_matches(admin_token, token)
+
+def admin_only(view):
+    """Refuse an HTTP request unless it carries the admin token as "Authorization: Bearer <token>"."""
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        if SERVER_SETTINGS["admin_token"] is None:
+            return jsonify({"error": "No admin token is configured"}), 403
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme != "Bearer" or not is_admin_token(token):
+            return jsonify({"error": "Admin token required"}), 401
+        return view(*args, **kwargs)
+    return guarded
 
 @app.route('/')
 def index():
@@ -260,6 +445,149 @@ def api_market_data():
         "market_data": market_data,
     })
 
+@app.route('/api/candles')
+def api_candles():
+    """API endpoint for candle history by time range.
+
+    Query parameters: stock, resolution (seconds), from and to (epoch seconds;
+    bars starting in [from, to)), and either max_points, to merge the whole
+    range down to at most that many bars, or cursor, to page through raw bars
+    candle_page_size at a time using the next_cursor of the previous page.
+    """
+    args = request.args
+    stock_id = args.get("stock", STOCK_SETTINGS["default_stock_id"])
+    resolution = args.get("resolution", CHART_SETTINGS["candlestick_interval"], type=int)
+    start = args.get("from", type=float)
+    end = args.get("to", type=float)
+    cursor = args.get("cursor", type=int)
+    max_points = args.get("max_points", type=int)
+    if max_points is not None and max_points < 1:
+        return jsonify({"error": "max_points must be at least 1."}), 400
+    
+    # Bars start on whole seconds, so round both bounds up
+    start = cursor if cursor is not None else (math.ceil(start) if start is not None else None)
+    end = math.ceil(end) if end is not None else None
+    # A page reads one bar past its end to know whether another page follows
+    limit = None if max_points is not None else CHART_SETTINGS["candle_page_size"] + 1
+    try:
+        starts, bars = candles.range_arrays(stock_id, resolution, start, end, limit)
+    except ValueError as range_error:
+        return jsonify({"error": str(range_error)}), 400
+    
+    next_cursor = None
+    if max_points is not None:
+        starts, bars = downsample(starts, bars, max_points)
+    elif len(starts) == limit:
+        next_cursor = str(starts[-1])
+        starts, bars = starts[:-1], bars[:-1]
+    return jsonify({
+        "stock": stock_id,
+        "resolution": resolution,
+        "candles": candle_dicts(starts, bars),
+        "next_cursor": next_cursor,
+    })
+
+@app.route('/api/trades')
+def api_trades():
+    """API endpoint for time and sales: the latest trades plus rolling statistics over the stats window."""
+    stock_id = STOCK_SETTINGS["default_stock_id"]
+    limit = request.args.get("limit", 50, type=int)
+    sides = {code: side for side, code in AGGRESSOR_CODES.items()}
+    trades = []
+    for rows in tape.last(stock_id, max(limit, 0)):
+        for time_, price, quantity, buyer, seller, aggressor in rows[["time", "price", "quantity", "buyer", "seller", "aggressor"]].tolist():
+            trades.append({"time": time_, "price": price, "quantity": quantity, "buyer_id": buyer,
+                           "seller_id": seller, "aggressor": sides[aggressor]})
+    return jsonify({
+        "trades": trades,
+        "stats": tape.stats(stock_id, TAPE_SETTINGS["stats_window"]),
+        "total_trades": tape.count(stock_id),
+    })
+
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    """API endpoint for a page of the leaderboard: traders ranked offset+1 to offset+limit by total value."""
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", LEADERBOARD_SETTINGS["size"], type=int), 0), LEADERBOARD_SETTINGS["page_size"])
+    return jsonify({
+        "offset": offset,
+        "total": len(leaderboard),
+        "traders": leaderboard.page(offset, limit),
+    })
+
+@app.route('/api/pnl')
+def api_pnl():
+    """API endpoint for P&L at the last traded prices.
+
+    With user_id, that user's position, average cost and realized and
+    unrealized P&L per stock; without, the market-wide exposure and P&L per
+    stock. Served from the P&L engine, so it never waits on matching.
+    """
+    user_id = request.args.get("user_id", type=int)
+    if user_id is None:
+        return jsonify({"users": pnl.num_users, "stocks": pnl.stock_summary()})
+    try:
+        stocks = pnl.user(user_id)
+    except ValueError as user_error:
+        return jsonify({"error": str(user_error)}), 404
+    return jsonify({
+        "user_id": user_id,
+        "stocks": stocks,
+        "realized": round(sum(row["realized"] for row in stocks.values()), 2),
+        "unrealized": round(sum(row["unrealized"] for row in stocks.values()), 2),
+    })
+
+@app.route('/api/logs')
+def api_logs():
+    """API endpoint for the newest log entries kept in memory, optionally only those at level or above."""
+    try:
+        entries = EventLog.recent(request.args.get("limit", 100, type=int), request.args.get("level"))
+    except ValueError as level_error:
+        return jsonify({"error": str(level_error)}), 400
+    return jsonify({"entries": entries})
+
+@app.route('/api/metrics')
+def api_metrics():
+    """Stage latency histograms, order and fill counters and book depth in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/profile')
+@admin_only
+def api_profile():
+    """API endpoint for the running profiling session, if any, and the latest result."""
+    return jsonify(profiler.status())
+
+@app.route('/api/profile/start', methods=['POST'])
+@admin_only
+def api_profile_start():
+    """Start profiling: ?mode=sampling|deterministic&interval=<seconds between samples>&threads=<name,name>."""
+    threads = request.args.get("threads")
+    try:
+        status = start_profiling(request.args.get("mode", SAMPLING), request.args.get("interval", type=float),
+                                 threads.split(",") if threads else None)
+    except ValueError as profile_error:
+        return jsonify({"error": str(profile_error)}), 400
+    except RuntimeError as profile_error:
+        return jsonify({"error": str(profile_error)}), 409
+    return jsonify(status)
+
+@app.route('/api/profile/stop', methods=['POST'])
+@admin_only
+def api_profile_stop():
+    """Stop profiling and return where the profile was written; fetch it from /api/profile/download."""
+    try:
+        return jsonify(stop_profiling())
+    except RuntimeError as profile_error:
+        return jsonify({"error": str(profile_error)}), 409
+
+@app.route('/api/profile/download')
+@admin_only
+def api_profile_download():
+    """API endpoint for the latest profile: collapsed stacks for a sampling session, a pstats file for a deterministic one."""
+    if profiler.last is None:
+        return jsonify({"error": "No profile has been taken yet"}), 404
+    return send_file(os.path.abspath(profiler.last["path"]), as_attachment=True)
+
 @app.route('/api/config')
 def api_config():
     """API endpoint for configuration data."""
@@ -269,16 +597,144 @@ def api_config():
         "simulation_settings": SIMULATION_SETTINGS
     })
 
+def owned_order(user_id, order_id):
+    """A resting order of user_id's. Run it in the sequencer; others' orders are reported as missing."""
+    order = gateway.exchange.get_order(order_id)
+    if order is None or order.user_id != user_id:
+        raise ValueError("No such order exists.")
+    return order
+
+def cancel_own_order(user_id, order_id):
+    owned_order(user_id, order_id)
+    return gateway.exchange.cancel_order(order_id)
+
+def amend_own_order(user_id, order_id, new_qty):
+    owned_order(user_id, order_id)
+    return gateway.exchange.amend_order(order_id, new_qty)
+
 @socketio.on('connect')
-def handle_connect():
-    """Handle client connection."""
-    print('Client connected')
+def handle_connect(auth=None):
+    """Handle client connection, binding it to a trader (or marking it as the admin) if it presents a known token."""
+    token = auth.get("token") if isinstance(auth, dict) else None
+    if is_admin_token(token):
+        session_admins.add(request.sid)
+    elif token is not None:
+        user_id = trader_for_token(token)
+        if user_id is None:
+            logger.warning("Refused a client connection with an unknown token")
+            return False
+        session_traders[request.sid] = user_id
+    logger.info('Client connected', trader=session_traders.get(request.sid))
     emit('trading_status', {'status': 'connected'})
+    if publisher is not None:
+        publisher.add_client(request.sid)
+
+@socketio.on('request_book_snapshot')
+def handle_request_book_snapshot():
+    """Resend the full book to a client that saw a gap in the frame sequence."""
+    if publisher is not None:
+        publisher.resync(request.sid)
+
+@socketio.on('set_update_interval')
+def handle_set_update_interval(data):
+    """Let a client choose how often it receives market frames. The ack carries the granted interval."""
+    if publisher is None:
+        return {"status": "rejected", "error": "Market not initialized"}
+    try:
+        return {"status": "ok", "interval": publisher.set_interval(request.sid, data["interval"])}
+    except (KeyError, TypeError, ValueError) as interval_error:
+        return {"status": "rejected", "error": str(interval_error)}
+
+@socketio.on('request_leaderboard')
+def handle_request_leaderboard(data):
+    """Send a client a page of the leaderboard as the ack, at most page_size traders from data's offset."""
+    if leaderboard is None:
+        return {"status": "rejected", "error": "Market not initialized"}
+    try:
+        offset = max(int(data.get("offset", 0)), 0)
+        limit = min(max(int(data.get("limit", LEADERBOARD_SETTINGS["size"])), 0), LEADERBOARD_SETTINGS["page_size"])
+    except (AttributeError, TypeError, ValueError) as page_error:
+        return {"status": "rejected", "error": str(page_error)}
+    return {"status": "ok", "offset": offset, "total": len(leaderboard), "traders": leaderboard.page(offset, limit)}
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection."""
-    print('Client disconnected')
+    logger.info('Client disconnected')
+    session_traders.pop(request.sid, None)
+    session_admins.discard(request.sid)
+    if publisher is not None:
+        publisher.remove_client(request.sid)
+
+@socketio.on('place_order')
+def handle_place_order(data):
+    """Accept an order from a socket client for the trader it is bound to. The return value is sent back as the client's ack."""
+    if gateway is None:
+        return {"status": "rejected", "error": "Market not initialized"}
+    user_id = session_traders.get(request.sid)
+    if user_id is None:
+        return {"status": "rejected", "error": "Connect with a trader token to trade"}
+    try:
+        if data.get("user_id", user_id) != user_id:
+            return {"status": "rejected", "error": "Orders can only be placed for the connected trader"}
+        filled, value, order_id = gateway.submit(
+            "order", data.get("stock_id", STOCK_SETTINGS["default_stock_id"]), user_id,
+            data["side"], data["order_type"], data["quantity"], data.get("price"),
+        ).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
+    except Exception as order_error:
+        return {"status": "rejected", "error": str(order_error)}
+    return {"status": "accepted", "order_id": order_id, "filled": filled, "value": value}
+
+@socketio.on('cancel_order')
+def handle_cancel_order(data):
+    """Cancel one of the bound trader's resting orders. The return value is sent back as the client's ack."""
+    if gateway is None:
+        return {"status": "rejected", "error": "Market not initialized"}
+    user_id = session_traders.get(request.sid)
+    if user_id is None:
+        return {"status": "rejected", "error": "Connect with a trader token to trade"}
+    try:
+        remaining = gateway.call(cancel_own_order, user_id, data["order_id"]).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
+    except Exception as cancel_error:
+        return {"status": "rejected", "error": str(cancel_error)}
+    return {"status": "cancelled", "order_id": data["order_id"], "remaining": remaining}
+
+@socketio.on('amend_order')
+def handle_amend_order(data):
+    """Change the open quantity of one of the bound trader's resting orders. The return value is sent back as the client's ack."""
+    if gateway is None:
+        return {"status": "rejected", "error": "Market not initialized"}
+    user_id = session_traders.get(request.sid)
+    if user_id is None:
+        return {"status": "rejected", "error": "Connect with a trader token to trade"}
+    try:
+        gateway.call(amend_own_order, user_id, data["order_id"], data["quantity"]).result(timeout=GATEWAY_SETTINGS["ack_timeout"])
+    except Exception as amend_error:
+        return {"status": "rejected", "error": str(amend_error)}
+    return {"status": "amended", "order_id": data["order_id"], "quantity": data["quantity"]}
+
+@socketio.on('start_profiling')
+def handle_start_profiling(data=None):
+    """Start a profiling session for an admin socket client. The return value is sent back as the client's ack."""
+    if request.sid not in session_admins:
+        return {"status": "rejected", "error": "Connect with the admin token to profile"}
+    data = data or {}
+    try:
+        status = start_profiling(data.get("mode", SAMPLING), data.get("interval"), data.get("threads"))
+    except (ValueError, RuntimeError) as profile_error:
+        return {"status": "rejected", "error": str(profile_error)}
+    return {"status": "started", **status}
+
+@socketio.on('stop_profiling')
+def handle_stop_profiling():
+    """Stop the profiling session for an admin socket client. The return value is sent back as the client's ack."""
+    if request.sid not in session_admins:
+        return {"status": "rejected", "error": "Connect with the admin token to profile"}
+    try:
+        result = stop_profiling()
+    except RuntimeError as profile_error:
+        return {"status": "rejected", "error": str(profile_error)}
+    return {"status": "stopped", "download": "/api/profile/download", **result}
 
 @socketio.on('start_trading')
 def handle_start_trading():
@@ -288,7 +744,7 @@ def handle_start_trading():
     if not trading_active:
         trading_active = True
         # Start trading in a separate thread
-        trading_thread = threading.Thread(target=trading_loop)
+        trading_thread = threading.Thread(target=trading_loop, name="trading-loop")
         trading_thread.daemon = True
         trading_thread.start()
         emit('trading_status', {'status': 'started'})
@@ -303,23 +759,22 @@ def handle_stop_trading():
 @socketio.on('reset_market')
 def handle_reset_market():
     """Reset the market to initial state."""
-    global trading_active, price_history, candlestick_data, current_candle
+    global trading_active
     trading_active = False
-    price_history = []
-    candlestick_data = []
-    current_candle = None
-    initialize_market()
+    reset_market()
     emit('trading_status', {'status': 'reset'})
 
 if __name__ == '__main__':
-    # Initialize the market
-    initialize_market()
+    EventLog.configure(**LOGGING_SETTINGS)
+    
+    # Initialize the market, picking up from the journal if there is one
+    initialize_market(recover=JOURNAL_SETTINGS["recover"])
     
     # Create templates directory if it doesn't exist
     import os
     os.makedirs('templates', exist_ok=True)
     
-    print("Starting Stock Market Visualization Server...")
-    print("Open http://localhost:5000 in your browser")
+    logger.info("Starting Stock Market Visualization Server...")
+    logger.info("Open http://localhost:5000 in your browser")
     
     socketio.run(app, debug=SERVER_SETTINGS["debug"], host=SERVER_SETTINGS["host"], port=SERVER_SETTINGS["port"], allow_unsafe_werkzeug=True)
\ No newline at end of file
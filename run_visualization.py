@@ -70,7 +70,10 @@ def main():
     
     # Import and run the Flask app
     try:
+        import EventLog
+        from config import LOGGING_SETTINGS
         from market_visualizer import app, socketio, initialize_market
+        EventLog.configure(**LOGGING_SETTINGS)
         initialize_market()
         socketio.run(app, debug=False,)
     except KeyboardInterrupt:
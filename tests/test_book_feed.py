@@ -0,0 +1,55 @@
+import random
+from BookFeed import BookFeed
+from RandomTraders import RandomTraders
+from StockExchange import StockExchange
+
+def apply(book, delta):
+    """Apply a delta's absolute level quantities to a {"bids", "asks"} book of {price: quantity}."""
+    for side in ("bids", "asks"):
+        for price, quantity in delta[side]:
+            if quantity:
+                book[side][price] = quantity
+            else:
+                book[side].pop(price, None)
+
+def levels(snapshot):
+    return {side: dict(map(tuple, snapshot[side])) for side in ("bids", "asks")}
+
+def test_deltas_applied_to_a_snapshot_rebuild_the_full_book():
+    """Deltas on top of the first snapshot, or of a snapshot taken mid-stream, match a full snapshot after every step."""
+    exchange = StockExchange()
+    exchange.ipo_stock("TECH", 50 * 100, 100)
+    traders = RandomTraders(exchange, "TECH", 50, 10_000, seed=4, verbose=False)
+    for trader_id in traders.trader_ids:
+        exchange.transfer_stock(0, trader_id, "TECH", 100)
+    feed = BookFeed(exchange, "TECH", traders.trader_ids, seq=7)
+    first = feed.snapshot()
+    book, rows = levels(first), {row[0]: row for row in first["users"]}
+    late_book, late_seq = None, None
+    rng = random.Random(4)
+    seq = first["seq"]
+    for step in range(60):
+        for _ in range(rng.randint(0, 15)):
+            traders.place_random_order(rng.choice(traders.trader_ids))
+        if step == 30:
+            late = feed.snapshot()
+            late_book, late_seq = levels(late), late["seq"]
+            traders.place_random_order(rng.choice(traders.trader_ids)) # a change the late snapshot already holds
+        delta = feed.delta()
+        if delta is None:
+            continue
+        assert delta["seq"] == seq + 1
+        seq = delta["seq"]
+        apply(book, delta)
+        rows.update((row[0], row) for row in delta["users"])
+        if late_book is not None and delta["seq"] > late_seq:
+            apply(late_book, delta)
+        full = feed.snapshot()
+        assert full["seq"] == seq
+        assert book == levels(full)
+        assert sorted(rows.values()) == sorted(full["users"])
+        assert delta["summary"] == full["summary"]
+        if late_book is not None:
+            assert late_book == levels(full)
+    assert seq > first["seq"] + 30
+    assert feed.delta() is None
@@ -0,0 +1,54 @@
+import random
+import numpy as np
+import pytest
+from CandleAggregator import CandleAggregator
+
+RESOLUTIONS = (1, 5, 60, 300)
+
+def naive_bars(fills, resolution):
+    """Bars grouped straight from the fills: {start: [open, high, low, close, volume, notional]}."""
+    bars = {}
+    for timestamp, price, quantity in fills:
+        start = int(timestamp // resolution) * resolution
+        bar = bars.get(start)
+        if bar is None:
+            bars[start] = [price, price, price, price, quantity, price * quantity]
+        else:
+            bar[1], bar[2], bar[3] = max(bar[1], price), min(bar[2], price), price
+            bar[4] += quantity
+            bar[5] += price * quantity
+    return bars
+
+def test_rolled_up_bars_match_naive_aggregation():
+    """Bars rolled up from finer bars equal bars built from every fill, at every resolution and at every point in time."""
+    rng = random.Random(6)
+    candles = CandleAggregator(RESOLUTIONS, capacity=10_000)
+    fills, now = [], 1_700_000_000.0
+    for i in range(5_000):
+        # Mostly sub-second steps, with gaps that skip whole bars of every resolution
+        now += rng.expovariate(4.0) if rng.random() < 0.995 else rng.uniform(300, 1_000)
+        fill = (now, round(rng.uniform(90, 110), 2), rng.randint(1, 50))
+        fills.append(fill)
+        candles.on_trade("TECH", fill[1], fill[2], timestamp=fill[0])
+        if i % 1_000 == 999 or i == 4_999:
+            for resolution in RESOLUTIONS:
+                expected = naive_bars(fills, resolution)
+                starts, bars = candles.arrays("TECH", resolution)
+                assert starts.tolist() == list(expected)
+                assert bars == pytest.approx(np.array(list(expected.values())))
+                assert candles.latest("TECH", resolution)["close"] == fill[1]
+
+def test_range_arrays_match_a_filter_over_all_bars():
+    rng = random.Random(7)
+    candles = CandleAggregator(RESOLUTIONS, capacity=50)
+    now = 1_700_000_000.0
+    for _ in range(2_000):
+        now += rng.expovariate(2.0)
+        candles.on_trade("TECH", rng.uniform(90, 110), rng.randint(1, 50), timestamp=now)
+    starts, bars = candles.arrays("TECH", 5)
+    assert len(starts) > 50 # the ring has wrapped; the newest bars are still in progress
+    for low, high, limit in ((starts[3], starts[20], None), (starts[10], starts[-1] + 1, 5), (0, starts[0], None)):
+        keep = (starts >= low) & (starts < high)
+        range_starts, range_bars = candles.range_arrays("TECH", 5, low, high, limit)
+        assert range_starts.tolist() == starts[keep][:limit].tolist()
+        assert range_bars.tolist() == bars[keep][:limit].tolist()
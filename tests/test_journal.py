@@ -0,0 +1,131 @@
+import random
+import sys
+import threading
+from Journal import Journal, FSYNC_NEVER, read_journal
+from StockExchange import StockExchange, ORDER_REJECTED
+
+def test_concurrent_first_use_of_stocks_replays_exactly(tmp_path):
+    """Threads journaling the first records of different stocks at once must not corrupt the symbol table."""
+    num_threads, stocks_per_thread, users_per_thread = 8, 25, 4
+    base_exchange = StockExchange()
+    for thread in range(num_threads):
+        for stock in range(stocks_per_thread):
+            base_exchange.ipo_stock(f"S{thread}-{stock}", 10_000, 100)
+        for user in range(users_per_thread):
+            base_exchange.add_user(1 + thread * users_per_thread + user, 1_000_000)
+    for user_id in range(1, num_threads * users_per_thread + 1):
+        for stock_id in base_exchange.stocks:
+            base_exchange.transfer_stock(0, user_id, stock_id, 100)
+    base = tmp_path / "base.snapshot"
+    base_exchange.snapshot(str(base))
+
+    # A journal started on a restored exchange writes each stock's SYMBOL record on its first use
+    path = str(tmp_path / "exchange.journal")
+    journal = Journal(path, fsync=FSYNC_NEVER, group_size=64)
+    exchange = StockExchange.restore(str(base), journal=journal)
+    start = threading.Barrier(num_threads)
+    errors = []
+
+    def trade(thread):
+        # Orders stay on the thread's own stocks and users, so the journal replays exactly
+        rng = random.Random(thread)
+        user_ids = [1 + thread * users_per_thread + user for user in range(users_per_thread)]
+        start.wait()
+        # Every thread moves shares of every stock between its own users (under their cash
+        # stripes, not a lock shared with other threads), so threads race to use each one first
+        all_stocks = list(exchange.stocks)
+        rng.shuffle(all_stocks)
+        for stock_id in all_stocks:
+            exchange.transfer_stock(user_ids[0], rng.choice(user_ids[1:]), stock_id, 1)
+        for stock in range(stocks_per_thread):
+            stock_id = f"S{thread}-{stock}"
+            for _ in range(20):
+                try:
+                    exchange.place_order(stock_id, rng.choice(user_ids), rng.choice(("bid", "ask")), "limit",
+                                         rng.randint(1, 20), round(rng.uniform(95, 105), 2))
+                except ValueError:
+                    pass # unfunded, so rejected before it was journaled
+
+    def run(thread):
+        try:
+            trade(thread)
+        except Exception as error:
+            errors.append(error)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) # switch threads often, so first uses of stocks interleave
+    try:
+        threads = [threading.Thread(target=run, args=(thread,)) for thread in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    journal.close()
+    assert not errors
+
+    replayed = StockExchange.replay(path, base=str(base))
+    assert replayed.snapshot() == exchange.snapshot()
+    # One SYMBOL record and a distinct index per stock
+    assert sorted(journal.symbols.values()) == list(range(num_threads * stocks_per_thread))
+
+def test_order_batches_replay_with_their_id_blocks(tmp_path):
+    """Rejected rows leave gaps in a batch's ID block; replay must leave the same gaps."""
+    path = str(tmp_path / "exchange.journal")
+    exchange = StockExchange(journal=Journal(path, fsync=FSYNC_NEVER, group_size=16))
+    for stock_id in ("A", "B"):
+        exchange.ipo_stock(stock_id, 10_000, 100.0)
+    for user_id in range(1, 6):
+        exchange.add_user(user_id, 2_000)
+        for stock_id in ("A", "B"):
+            exchange.transfer_stock(0, user_id, stock_id, 50)
+    rng = random.Random(7)
+    rejected = 0
+    for _ in range(20):
+        size = rng.randint(1, 40)
+        results = exchange.place_orders({
+            "stock": [rng.choice("AB") for _ in range(size)],
+            "user": [rng.randint(1, 5) for _ in range(size)],
+            "side": [rng.randint(0, 1) for _ in range(size)],
+            "type": [int(rng.random() < 0.8) for _ in range(size)],
+            "qty": [rng.randint(1, 30) for _ in range(size)],
+            "price": [rng.uniform(90, 110) for _ in range(size)],
+        })
+        rejected += int((results["status"] == ORDER_REJECTED).sum())
+        try:
+            exchange.place_order(rng.choice("AB"), rng.randint(1, 5), "bid", "limit", 1, 95)
+        except ValueError:
+            pass
+    exchange.journal.close()
+    assert rejected
+
+    replayed = StockExchange.replay(path)
+    assert replayed.snapshot() == exchange.snapshot()
+    assert replayed.orders.keys() == exchange.orders.keys()
+
+def test_every_record_kind_replays(tmp_path):
+    """A journal holding each kind of record yields each call once and rebuilds the same exchange."""
+    path = str(tmp_path / "exchange.journal")
+    exchange = StockExchange(journal=Journal(path, fsync=FSYNC_NEVER))
+    exchange.ipo_stock("TECH", 1_000, 100.0, tick_size=0.05, ladder="dense")
+    exchange.add_user(1, 5_000)
+    exchange.add_user(2, 5_000)
+    exchange.transfer_stock(0, 1, "TECH", 100)
+    exchange.transfer_money(2, 1, 250.5)
+    _, _, ask_id = exchange.place_order("TECH", 1, "ask", "limit", 40, 101.03)
+    _, _, bid_id = exchange.place_order("TECH", 2, "bid", "limit", 10, 99)
+    exchange.place_order("TECH", 2, "bid", "market", 5)
+    exchange.amend_order(ask_id, 20)
+    exchange.cancel_order(bid_id)
+    exchange.place_orders({"stock": ["TECH"] * 3, "user": [2, 2, 1], "side": [0, 0, 1],
+                           "type": [1, 0, 1], "qty": [3, 2, 5], "price": [100.0, 0.0, 102.0]})
+    exchange.journal.close()
+
+    calls = [method for method, _ in read_journal(path)]
+    assert calls == ["ipo_stock", "add_user", "add_user", "transfer_stock", "transfer_money", "place_order",
+                     "place_order", "place_order", "amend_order", "cancel_order", "place_orders"]
+    replayed = StockExchange.replay(path)
+    assert replayed.snapshot() == exchange.snapshot()
+    assert replayed.orders.keys() == exchange.orders.keys()
+    assert replayed.get_order(ask_id).quantity == 18
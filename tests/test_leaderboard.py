@@ -0,0 +1,38 @@
+import random
+import pytest
+from Leaderboard import Leaderboard
+from RandomTraders import RandomTraders
+from StockExchange import StockExchange
+
+def full_sort(exchange, user_ids, stock_id):
+    """(value, user_id) of every trader from scratch, highest value first."""
+    price = exchange.get_stock_price(stock_id)
+    values = []
+    for user_id in user_ids:
+        reserved_balance, reserved_holdings = exchange.get_user_reserved(user_id)
+        shares = exchange.get_user_portfolio(user_id).get(stock_id, 0) + reserved_holdings.get(stock_id, 0)
+        values.append((exchange.get_user_balance(user_id) + reserved_balance + shares * price, user_id))
+    return sorted(values, reverse=True)
+
+@pytest.mark.parametrize("remark_threshold", [0.0, 0.01, 0.5])
+def test_board_matches_a_full_sort(remark_threshold):
+    """The ends of the board equal the ends of a full sort at the latest price, whether or not the marks are stale."""
+    exchange = StockExchange()
+    exchange.ipo_stock("TECH", 200 * 100, 100)
+    traders = RandomTraders(exchange, "TECH", 200, 10_000, seed=8, verbose=False)
+    rng = random.Random(8)
+    for trader_id in traders.trader_ids:
+        exchange.transfer_stock(0, trader_id, "TECH", rng.randint(1, 100))
+    leaderboard = Leaderboard(exchange, traders.trader_ids, remark_threshold=remark_threshold)
+    for _ in range(40):
+        for _ in range(rng.randint(1, 40)):
+            traders.place_random_order(rng.choice(traders.trader_ids))
+        leaderboard.update()
+        expected = full_sort(exchange, traders.trader_ids, "TECH")
+        top, bottom = leaderboard.board(10, "TECH")
+        assert [value for _, value, _, _ in top] == pytest.approx([round(value, 2) for value, _ in expected[:10]], abs=0.01)
+        assert [value for _, value, _, _ in bottom] == pytest.approx([round(value, 2) for value, _ in expected[::-1][:10]], abs=0.01)
+        assert not {row[0] for row in top} & {row[0] for row in bottom}
+        assert sorted(row["user_id"] for row in leaderboard.page(0, 500)) == sorted(traders.trader_ids)
+    if remark_threshold == 0.5:
+        assert leaderboard.remarks == 1 # only the first ranking; board() was exact from stale marks
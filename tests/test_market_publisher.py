@@ -0,0 +1,80 @@
+import threading
+import time
+import numpy as np
+from MarketPublisher import MarketPublisher, FRAME_HEADER, SNAPSHOT, DELTA
+
+def decode(frame):
+    """(kind, from_seq, to_seq, bids, asks) of a frame, levels as {price: quantity}."""
+    kind, from_seq, to_seq, *_, num_bids, num_asks, num_rows, _ = FRAME_HEADER.unpack_from(frame)
+    levels = num_bids + num_asks
+    prices = np.frombuffer(frame, "<f8", levels, FRAME_HEADER.size)
+    quantities = np.frombuffer(frame, "<i4", levels, FRAME_HEADER.size + 8 * (levels + 2 * num_rows))
+    book = dict(zip(prices.tolist(), quantities.tolist()))
+    return kind, from_seq, to_seq, dict(list(book.items())[:num_bids]), dict(list(book.items())[num_bids:])
+
+class Client:
+    """Collects frames and acknowledges them only when told to."""
+
+    def __init__(self):
+        self.frames = []
+        self.acks = []
+        self.received = threading.Condition()
+
+    def send(self, sid, frame, callback):
+        with self.received:
+            self.frames.append(decode(frame))
+            self.acks.append(callback)
+            self.received.notify_all()
+
+    def next_frame(self):
+        """Acknowledge the last frame and wait for the one after it."""
+        with self.received:
+            count = len(self.frames)
+            self.acks[-1]()
+            assert self.received.wait_for(lambda: len(self.frames) > count, timeout=5)
+            return self.frames[-1]
+
+def delta(seq, bids=(), asks=()):
+    return {"seq": seq, "summary": {"current_price": 100.0}, "bids": list(bids), "asks": list(asks), "users": []}
+
+def start(client, book_seq):
+    snapshot = lambda: {"seq": book_seq[0], "summary": {}, "bids": [[99.0, 5]], "asks": [[101.0, 3]], "users": []}
+    publisher = MarketPublisher(client.send, snapshot, default_interval=0.01, min_interval=0.0)
+    publisher.add_client("a")
+    with client.received:
+        assert client.received.wait_for(lambda: client.frames, timeout=5)
+    return publisher
+
+def test_slow_client_gets_one_merged_delta_with_the_latest_quantities():
+    client, book_seq = Client(), [0]
+    publisher = start(client, book_seq)
+    try:
+        assert client.frames[0] == (SNAPSHOT, 0, 0, {99.0: 5}, {101.0: 3})
+        # Nothing is sent while the snapshot is unacknowledged, so these pile up
+        publisher.publish(delta(1, bids=[[99.0, 7]]))
+        publisher.publish(delta(2, bids=[[98.0, 4]], asks=[[101.0, 0]]))
+        publisher.publish(delta(3, bids=[[99.0, 2]]))
+        time.sleep(0.05)
+        assert len(client.frames) == 1
+        assert client.next_frame() == (DELTA, 1, 3, {99.0: 2, 98.0: 4}, {101.0: 0})
+        assert publisher.frames_sent == 2
+    finally:
+        publisher.close()
+
+def test_resync_and_gaps_send_a_snapshot():
+    client, book_seq = Client(), [0]
+    publisher = start(client, book_seq)
+    try:
+        publisher.publish(delta(1, bids=[[99.0, 6]]))
+        assert client.next_frame()[:3] == (DELTA, 1, 1)
+        book_seq[0] = 1
+        publisher.resync("a")
+        assert client.next_frame()[:3] == (SNAPSHOT, 1, 1)
+        # A delta that does not follow the log (a replaced feed) can only be bridged by a snapshot
+        book_seq[0] = 10
+        publisher.publish(delta(10, asks=[[102.0, 1]]))
+        assert client.next_frame()[:3] == (SNAPSHOT, 10, 10)
+        publisher.publish(delta(11, asks=[[102.0, 2]]))
+        assert client.next_frame() == (DELTA, 11, 11, {}, {102.0: 2})
+    finally:
+        publisher.close()
@@ -0,0 +1,22 @@
+import random
+from MarketSnapshot import MarketSnapshot
+from RandomTraders import RandomTraders
+from StockExchange import StockExchange
+
+def test_incremental_user_rows_match_a_fresh_snapshot():
+    """Rows kept up to date from dirty users and a new price must equal rows read from scratch."""
+    exchange = StockExchange()
+    exchange.ipo_stock("TECH", 50 * 100, 100)
+    traders = RandomTraders(exchange, "TECH", 50, 10_000, seed=3, verbose=False)
+    for trader_id in traders.trader_ids:
+        exchange.transfer_stock(0, trader_id, "TECH", 100)
+    snapshot = MarketSnapshot(exchange, "TECH", traders.trader_ids)
+    rng = random.Random(3)
+    prices = set()
+    for _ in range(50):
+        for _ in range(20):
+            traders.place_random_order(rng.choice(traders.trader_ids))
+        payload = snapshot.get(include_full_history=False)
+        prices.add(payload["current_price"])
+        assert payload["users"] == MarketSnapshot(exchange, "TECH", traders.trader_ids).get(include_full_history=False)["users"]
+    assert len(prices) > 1
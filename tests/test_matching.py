@@ -0,0 +1,40 @@
+from Journal import Journal, FSYNC_NEVER, read_journal
+from StockExchange import StockExchange
+
+def new_exchange(journal=None):
+    exchange = StockExchange(journal=journal)
+    exchange.ipo_stock("TECH", 1_000, 100.0)
+    exchange.add_user(1, 1_000)
+    exchange.add_user(2, 0)
+    exchange.transfer_stock(0, 2, "TECH", 100)
+    return exchange
+
+def test_limit_bid_remainder_cut_after_validation_is_journaled(tmp_path, caplog):
+    """Cash spent between validation and resting shrinks the remainder, and the journal and log say so."""
+    path = str(tmp_path / "exchange.journal")
+    exchange = new_exchange(Journal(path, fsync=FSYNC_NEVER))
+    exchange.place_order("TECH", 2, "ask", "limit", 1, 100)
+
+    def spend_cash(stock_id, price, quantity, buyer_id, seller_id, aggressor):
+        # Stands in for another stock's thread spending the buyer's cash mid-order
+        exchange.transfer_money(buyer_id, 2, exchange.get_user_balance(buyer_id) - 350)
+    exchange.add_trade_listener(spend_cash)
+    filled, _, order_id = exchange.place_order("TECH", 1, "bid", "limit", 10, 100)
+    exchange.journal.close()
+
+    assert filled == 1
+    assert exchange.get_order(order_id).quantity == 3
+    assert exchange.verify_conservation()
+    assert list(read_journal(path))[-1] == ("amend_order", (order_id, 3))
+    assert "rested 3 of its 9 remaining shares" in caplog.text
+
+def test_market_bid_fills_what_it_can_afford_at_the_last_level():
+    exchange = new_exchange()
+    exchange.place_order("TECH", 2, "ask", "limit", 5, 100)
+    exchange.place_order("TECH", 2, "ask", "limit", 10, 110)
+    filled, value, _ = exchange.place_order("TECH", 1, "bid", "market", 10)
+    # Validated at the best ask; after 5 at 100 the remaining 500 covers 4 of the 5 shares at 110
+    assert (filled, value) == (9, 940)
+    assert exchange.get_user_balance(1) == 60
+    assert exchange.get_depth("TECH", "ask", 1) == [(110, 6, 1)]
+    assert exchange.verify_conservation()
@@ -0,0 +1,39 @@
+import pytest
+import market_visualizer as mv
+
+@pytest.fixture(scope="module")
+def market():
+    mv.initialize_market()
+    return mv
+
+@pytest.fixture
+def tokens(monkeypatch, market):
+    owner, other = market.traders.trader_ids[:2]
+    monkeypatch.setitem(mv.SERVER_SETTINGS, "trader_tokens", {"owner-token": owner, "other-token": other})
+    return owner, other
+
+def connect(token=None):
+    return mv.socketio.test_client(mv.app, auth={"token": token} if token is not None else None)
+
+def test_unknown_token_is_refused(tokens):
+    assert not connect("guess").is_connected()
+
+def test_orders_are_placed_for_the_bound_trader_only(tokens):
+    owner, other = tokens
+    watcher, client = connect(), connect("owner-token")
+    order = {"side": "bid", "order_type": "limit", "quantity": 1, "price": 1.0}
+    assert watcher.emit("place_order", order, callback=True)["status"] == "rejected"
+    assert client.emit("place_order", {**order, "user_id": other}, callback=True)["status"] == "rejected"
+    ack = client.emit("place_order", order, callback=True)
+    assert ack["status"] == "accepted"
+    assert mv.gateway.submit("get_order", ack["order_id"]).result(5).user_id == owner
+
+def test_only_the_owner_can_cancel_or_amend(tokens):
+    owner_client, other_client = connect("owner-token"), connect("other-token")
+    order_id = owner_client.emit("place_order", {"side": "bid", "order_type": "limit", "quantity": 2, "price": 1.0},
+                                 callback=True)["order_id"]
+    assert other_client.emit("amend_order", {"order_id": order_id, "quantity": 1}, callback=True)["status"] == "rejected"
+    assert other_client.emit("cancel_order", {"order_id": order_id}, callback=True)["status"] == "rejected"
+    assert owner_client.emit("amend_order", {"order_id": order_id, "quantity": 1}, callback=True)["status"] == "amended"
+    ack = owner_client.emit("cancel_order", {"order_id": order_id}, callback=True)
+    assert (ack["status"], ack["remaining"]) == ("cancelled", 1)
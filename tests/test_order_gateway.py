@@ -0,0 +1,72 @@
+import threading
+import pytest
+from OrderGateway import OrderGateway, GatewayFull
+from StockExchange import StockExchange
+
+def new_exchange():
+    exchange = StockExchange()
+    exchange.ipo_stock("TECH", 10_000, 100.0)
+    for user_id in range(1, 5):
+        exchange.add_user(user_id, 1_000_000)
+        exchange.transfer_stock(0, user_id, "TECH", 1_000)
+    return exchange
+
+@pytest.fixture
+def gateway():
+    gateway = OrderGateway(new_exchange(), max_queue=4)
+    yield gateway
+    gateway.close()
+
+def test_producers_see_one_order_that_replays_exactly():
+    """Each producer's commands apply in its submission order, and the interleaving the sequencer chose replays to the same book."""
+    gateway = OrderGateway(new_exchange())
+    start = threading.Barrier(4)
+    acks = {}
+
+    def produce(user_id):
+        orders = [("TECH", user_id, "bid" if (user_id + i) % 2 else "ask", "limit", 1 + i % 7, 95.0 + (user_id * 7 + i) % 11)
+                  for i in range(200)]
+        start.wait()
+        futures = [gateway.submit("order", *order) for order in orders]
+        acks[user_id] = [(future.result(5), order) for future, order in zip(futures, orders)]
+
+    threads = [threading.Thread(target=produce, args=(user_id,)) for user_id in range(1, 5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gateway.close()
+
+    for user_acks in acks.values():
+        order_ids = [order_id for (_, _, order_id), _ in user_acks]
+        assert order_ids == sorted(order_ids)
+    applied = sorted((ack for user_acks in acks.values() for ack in user_acks), key=lambda ack: ack[0][2])
+    replayed = new_exchange()
+    assert [replayed.place_order(*order) for _, order in applied] == [result for result, _ in applied]
+    assert replayed.snapshot() == gateway.exchange.snapshot()
+
+def test_full_queue_refuses_without_blocking_queued_commands(gateway):
+    running, release = threading.Event(), threading.Event()
+    blocker = gateway.call(lambda: running.set() or release.wait(5))
+    running.wait(5)
+    # Offered to the queue in submission order once the sequencer lets go of the loop
+    queued = [gateway.submit("order", "TECH", 1, "bid", "limit", 1, 99.0) for _ in range(4)]
+    refused = gateway.submit("order", "TECH", 1, "bid", "limit", 1, 99.0)
+    release.set()
+    assert blocker.result(5)
+    with pytest.raises(GatewayFull):
+        refused.result(5)
+    assert [future.result(5)[2] for future in queued] == [1, 2, 3, 4]
+    assert gateway.rejected_full == 1
+
+def test_commands_queued_before_a_switch_apply_to_the_old_exchange(gateway):
+    old, new = gateway.exchange, new_exchange()
+    before = gateway.submit("order", "TECH", 1, "bid", "limit", 5, 99.0)
+    gateway.use_exchange(new).result(5)
+    after = gateway.submit("order", "TECH", 2, "ask", "limit", 5, 101.0)
+    after.result(5)
+    assert old.get_order(before.result(5)[2]).user_id == 1
+    assert new.get_order(after.result(5)[2]).user_id == 2
+    assert new.get_highest_bid("TECH") is None and old.get_lowest_ask("TECH") is None
+    with pytest.raises(ValueError):
+        gateway.submit("place_order", "TECH", 1, "bid", "limit", 1, 99.0).result(5)
@@ -0,0 +1,65 @@
+import random
+import pytest
+from PnLEngine import PnLEngine
+
+def cell(engine, user_id, stock_id="TECH"):
+    """(position, cost basis, realized P&L) of one user in one stock."""
+    row, column = engine.user_index[user_id], engine.stock_index[stock_id]
+    return engine.positions[row, column], engine.costs[row, column], engine.realized[row, column]
+
+def test_realized_and_unrealized_across_long_short_and_zero():
+    engine = PnLEngine(user_capacity=1, stock_capacity=1) # grows as users and stocks arrive
+    steps = [
+        # (quantity bought by user 1 from user 2, price, expected position, cost, realized)
+        (10, 100, 10, 1_000, 0),
+        (10, 110, 20, 2_100, 0), # average cost 105
+        (-5, 120, 15, 1_575, 75), # sells 5 at 15 over average
+        (-25, 90, -10, -900, -150), # closes 15 at 15 under average, opens 10 short at 90
+        (4, 80, -6, -540, -110), # covers 4 of the short at 10 under its price
+        (6, 100, 0, 0, -170), # covers the rest at 10 over: flat, nothing left open
+        (3, 50, 3, 150, -170), # reopens long from zero
+    ]
+    for quantity, price, position, cost, realized in steps:
+        if quantity > 0:
+            engine.on_trade("TECH", price, quantity, 1, 2)
+        else:
+            engine.on_trade("TECH", price, -quantity, 2, 1)
+        assert cell(engine, 1) == pytest.approx((position, cost, realized))
+        assert cell(engine, 2) == pytest.approx((-position, -cost, -realized))
+    values = engine.revalue({"TECH": 60})
+    assert values["unrealized"].tolist() == pytest.approx([30, -30])
+    assert values["total"].tolist() == pytest.approx([-140, 140])
+    assert engine.revalue()["unrealized"].tolist() == pytest.approx([0, 0]) # at the last fill, 50
+
+def naive_pnl(fills, user_id):
+    """(position, average cost, realized) of a user from the fills, one share at a time."""
+    position, average, realized = 0, 0.0, 0.0
+    for _, price, quantity, buyer_id, seller_id in fills:
+        step = 1 if buyer_id == user_id else -1 if seller_id == user_id else 0
+        for _ in range(quantity if step else 0):
+            if position and (position > 0) != (step > 0):
+                realized += (price - average) * -step
+                position += step
+                if not position:
+                    average = 0.0
+            else:
+                average = (average * abs(position) + price) / (abs(position) + 1)
+                position += step
+    return position, average, realized
+
+def test_random_fills_match_share_by_share_accounting():
+    rng = random.Random(9)
+    engine = PnLEngine(user_capacity=2, stock_capacity=1)
+    fills = []
+    for _ in range(2_000):
+        buyer, seller = rng.sample(range(1, 7), 2)
+        fill = (rng.choice(["A", "B"]), round(rng.uniform(90, 110), 2), rng.randint(1, 30), buyer, seller)
+        fills.append(fill)
+        engine.on_trade(*fill)
+    for stock_id in ("A", "B"):
+        stock_fills = [fill for fill in fills if fill[0] == stock_id]
+        for user_id in range(1, 7):
+            position, average, realized = naive_pnl(stock_fills, user_id)
+            assert cell(engine, user_id, stock_id) == pytest.approx((position, average * position, realized))
+    # Every fill is zero-sum, so total P&L over all users is zero at any prices
+    assert engine.revalue({"A": 95, "B": 130})["total"].sum() == pytest.approx(0, abs=1e-6)
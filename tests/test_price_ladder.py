@@ -0,0 +1,39 @@
+import random
+import pytest
+from PriceLadder import DenseLadder, PriceLevel, SortedLadder
+
+@pytest.mark.parametrize("side", ["bid", "ask"])
+def test_dense_ladder_matches_sorted_ladder(side):
+    """Random inserts and deletes, including far jumps that re-centre the window, agree with the SortedDict ladder."""
+    rng = random.Random(5)
+    dense, reference = DenseLadder(side, capacity=16), SortedLadder(side)
+    centre = 1_000
+    for step in range(5_000):
+        if step % 500 == 0:
+            centre += rng.choice([-1, 1]) * rng.randint(50, 5_000)
+        if reference and rng.random() < 0.45:
+            tick = rng.choice(list(reference.keys()))
+            assert dense.pop(tick) is reference.pop(tick)
+        else:
+            tick = max(centre + rng.randint(-40, 40), 1)
+            assert dense.setdefault(tick) is reference.setdefault(tick, dense[tick])
+        assert len(dense) == len(reference)
+        assert dense.best_tick() == reference.best_tick()
+        if step % 50 == 0:
+            assert dense.items() == list(reference.items())
+            assert dense.top(5) == reference.top(5)
+
+def test_dense_ladder_window_follows_the_live_span():
+    ladder = DenseLadder("ask", capacity=16)
+    for tick in range(100, 1_100, 10):
+        ladder.setdefault(tick)
+    assert len(ladder._levels) >= 2 * 1_000
+    for tick in range(100, 1_100, 10):
+        del ladder[tick]
+    assert len(ladder._levels) == 16 and ladder.best_tick() is None
+    # A narrow book far from the old one fits the initial window again
+    for tick in range(50_000, 50_006):
+        ladder.setdefault(tick)
+    assert len(ladder._levels) == 16
+    assert ladder.keys() == list(range(50_000, 50_006))
+    assert isinstance(ladder.best()[1], PriceLevel)
@@ -0,0 +1,31 @@
+import pytest
+import market_visualizer as mv
+
+@pytest.fixture
+def admin(monkeypatch):
+    mv.initialize_market()
+    monkeypatch.setitem(mv.SERVER_SETTINGS, "admin_token", "admin-token")
+    return {"Authorization": "Bearer admin-token"}
+
+def test_profiling_is_refused_without_an_admin_token(monkeypatch):
+    monkeypatch.setitem(mv.SERVER_SETTINGS, "admin_token", None)
+    http = mv.app.test_client()
+    for route in ("/api/profile/start", "/api/profile/stop"):
+        assert http.post(route, headers={"Authorization": "Bearer None"}).status_code == 403
+    assert http.get("/api/profile/download").status_code == 403
+    client = mv.socketio.test_client(mv.app)
+    assert client.emit("start_profiling", {}, callback=True)["status"] == "rejected"
+
+def test_only_the_admin_can_profile(admin):
+    http = mv.app.test_client()
+    assert http.post("/api/profile/start").status_code == 401
+    assert http.post("/api/profile/start", headers={"Authorization": "Bearer guess"}).status_code == 401
+    assert mv.socketio.test_client(mv.app).emit("start_profiling", {}, callback=True)["status"] == "rejected"
+    assert http.post("/api/profile/start?mode=sampling", headers=admin).status_code == 200
+    assert http.post("/api/profile/stop", headers=admin).status_code == 200
+    assert http.get("/api/profile/download", headers=admin).status_code == 200
+
+def test_admin_socket_client_can_profile(admin):
+    client = mv.socketio.test_client(mv.app, auth={"token": "admin-token"})
+    assert client.emit("start_profiling", {"mode": "sampling"}, callback=True)["status"] == "started"
+    assert client.emit("stop_profiling", callback=True)["status"] == "stopped"
@@ -0,0 +1,59 @@
+import pytest
+from ShardedExchange import ShardedExchange, shard_of
+from StockExchange import StockExchange
+
+STOCK_IDS = [f"S{i}" for i in range(6)]
+
+def seed(exchange):
+    for stock_id in STOCK_IDS:
+        exchange.ipo_stock(stock_id, 1_000, 100)
+    for user_id in (1, 2):
+        exchange.add_user(user_id, 10_000)
+    for stock_id in STOCK_IDS:
+        exchange.transfer_stock(0, 1, stock_id, 100)
+    return exchange
+
+@pytest.fixture(params=["dict", "compact"])
+def sharded(request):
+    with ShardedExchange(num_shards=3, ledger=request.param, credit_chunk=100.0) as exchange:
+        yield seed(exchange)
+
+def test_orders_route_to_their_stock_shard_and_match_one_exchange(sharded):
+    """A batch spread over shards fills like the same orders on one exchange and encodes the shard in each order ID."""
+    single = seed(StockExchange())
+    batch = {
+        "stock": STOCK_IDS * 2,
+        "user": [1] * 6 + [2] * 6,
+        "side": [1] * 6 + [0] * 6,
+        "type": [1] * 12,
+        "qty": [10] * 12,
+        "price": [101.0] * 6 + [101.0, 102.0, 100.0, 101.5, 101.0, 99.0],
+    }
+    results, expected = sharded.place_orders(batch), single.place_orders(batch)
+    assert results["filled"].tolist() == expected["filled"].tolist()
+    assert results["value"].tolist() == pytest.approx(expected["value"].tolist())
+    assert [order_id % 3 for order_id in results["order_id"][:6]] == [shard_of(stock_id, 3) for stock_id in STOCK_IDS]
+    assert sharded.get_user_balance(2) == pytest.approx(single.get_user_balance(2))
+    assert sharded.verify_conservation()
+
+def test_first_market_bid_on_a_stock_is_funded(sharded):
+    """A market bid before the coordinator has seen any ask for the stock still gets credit for it."""
+    sharded.place_order("S0", 1, "ask", "limit", 10, 100)
+    sharded.ask_hints.clear()
+    filled, value, _ = sharded.place_order("S0", 2, "bid", "market", 5)
+    assert (filled, value) == (5, pytest.approx(500))
+    assert sharded.verify_conservation()
+
+def test_worker_errors_are_raised_in_the_coordinator_and_the_shard_keeps_serving(sharded):
+    with pytest.raises(ValueError):
+        sharded.place_order("S1", 2, "ask", "limit", 10, 100)
+    with pytest.raises(TypeError):
+        sharded.transfer_stock(1, 2, "S1", None)
+    assert sharded.get_lowest_ask("S1") is None
+
+def test_user_reads_are_plain_dicts(sharded):
+    sharded.place_order("S2", 1, "ask", "limit", 30, 105)
+    assert sharded.get_user_portfolio(1) == {**{stock_id: 100 for stock_id in STOCK_IDS}, "S2": 70}
+    balance, holdings = sharded.get_user_reserved(1)
+    assert (balance, holdings) == (0, {"S2": 30})
+    assert type(holdings) is dict
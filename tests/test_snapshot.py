@@ -0,0 +1,58 @@
+import random
+import pytest
+from StockExchange import StockExchange
+
+def book(exchange):
+    """Every resting order per stock, side and tick, in queue order."""
+    return {(stock_id, side): [(tick, [(order.order_id, order.user_id, order.quantity) for order in level.values()])
+                               for tick, level in exchange.stocks[stock_id][side].items()]
+            for stock_id in exchange.stocks for side in ("bids", "asks")}
+
+def ledger(exchange):
+    users = sorted(exchange.users_balances)
+    return [(user_id, exchange.get_user_balance(user_id), dict(exchange.get_user_portfolio(user_id)),
+             exchange.get_user_reserved(user_id)[0], dict(exchange.get_user_reserved(user_id)[1])) for user_id in users]
+
+def trade(exchange, seed, count):
+    rng = random.Random(seed)
+    results = []
+    for _ in range(count):
+        try:
+            results.append(exchange.place_order(rng.choice(["A", "B"]), rng.randint(1, 8), rng.choice(("bid", "ask")),
+                                                "limit" if rng.random() < 0.85 else "market", rng.randint(1, 15),
+                                                round(rng.uniform(95, 105), 2)))
+        except ValueError as error:
+            results.append(str(error))
+    return results
+
+@pytest.fixture
+def traded():
+    exchange = StockExchange()
+    exchange.ipo_stock("A", 5_000, 100.0)
+    exchange.ipo_stock("B", 5_000, 100.0, tick_size=0.05, ladder="dense")
+    for user_id in range(1, 9):
+        exchange.add_user(user_id, 20_000)
+        for stock_id in ("A", "B"):
+            exchange.transfer_stock(0, user_id, stock_id, 200)
+    trade(exchange, 1, 400)
+    return exchange
+
+@pytest.mark.parametrize("ledger_mode", ["dict", "compact"])
+@pytest.mark.parametrize("from_file", [False, True])
+def test_restore_round_trips_books_and_ledger(traded, tmp_path, ledger_mode, from_file):
+    """A restored exchange holds the same queues and ledger, and trades on exactly like the original."""
+    if from_file:
+        source = str(tmp_path / "exchange.snapshot")
+        traded.snapshot(source)
+    else:
+        source = traded.snapshot()
+    restored = StockExchange.restore(source, ledger=ledger_mode)
+
+    assert book(restored) == book(traded)
+    assert ledger(restored) == ledger(traded)
+    assert restored.last_traded_prices == traded.last_traded_prices
+    assert restored.verify_conservation()
+    assert restored.snapshot() == traded.snapshot()
+    # Same order IDs, fills and rejections from here on
+    assert trade(restored, 2, 200) == trade(traded, 2, 200)
+    assert book(restored) == book(traded)
@@ -0,0 +1,80 @@
+import random
+import threading
+import pytest
+from StockExchange import StockExchange
+
+STOCK_IDS = [f"S{i}" for i in range(4)]
+NUM_TRADERS = 50
+
+def new_exchange(ledger):
+    exchange = StockExchange(ledger=ledger)
+    for stock_id in STOCK_IDS:
+        exchange.ipo_stock(stock_id, NUM_TRADERS * 500, 100)
+    for user_id in range(1, NUM_TRADERS + 1):
+        exchange.add_user(user_id, 50_000)
+        for stock_id in STOCK_IDS:
+            exchange.transfer_stock(0, user_id, stock_id, 500)
+    return exchange
+
+@pytest.mark.parametrize("ledger", ["dict", "compact"])
+def test_concurrent_trading_conserves_money_and_shares(ledger):
+    """Threads placing, cancelling and amending orders and moving cash on shared stocks and users keep the exchange consistent."""
+    exchange = new_exchange(ledger)
+    start = threading.Barrier(6)
+    errors = []
+
+    def trade(seed):
+        rng = random.Random(seed)
+        placed = []
+        start.wait()
+        for _ in range(3_000):
+            action = rng.random()
+            try:
+                if action < 0.75 or not placed:
+                    placed.append(exchange.place_order(rng.choice(STOCK_IDS), rng.randint(1, NUM_TRADERS), rng.choice(("bid", "ask")),
+                                                       "limit" if rng.random() < 0.8 else "market", rng.randint(1, 20), rng.uniform(95, 105))[2])
+                elif action < 0.85:
+                    exchange.cancel_order(placed.pop(rng.randrange(len(placed))))
+                elif action < 0.9:
+                    exchange.amend_order(rng.choice(placed), rng.randint(1, 30))
+                elif action < 0.95:
+                    exchange.transfer_money(rng.randint(1, NUM_TRADERS), rng.randint(1, NUM_TRADERS), rng.uniform(1, 100))
+                else:
+                    size = rng.randint(1, 20)
+                    exchange.place_orders({
+                        "stock": [rng.choice(STOCK_IDS) for _ in range(size)],
+                        "user": [rng.randint(1, NUM_TRADERS) for _ in range(size)],
+                        "side": [rng.randint(0, 1) for _ in range(size)],
+                        "type": [1] * size,
+                        "qty": [rng.randint(1, 20) for _ in range(size)],
+                        "price": [rng.uniform(95, 105) for _ in range(size)],
+                    })
+            except ValueError:
+                pass # unfunded, or the order already filled or was cancelled
+            except Exception as error:
+                errors.append(error)
+
+    threads = [threading.Thread(target=trade, args=(seed,)) for seed in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert exchange.trade_count > 0
+    assert exchange.conservation_problems() == []
+    assert exchange.verify_conservation()
+
+def test_verify_conservation_catches_a_broken_ledger():
+    exchange = new_exchange("dict")
+    exchange.place_order("S0", 1, "bid", "limit", 10, 90)
+    assert exchange.verify_conservation()
+    exchange.reserved_balances[1] -= 100
+    exchange.users_balances[1] += 100
+    assert not exchange.verify_conservation()
+    assert exchange.conservation_problems() == ["user 1 reserved cash does not match resting bids"]
+
+def test_restored_exchange_conserves_the_snapshot():
+    exchange = new_exchange("dict")
+    exchange.place_order("S0", 1, "bid", "limit", 10, 90)
+    assert StockExchange.restore(exchange.snapshot()).verify_conservation()
@@ -0,0 +1,51 @@
+import math
+import random
+import numpy as np
+import pytest
+from TradeTape import TradeTape
+
+def record(tape, fills, stock_id="TECH"):
+    for price, quantity in fills:
+        tape.on_trade(stock_id, price, quantity, 1, 2, "bid")
+
+def random_fills(seed, count):
+    rng = random.Random(seed)
+    return [(round(rng.uniform(95, 105), 2), rng.randint(1, 50)) for _ in range(count)]
+
+def test_stats_match_a_naive_pass_over_the_window():
+    """Windowed stats from the running totals agree with summing the window's fills directly, across ring wraps."""
+    clock = [0.0]
+    tape = TradeTape(capacity=64, chunk_size=16, flush_size=5, clock=lambda: clock[0])
+    fills = random_fills(1, 300)
+    for i, fill in enumerate(fills):
+        clock[0] = float(i)
+        record(tape, [fill])
+    for window in (0.5, 10, 40, 63.5):
+        window_fills = [fill for i, fill in enumerate(fills) if i > 299 - window]
+        stats = tape.stats("TECH", window, now=299)
+        volume = sum(quantity for _, quantity in window_fills)
+        returns = [math.log(b[0] / a[0]) for a, b in zip(window_fills, window_fills[1:])]
+        assert stats["trades"] == len(window_fills)
+        assert stats["volume"] == volume
+        assert stats["vwap"] == pytest.approx(sum(price * quantity for price, quantity in window_fills) / volume)
+        assert stats["last_price"] == fills[-1][0]
+        assert stats["realized_volatility"] == pytest.approx(math.sqrt(sum(r * r for r in returns)), abs=1e-9)
+    assert tape.count("TECH") == 300
+    assert np.concatenate(tape.segments("TECH"))["price"].tolist() == [price for price, _ in fills[-64:]]
+
+def test_spill_file_keeps_every_row_once_across_close_and_new_tapes(tmp_path):
+    fills = random_fills(2, 100)
+    tape = TradeTape(capacity=32, chunk_size=8, flush_size=3, spill_dir=str(tmp_path))
+    record(tape, fills[:37])
+    tape.close() # spills the partial chunk
+    record(tape, fills[37:60]) # completes that chunk without writing its start again
+    tape.close()
+    assert tape.spilled("TECH")["price"].tolist() == [price for price, _ in fills[:60]]
+
+    # A new tape (as after a market reset) appends instead of truncating
+    second = TradeTape(capacity=32, chunk_size=8, flush_size=3, spill_dir=str(tmp_path))
+    record(second, fills[60:])
+    second.close()
+    assert second.spilled("TECH")["price"].tolist() == [price for price, _ in fills[60:]]
+    on_disk = np.fromfile(tmp_path / "TECH.tape", dtype=tape.spilled("TECH").dtype)
+    assert on_disk["price"].tolist() == [price for price, _ in fills]